@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Appointment, TimeBlock, NotificationSubscription, AppointmentNotification, ClientToken
+from django.utils import timezone
+from .models import Appointment, TimeBlock, NotificationSubscription, AppointmentNotification, ClientToken, PushOutbox
 
 
 @admin.register(Appointment)
@@ -34,3 +35,19 @@ class AppointmentNotificationAdmin(admin.ModelAdmin):
 class ClientTokenAdmin(admin.ModelAdmin):
     list_display = ('token', 'created_at', 'last_seen_at')
     search_fields = ('token',)
+
+
+@admin.register(PushOutbox)
+class PushOutboxAdmin(admin.ModelAdmin):
+    list_display = ('token', 'title', 'status', 'attempts', 'last_error', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'last_error')
+    search_fields = ('token', 'title')
+    date_hierarchy = 'created_at'
+    actions = ['requeue']
+
+    @admin.action(description='Reenfileirar envios selecionados')
+    def requeue(self, request, queryset):
+        count = queryset.exclude(status=PushOutbox.STATUS_SENT).update(
+            status=PushOutbox.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now(), last_error='',
+        )
+        self.message_user(request, f'{count} envio(s) reenfileirado(s).')
@@ -0,0 +1,50 @@
+"""Sincronização incremental (GET /api/appointments/changes/).
+
+O cursor é opaco para o cliente: um instante do servidor codificado em
+base64. Cada chamada devolve o que mudou desde esse instante (updated_at de
+Appointment/TimeBlock e Tombstone das exclusões) e um novo cursor tirado antes
+das consultas. Como updated_at é preenchido antes do commit, a busca recua
+CHANGES_OVERLAP para não perder transações que terminam depois do cursor ser
+emitido; o cliente aplica as linhas como upsert, então repetições não fazem mal.
+"""
+import base64
+import binascii
+import datetime
+
+from django.utils import timezone
+
+from .models import Appointment, TimeBlock, Tombstone
+
+CHANGES_OVERLAP = datetime.timedelta(seconds=5)
+# Tombstones mais antigos são expurgados (audit.maintenance.monthly_purge_if_due);
+# cursores anteriores a isso exigem recarga completa
+CHANGES_RETENTION = datetime.timedelta(days=30)
+
+
+def encode_token(moment):
+    return base64.urlsafe_b64encode(moment.isoformat().encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    """Instante do cursor; ValueError se inválido."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        moment = datetime.datetime.fromisoformat(raw)
+    except (binascii.Error, UnicodeDecodeError) as exc:
+        raise ValueError('cursor inválido') from exc
+    if timezone.is_naive(moment):
+        raise ValueError('cursor inválido')
+    return moment
+
+
+def changes_since(since, barber_id=None):
+    """(agendamentos, bloqueios, tombstones) alterados desde `since`, já com a folga de CHANGES_OVERLAP."""
+    cutoff = since - CHANGES_OVERLAP
+    appointments = Appointment.objects.filter(updated_at__gte=cutoff).with_effective_status().order_by('updated_at', 'id')
+    blocks = TimeBlock.objects.filter(updated_at__gte=cutoff).order_by('updated_at', 'id')
+    tombstones = Tombstone.objects.filter(deleted_at__gte=cutoff).order_by('deleted_at', 'id')
+    if barber_id:
+        appointments = appointments.filter(barber_id=barber_id)
+        blocks = blocks.filter(barber_id=barber_id)
+        tombstones = tombstones.filter(barber_id=barber_id)
+    return appointments, blocks, tombstones
@@ -37,7 +37,7 @@ def _ensure_firebase():
         return False
 
 
-from typing import Optional, Dict
+from typing import Dict, Iterable, List, Optional, Tuple
 
 def send_push(token: str, title: str, body: str, data: Optional[Dict] = None) -> bool:
     """Envia notificação push via FCM. Retorna True se enviado, False caso contrário."""
@@ -52,4 +52,58 @@ def send_push(token: str, title: str, body: str, data: Optional[Dict] = None) ->
         messaging.send(msg)
         return True
     except Exception:
-        return False
\ No newline at end of file
+        return False
+
+# Resultado por token de send_push_batch/send_push_many
+PUSH_SENT = 'sent'
+PUSH_UNREGISTERED = 'unregistered'  # token morto: pode ser removido
+PUSH_INVALID = 'invalid'            # token malformado (INVALID_ARGUMENT)
+PUSH_RETRYABLE = 'retryable'        # falha temporária do FCM: tentar de novo mais tarde
+PUSH_FAILED = 'failed'              # FCM indisponível/não configurado ou erro permanente
+
+FCM_BATCH_SIZE = 500  # limite do FCM por chamada send_each
+_RETRYABLE_CODES = {'UNAVAILABLE', 'INTERNAL', 'RESOURCE_EXHAUSTED', 'DEADLINE_EXCEEDED', 'UNKNOWN'}
+
+
+def _classify(exc) -> str:
+    if isinstance(exc, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+        return PUSH_UNREGISTERED
+    if getattr(exc, 'code', None) in _RETRYABLE_CODES:
+        return PUSH_RETRYABLE
+    if getattr(exc, 'code', None) == 'INVALID_ARGUMENT':
+        return PUSH_INVALID
+    return PUSH_FAILED
+
+
+def send_push_batch(items: Iterable[Tuple[str, str, str, Optional[Dict]]]) -> List[str]:
+    """Envia várias mensagens (token, título, corpo, data) com messaging.send_each,
+    em lotes de até FCM_BATCH_SIZE. Retorna um resultado PUSH_* por item, na ordem."""
+    items = list(items)
+    if not items:
+        return []
+    if not _ensure_firebase():
+        return [PUSH_FAILED] * len(items)
+    results = []
+    for i in range(0, len(items), FCM_BATCH_SIZE):
+        chunk = items[i:i + FCM_BATCH_SIZE]
+        msgs = [
+            messaging.Message(
+                token=token,
+                notification=messaging.Notification(title=title, body=body),
+                data={**(data or {})},
+            )
+            for token, title, body, data in chunk
+        ]
+        try:
+            batch = messaging.send_each(msgs)
+        except Exception:
+            # Falha do lote inteiro (rede, autenticação): nada foi confirmado
+            results.extend([PUSH_RETRYABLE] * len(chunk))
+            continue
+        results.extend(PUSH_SENT if r.success else _classify(r.exception) for r in batch.responses)
+    return results
+
+
+def send_push_many(tokens: Iterable[str], title: str, body: str, data: Optional[Dict] = None) -> List[str]:
+    """Mesma notificação para vários tokens; resultado PUSH_* por token, na ordem."""
+    return send_push_batch((token, title, body, data) for token in tokens)
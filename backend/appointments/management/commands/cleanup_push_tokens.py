@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from appointments.push_tokens import PRUNE_BATCH_SIZE, expire_stale_tokens
+
+
+class Command(BaseCommand):
+    help = 'Apaga (em lotes) os tokens FCM não vistos há mais de --days dias e suas inscrições.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PUSH_TOKEN_TTL_DAYS, help='Idade máxima desde a última inscrição (dias)')
+        parser.add_argument('--batch-size', type=int, default=PRUNE_BATCH_SIZE, help='Tokens apagados por transação')
+
+    def handle(self, *args, **options):
+        count = expire_stale_tokens(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Tokens expirados: {count}'))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from appointments.reminders import Scheduler
+
+
+class Command(BaseCommand):
+    help = 'Daemon de lembretes push: envia cada ScheduledNotification no horário exato.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Envia o que já venceu e sai')
+
+    def handle(self, *args, **options):
+        scheduler = Scheduler()
+        while True:
+            try:
+                count = scheduler.run_once()
+                if count:
+                    self.stdout.write(self.style.SUCCESS(f'Notificações enviadas: {count}'))
+                if options['once']:
+                    return
+                scheduler.wait(timezone.now())
+            except Exception as e:
+                if options['once']:
+                    raise
+                self.stderr.write(f'Falha no agendador: {e}')
+                scheduler.reset_connection()
+                time.sleep(5)
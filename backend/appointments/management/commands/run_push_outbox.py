@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from appointments.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = 'Worker da fila de push (PushOutbox): entrega em lotes, com novas tentativas e backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Entrega o que já venceu e sai')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            try:
+                counts = deliver_batch()
+                if counts['claimed']:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Push: {counts['sent']} enviados, {counts['retry']} para nova tentativa, {counts['dead']} falharam, "
+                        f"{counts['pruned']} tokens removidos"
+                    ))
+            except Exception as e:
+                if options['once']:
+                    raise
+                self.stderr.write(f'Falha na entrega de push: {e}')
+                counts = {'claimed': 0}
+            # Lote cheio: provavelmente há mais vencidos, segue sem dormir
+            if counts['claimed'] >= settings.PUSH_OUTBOX_BATCH_SIZE:
+                continue
+            if options['once']:
+                return
+            time.sleep(settings.PUSH_OUTBOX_POLL_SECONDS)
@@ -1,161 +1,79 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from appointments.models import Appointment, NotificationSubscription, AppointmentNotification
-from appointments.fcm import send_push
+from appointments.models import Appointment, NotificationSubscription, AppointmentNotification, PushOutbox
+from appointments.reminders import alert_0_message, alert_15_message, confirmation_message, greeting_30_message
 import datetime
 
 
 class Command(BaseCommand):
     help = 'Envio de notificações push para agendamentos: Confirmação, 30 min, 15 min, Na hora.'
+    # Modo cron (a cada minuto). Com o daemon run_notification_scheduler em
+    # execução, não agende este comando: os dois enviariam o mesmo lembrete.
 
     def handle(self, *args, **options):
         now = timezone.now()
-        # Janela de 1 min para capturar eventos, assumindo execução frequente
-        
-        # 0. Confirmação (30s após criação)
-        # Buscar agendamentos criados entre 30s e 5 min atrás (margem de segurança)
-        # e que AINDA NÃO tenham recebido notificação de confirmação.
-        confirm_threshold = now - datetime.timedelta(seconds=30)
-        confirm_limit = now - datetime.timedelta(minutes=5)
-        
-        appts_confirm = Appointment.objects.filter(
-            status=Appointment.STATUS_SCHEDULED,
-            created_at__lte=confirm_threshold,
-            created_at__gte=confirm_limit
-        )
-
-        # Janelas de tempo para lembretes
-        # Usamos uma janela de 1 minuto para frente para pegar o momento exato
-        # Execução recomendada: a cada 1 minuto (cron ou loop)
-        
-        # 30 minutos antes
-        window_30_start = now + datetime.timedelta(minutes=30)
-        window_30_end = now + datetime.timedelta(minutes=31)
-        
-        # 15 minutos antes
-        window_15_start = now + datetime.timedelta(minutes=15)
-        window_15_end = now + datetime.timedelta(minutes=16)
-
-        # Na hora (0 a 1 min antes)
-        window_0_start = now
-        window_0_end = now + datetime.timedelta(minutes=1)
+        # Execução recomendada: a cada 1 minuto (cron ou loop). Cada lembrete
+        # olha uma janela de 1 minuto à frente para pegar o momento exato.
+        #
+        # (tipo, campo, início, fim, mensagem). A confirmação vale para
+        # agendamentos criados entre 5 min e 30 s atrás (margem de segurança).
+        reminders = [
+            (AppointmentNotification.TYPE_CONFIRMATION, 'created_at',
+             now - datetime.timedelta(minutes=5), now - datetime.timedelta(seconds=30), confirmation_message),
+            (AppointmentNotification.TYPE_GREETING_30, 'start_datetime',
+             now + datetime.timedelta(minutes=30), now + datetime.timedelta(minutes=31), greeting_30_message),
+            (AppointmentNotification.TYPE_ALERT_15, 'start_datetime',
+             now + datetime.timedelta(minutes=15), now + datetime.timedelta(minutes=16), alert_15_message),
+            (AppointmentNotification.TYPE_ALERT_0, 'start_datetime',
+             now, now + datetime.timedelta(minutes=1), alert_0_message),
+        ]
 
-        # Queries
-        appts_30 = Appointment.objects.filter(
-            status=Appointment.STATUS_SCHEDULED,
-            start_datetime__gte=window_30_start,
-            start_datetime__lt=window_30_end,
+        # Uma passada para todos os tipos: agendamentos das janelas, depois os
+        # tipos já enviados e os tokens de todos eles de uma vez.
+        windows = Q()
+        for _type, field, beg, end, _message in reminders:
+            if field == 'created_at':
+                windows |= Q(created_at__gte=beg, created_at__lte=end)
+            else:
+                windows |= Q(**{f'{field}__gte': beg, f'{field}__lt': end})
+        appts = list(
+            Appointment.objects.filter(windows, status=Appointment.STATUS_SCHEDULED)
+            .select_related('barber', 'service')
         )
-        appts_15 = Appointment.objects.filter(
-            status=Appointment.STATUS_SCHEDULED,
-            start_datetime__gte=window_15_start,
-            start_datetime__lt=window_15_end,
+        if not appts:
+            return
+        ids = [a.id for a in appts]
+        already_sent = set(
+            AppointmentNotification.objects.filter(appointment_id__in=ids).values_list('appointment_id', 'type')
         )
-        appts_0 = Appointment.objects.filter(
-            status=Appointment.STATUS_SCHEDULED,
-            start_datetime__gte=window_0_start,
-            start_datetime__lt=window_0_end,
-        )
-
-        sent_count = 0
-
-        # --- PROCESSAMENTO CONFIRMAÇÃO ---
-        for appt in appts_confirm:
-            if AppointmentNotification.objects.filter(appointment=appt, type=AppointmentNotification.TYPE_CONFIRMATION).exists():
-                continue
-            subs = NotificationSubscription.objects.filter(appointment=appt)
-            if not subs.exists():
-                continue
-            
-            barber_name = getattr(appt.barber, 'display_name', None) or getattr(appt.barber, 'username', '')
-            service_title = getattr(appt.service, 'title', '')
-            start_local = timezone.localtime(appt.start_datetime).strftime('%d/%m às %H:%M')
-            
-            title = '✅ Agendamento Confirmado!'
-            body = f'Tudo certo! Seu horário para {service_title} com {barber_name} está confirmado para {start_local}.'
-            data = {'type': 'confirmation', 'appointmentId': str(appt.id)}
-            
-            any_sent = False
-            for s in subs:
-                if send_push(s.token, title, body, data):
-                    any_sent = True
-            
-            if any_sent:
-                AppointmentNotification.objects.create(appointment=appt, type=AppointmentNotification.TYPE_CONFIRMATION)
-                sent_count += 1
-
-        # --- PROCESSAMENTO 30 MIN ---
-        for appt in appts_30:
-            if AppointmentNotification.objects.filter(appointment=appt, type=AppointmentNotification.TYPE_GREETING_30).exists():
-                continue
-            subs = NotificationSubscription.objects.filter(appointment=appt)
-            if not subs.exists():
-                continue
-                
-            barber_name = getattr(appt.barber, 'display_name', None) or getattr(appt.barber, 'username', '')
-            service_title = getattr(appt.service, 'title', '')
-            start_local = timezone.localtime(appt.start_datetime).strftime('%H:%M')
-            
-            title = f'Lembrete: {service_title} às {start_local}'
-            body = f'Olá! {barber_name} te espera para {service_title} em 30 minutos.'
-            data = {'type': 'greeting_30', 'appointmentId': str(appt.id), 'service': service_title}
-            
-            any_sent = False
-            for s in subs:
-                if send_push(s.token, title, body, data):
-                    any_sent = True
-            
-            if any_sent:
-                AppointmentNotification.objects.create(appointment=appt, type=AppointmentNotification.TYPE_GREETING_30)
-                sent_count += 1
-
-        # --- PROCESSAMENTO 15 MIN ---
-        for appt in appts_15:
-            if AppointmentNotification.objects.filter(appointment=appt, type=AppointmentNotification.TYPE_ALERT_15).exists():
-                continue
-            subs = NotificationSubscription.objects.filter(appointment=appt)
-            if not subs.exists():
-                continue
-
-            barber_name = getattr(appt.barber, 'display_name', None) or getattr(appt.barber, 'username', '')
-            service_title = getattr(appt.service, 'title', '')
-            
-            title = f'⏰ 15 minutos para seu corte!'
-            body = f'Seu horário com {barber_name} é daqui a pouco. Estamos te aguardando!'
-            data = {'type': 'alert_15', 'appointmentId': str(appt.id), 'service': service_title}
-            
-            any_sent = False
-            for s in subs:
-                if send_push(s.token, title, body, data):
-                    any_sent = True
-            
-            if any_sent:
-                AppointmentNotification.objects.create(appointment=appt, type=AppointmentNotification.TYPE_ALERT_15)
-                sent_count += 1
-
-        # --- PROCESSAMENTO NA HORA (0 MIN) ---
-        for appt in appts_0:
-            if AppointmentNotification.objects.filter(appointment=appt, type=AppointmentNotification.TYPE_ALERT_0).exists():
-                continue
-            subs = NotificationSubscription.objects.filter(appointment=appt)
-            if not subs.exists():
-                continue
+        tokens = {}
+        for appt_id, token in NotificationSubscription.objects.filter(appointment_id__in=ids).values_list('appointment_id', 'token'):
+            tokens.setdefault(appt_id, []).append(token)
 
-            barber_name = getattr(appt.barber, 'display_name', None) or getattr(appt.barber, 'username', '')
-            service_title = getattr(appt.service, 'title', '')
-            
-            title = f'✂️ Chegou a hora!'
-            body = f'Seu horário para {service_title} com {barber_name} é agora. Bom corte!'
-            data = {'type': 'alert_0', 'appointmentId': str(appt.id), 'service': service_title}
-            
-            any_sent = False
-            for s in subs:
-                if send_push(s.token, title, body, data):
-                    any_sent = True
-            
-            if any_sent:
-                AppointmentNotification.objects.create(appointment=appt, type=AppointmentNotification.TYPE_ALERT_0)
-                sent_count += 1
+        # Mensagens vão para a fila de push (appointments/outbox.py), que faz
+        # as novas tentativas; enfileirado conta como enviado.
+        outbox = []
+        sent = {}
+        for type_, field, beg, end, message in reminders:
+            for appt in appts:
+                value = getattr(appt, field)
+                in_window = beg <= value <= end if field == 'created_at' else beg <= value < end
+                if not in_window or (appt.id, type_) in already_sent or not tokens.get(appt.id):
+                    continue
+                title, body, data = message(appt)
+                outbox.extend(
+                    PushOutbox(token=token, title=title, body=body, data=data, appointment=appt)
+                    for token in tokens[appt.id]
+                )
+                sent[(appt.id, type_)] = AppointmentNotification(appointment=appt, type=type_)
+        sent = list(sent.values())
 
-        if sent_count > 0:
-            self.stdout.write(self.style.SUCCESS(f'Notificações enviadas: {sent_count}'))
+        # A constraint única (appointment, type) descarta registros de uma
+        # execução concorrente que tenha enviado o mesmo lembrete.
+        with transaction.atomic():
+            PushOutbox.objects.bulk_create(outbox)
+            AppointmentNotification.objects.bulk_create(sent, ignore_conflicts=True)
+        if sent:
+            self.stdout.write(self.style.SUCCESS(f'Notificações enfileiradas: {len(sent)}'))
@@ -1,9 +1,8 @@
 from django.core.management.base import BaseCommand
-from appointments.models import ClientToken
-from appointments.fcm import send_push
+from appointments.models import ClientToken, PushOutbox
 
 class Command(BaseCommand):
-    help = 'Envia notificação promocional para todos os dispositivos registrados.'
+    help = 'Enfileira notificação promocional para todos os dispositivos registrados.'
 
     def add_arguments(self, parser):
         parser.add_argument('title', type=str, help='Título da notificação')
@@ -12,12 +11,16 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         title = options['title']
         body = options['body']
-        tokens = ClientToken.objects.all()
+        # A entrega (lotes multicast, novas tentativas) é do worker run_push_outbox
         count = 0
-        self.stdout.write(f"Enviando para {tokens.count()} dispositivos...")
+        batch = []
+        for token in ClientToken.objects.values_list('token', flat=True).iterator(chunk_size=1000):
+            batch.append(PushOutbox(token=token, title=title, body=body))
+            if len(batch) >= 1000:
+                PushOutbox.objects.bulk_create(batch)
+                count += len(batch)
+                batch = []
+        PushOutbox.objects.bulk_create(batch)
+        count += len(batch)
 
-        for t in tokens:
-            if send_push(t.token, title, body):
-                count += 1
-        
-        self.stdout.write(self.style.SUCCESS(f'Sucesso: {count}/{tokens.count()} enviados.'))
+        self.stdout.write(self.style.SUCCESS(f'Enfileirado para {count} dispositivos.'))
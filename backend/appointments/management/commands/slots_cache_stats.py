@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from appointments.slot_cache import reset_stats, stats
+
+
+class Command(BaseCommand):
+    help = 'Mostra a taxa de acerto (aproximada) do cache de horários livres (available-slots/availability).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zera os contadores após exibir')
+
+    def handle(self, *args, **options):
+        s = stats()
+        self.stdout.write(f"Acertos: {s['hits']}  Erros: {s['misses']}  Taxa de acerto: {s['hit_ratio'] * 100:.1f}% (aproximado)")
+        if options['reset']:
+            reset_stats()
+            self.stdout.write('Contadores zerados.')
@@ -0,0 +1,90 @@
+"""Não sobreposição de agendamentos garantida pelo banco.
+
+Dois agendamentos 'scheduled' do mesmo barbeiro não podem se sobrepor
+considerando a folga de 5 minutos (mesma regra de Appointment.clean):
+[início, fim + 5 min) de um não pode cruzar o do outro.
+
+- Postgres: exclusion constraint GiST sobre (barber_id, tstzrange), parcial
+  em status = 'scheduled' (requer btree_gist). A soma timestamptz + interval
+  não é IMMUTABLE, por isso o intervalo é montado por uma função própria.
+- SQLite: triggers BEFORE INSERT/UPDATE que abortam a escrita. O SQLite
+  serializa escritores, então a verificação do trigger é atômica. As datas
+  são comparadas via datetime(), com precisão de segundos. Migrações que
+  recriam a tabela no SQLite (ex.: AddField NOT NULL) descartam os triggers
+  e precisam recriá-los (ver 0009).
+
+Dados já sobrepostos fazem a migração falhar no Postgres; resolva-os antes.
+"""
+from django.db import migrations
+
+CONSTRAINT = 'appointments_no_overlap'
+
+POSTGRES_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS btree_gist',
+    """
+    CREATE OR REPLACE FUNCTION appointments_busy_range(s timestamptz, e timestamptz)
+    RETURNS tstzrange LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT tstzrange(s, e + interval '5 minutes', '[)') $$
+    """,
+    f"""
+    ALTER TABLE appointments_appointment ADD CONSTRAINT {CONSTRAINT}
+    EXCLUDE USING gist (barber_id WITH =, appointments_busy_range(start_datetime, end_datetime) WITH &&)
+    WHERE (status = 'scheduled')
+    """,
+]
+
+POSTGRES_BACKWARD = [
+    f'ALTER TABLE appointments_appointment DROP CONSTRAINT IF EXISTS {CONSTRAINT}',
+    'DROP FUNCTION IF EXISTS appointments_busy_range(timestamptz, timestamptz)',
+]
+
+_SQLITE_CONFLICT = """
+    NEW.status = 'scheduled' AND EXISTS (
+        SELECT 1 FROM appointments_appointment a
+        WHERE a.barber_id = NEW.barber_id
+          AND a.status = 'scheduled'
+          AND a.id IS NOT NEW.id
+          AND datetime(a.start_datetime) < datetime(NEW.end_datetime, '+5 minutes')
+          AND datetime(a.end_datetime, '+5 minutes') > datetime(NEW.start_datetime)
+    )
+"""
+
+SQLITE_FORWARD = [
+    f"""
+    CREATE TRIGGER {CONSTRAINT}_insert BEFORE INSERT ON appointments_appointment
+    WHEN {_SQLITE_CONFLICT}
+    BEGIN SELECT RAISE(ABORT, '{CONSTRAINT}'); END
+    """,
+    f"""
+    CREATE TRIGGER {CONSTRAINT}_update
+    BEFORE UPDATE OF barber_id, start_datetime, end_datetime, status ON appointments_appointment
+    WHEN {_SQLITE_CONFLICT}
+    BEGIN SELECT RAISE(ABORT, '{CONSTRAINT}'); END
+    """,
+]
+
+SQLITE_BACKWARD = [
+    f'DROP TRIGGER IF EXISTS {CONSTRAINT}_insert',
+    f'DROP TRIGGER IF EXISTS {CONSTRAINT}_update',
+]
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        for sql in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_alter_appointmentnotification_type'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}),
+            _run({'postgresql': POSTGRES_BACKWARD, 'sqlite': SQLITE_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:06
+
+import importlib
+
+from django.db import migrations, models
+
+# No SQLite, adicionar coluna NOT NULL recria a tabela e descarta os triggers
+# de não sobreposição da 0008; recriá-los depois dos AddField.
+no_overlap = importlib.import_module('appointments.migrations.0008_appointment_no_overlap')
+
+
+def recreate_sqlite_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in no_overlap.SQLITE_BACKWARD + no_overlap.SQLITE_FORWARD:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0008_appointment_no_overlap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('target_type', models.CharField(choices=[('appointment', 'Agendamento'), ('time_block', 'Bloqueio de horário')], max_length=20)),
+                ('target_id', models.PositiveBigIntegerField()),
+                ('barber_id', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='timeblock',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(recreate_sqlite_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:17
+
+import datetime
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+# Lembretes antes do início (tipo -> antecedência), congelados aqui para a migração
+OFFSETS = {
+    'greeting_30': datetime.timedelta(minutes=30),
+    'alert_15': datetime.timedelta(minutes=15),
+    'alert_0': datetime.timedelta(0),
+}
+
+
+def schedule_upcoming(apps, schema_editor):
+    """Agenda os lembretes ainda por vir dos agendamentos futuros já existentes."""
+    Appointment = apps.get_model('appointments', 'Appointment')
+    AppointmentNotification = apps.get_model('appointments', 'AppointmentNotification')
+    ScheduledNotification = apps.get_model('appointments', 'ScheduledNotification')
+    now = timezone.now()
+    upcoming = Appointment.objects.filter(status='scheduled', start_datetime__gt=now)
+    sent = set(AppointmentNotification.objects.filter(appointment__in=upcoming).values_list('appointment_id', 'type'))
+    rows = []
+    for appt_id, start in upcoming.values_list('id', 'start_datetime').iterator(chunk_size=2000):
+        for type_, offset in OFFSETS.items():
+            if start - offset >= now and (appt_id, type_) not in sent:
+                rows.append(ScheduledNotification(appointment_id=appt_id, type=type_, due_at=start - offset))
+    ScheduledNotification.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_updated_at_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('greeting_30', 'Saudação 30 min'), ('alert_15', 'Alerta 15 min'), ('alert_10', 'Alerta 10 min'), ('alert_0', 'Na hora'), ('confirmation', 'Confirmação')], max_length=20)),
+                ('due_at', models.DateTimeField(db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_notifications', to='appointments.appointment')),
+            ],
+            options={
+                'unique_together': {('appointment', 'type')},
+            },
+        ),
+        migrations.RunPython(schedule_upcoming, migrations.RunPython.noop),
+    ]
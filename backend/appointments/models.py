@@ -1,9 +1,34 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from users.models import User
 from services.models import Service
 
+# Nome da restrição de não sobreposição (ver migração 0008) e folga entre atendimentos
+OVERLAP_CONSTRAINT = 'appointments_no_overlap'
+OVERLAP_BUFFER = timezone.timedelta(minutes=5)
+OVERLAP_MESSAGE = 'Conflito de horário: barbeiro já possui agendamento nesse intervalo.'
+
+
+class AppointmentQuerySet(models.QuerySet):
+    def with_effective_status(self, now=None):
+        """Anota effective_status: agendados cujo fim já passou contam como concluídos.
+
+        Permite que listagens e dashboards fiquem corretos antes de o sweeper
+        (manage.py sweep_appointments) gravar o status 'done'. Os painéis
+        financeiros e o resumo diário usam o status gravado (ver sales/rollups.py).
+        """
+        now = now or timezone.now()
+        return self.annotate(effective_status=models.Case(
+            models.When(
+                status=Appointment.STATUS_SCHEDULED,
+                end_datetime__lte=now,
+                then=models.Value(Appointment.STATUS_DONE),
+            ),
+            default=models.F('status'),
+            output_field=models.CharField(max_length=12),
+        ))
+
 
 class Appointment(models.Model):
     STATUS_SCHEDULED = 'scheduled'
@@ -24,6 +49,10 @@ class Appointment(models.Model):
     status = models.CharField(max_length=12, choices=STATUS_CHOICES, default=STATUS_SCHEDULED)
     notes = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Base do /api/appointments/changes/; updates em massa devem preenchê-lo à mão
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = AppointmentQuerySet.as_manager()
 
     class Meta:
         indexes = [
@@ -35,46 +64,59 @@ class Appointment(models.Model):
         return f"{self.client_name} - {self.service.title} ({self.start_datetime:%d/%m %H:%M})"
 
     def clean(self):
-        # calcular end_datetime se não fornecido
-        if not self.end_datetime and self.service:
-            self.end_datetime = self.start_datetime + timezone.timedelta(minutes=self.service.duration_minutes)
-
-        
+        self._fill_end_datetime()
         if self.barber_id and self.start_datetime and self.end_datetime:
+            # Verificação antecipada só para mensagens amigáveis em formulários;
+            # quem garante a ausência de sobreposição é o banco (OVERLAP_CONSTRAINT).
             qs = Appointment.objects.filter(barber=self.barber, status=self.STATUS_SCHEDULED)
             if self.pk:
                 qs = qs.exclude(pk=self.pk)
             conflict = qs.filter(
-                start_datetime__lt=(self.end_datetime + timezone.timedelta(minutes=5)),
-                end_datetime__gt=(self.start_datetime - timezone.timedelta(minutes=5))
+                start_datetime__lt=(self.end_datetime + OVERLAP_BUFFER),
+                end_datetime__gt=(self.start_datetime - OVERLAP_BUFFER)
             ).exists()
             if conflict:
-                raise ValidationError('Conflito de horário: barbeiro já possui agendamento nesse intervalo.')
-
-            # validar conflito com bloqueios de horário (TimeBlock)
-            try:
-                from .models import TimeBlock  # local import para evitar ordem de definição
-                # Converter para horário local para comparação por data
-                start_local = timezone.localtime(self.start_datetime)
-                end_local = timezone.localtime(self.end_datetime)
-                day = start_local.date()
-                blocks = TimeBlock.objects.filter(barber=self.barber, date=day)
-                for b in blocks:
-                    if b.full_day:
-                        raise ValidationError('Conflito: barbeiro indisponível o dia inteiro.')
-                    if b.start_time and b.end_time:
-                        block_start = start_local.replace(hour=b.start_time.hour, minute=b.start_time.minute, second=0, microsecond=0)
-                        block_end = start_local.replace(hour=b.end_time.hour, minute=b.end_time.minute, second=0, microsecond=0)
-                        # Conflito se houver interseção
-                        if block_start < end_local and block_end > start_local:
-                            raise ValidationError('Conflito: intervalo bloqueado pelo barbeiro.')
-            except Exception:
-                # Em caso de erro inesperado, não bloquear o save, mas evitar quebra
-                pass
+                raise ValidationError(OVERLAP_MESSAGE)
+        self._check_time_blocks()
+
+    def _fill_end_datetime(self):
+        # calcular end_datetime se não fornecido
+        if not self.end_datetime and self.service:
+            self.end_datetime = self.start_datetime + timezone.timedelta(minutes=self.service.duration_minutes)
+
+    def _check_time_blocks(self):
+        """Valida conflito com bloqueios de horário (TimeBlock) do dia local do início."""
+        if not (self.barber_id and self.start_datetime and self.end_datetime):
+            return
+        start_local = timezone.localtime(self.start_datetime)
+        end_local = timezone.localtime(self.end_datetime)
+        for b in TimeBlock.objects.filter(barber_id=self.barber_id, date=start_local.date()):
+            if b.full_day:
+                raise ValidationError('Conflito: barbeiro indisponível o dia inteiro.')
+            if b.start_time and b.end_time:
+                block_start = start_local.replace(hour=b.start_time.hour, minute=b.start_time.minute, second=0, microsecond=0)
+                block_end = start_local.replace(hour=b.end_time.hour, minute=b.end_time.minute, second=0, microsecond=0)
+                # Conflito se houver interseção
+                if block_start < end_local and block_end > start_local:
+                    raise ValidationError('Conflito: intervalo bloqueado pelo barbeiro.')
 
     def save(self, *args, **kwargs):
-        self.clean()
-        super().save(*args, **kwargs)
+        """Grava o agendamento; sobreposição com outro agendado vira ValidationError.
+
+        Não há consulta prévia de conflito: a restrição do banco (exclusion
+        constraint no Postgres, trigger no SQLite; migração 0008) rejeita a
+        escrita de forma atômica, inclusive entre reservas concorrentes.
+        """
+        self._fill_end_datetime()
+        if self.status == self.STATUS_SCHEDULED:
+            self._check_time_blocks()
+        try:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+        except IntegrityError as exc:
+            if OVERLAP_CONSTRAINT in str(exc):
+                raise ValidationError(OVERLAP_MESSAGE) from exc
+            raise
 
 
 class TimeBlock(models.Model):
@@ -89,6 +131,7 @@ class TimeBlock(models.Model):
     full_day = models.BooleanField(default=False)
     reason = models.CharField(max_length=120, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         indexes = [
@@ -114,7 +157,25 @@ class TimeBlock(models.Model):
         self.clean()
         super().save(*args, **kwargs)
 
-# Create your models here.
+class Tombstone(models.Model):
+    """Registro de exclusão de Appointment/TimeBlock para a sincronização incremental.
+
+    Gravado pelo post_delete (audit/signals.py) e removido pelo expurgo mensal.
+    """
+    TYPE_APPOINTMENT = 'appointment'
+    TYPE_TIME_BLOCK = 'time_block'
+    TYPE_CHOICES = [
+        (TYPE_APPOINTMENT, 'Agendamento'),
+        (TYPE_TIME_BLOCK, 'Bloqueio de horário'),
+    ]
+
+    target_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+    target_id = models.PositiveBigIntegerField()
+    barber_id = models.PositiveBigIntegerField(null=True, blank=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.target_type} #{self.target_id} excluído em {self.deleted_at:%d/%m %H:%M}"
 
 
 class NotificationSubscription(models.Model):
@@ -172,3 +233,58 @@ class AppointmentNotification(models.Model):
 
     def __str__(self):
         return f"Notificação {self.type} para appt #{self.appointment_id}"
+
+
+class ScheduledNotification(models.Model):
+    """Lembrete pendente de um agendamento, com o horário exato de envio.
+
+    Mantido pelos sinais após o commit e consumido pelo comando
+    run_notification_scheduler (ver appointments/reminders.py).
+    """
+    appointment = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='scheduled_notifications')
+    type = models.CharField(max_length=20, choices=AppointmentNotification.TYPE_CHOICES)
+    due_at = models.DateTimeField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        unique_together = [('appointment', 'type')]
+
+    def __str__(self):
+        return f"Lembrete {self.type} para appt #{self.appointment_id} em {self.due_at}"
+
+
+class PushOutbox(models.Model):
+    """Fila durável de envios push (ver appointments/outbox.py).
+
+    Quem quer enviar grava aqui; o worker run_push_outbox entrega em lotes,
+    com novas tentativas e backoff. Envios que esgotam as tentativas ou cujo
+    token não existe mais ficam como 'dead' (visíveis no admin).
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_SENT, 'Enviado'),
+        (STATUS_DEAD, 'Falhou'),
+    ]
+
+    token = models.CharField(max_length=255)
+    title = models.CharField(max_length=255)
+    body = models.TextField()
+    data = models.JSONField(default=dict, blank=True)
+    appointment = models.ForeignKey(Appointment, on_delete=models.SET_NULL, null=True, blank=True, related_name='push_outbox')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=255, blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f"Push {self.status} para {self.token[:12]}... ({self.attempts} tentativas)"
@@ -0,0 +1,92 @@
+"""Fila durável de envios push (PushOutbox) e a entrega feita pelo worker run_push_outbox.
+
+Quem envia push grava linhas com PushOutbox.objects.bulk_create. Cada
+deliver_batch reivindica até PUSH_OUTBOX_BATCH_SIZE linhas vencidas com
+select_for_update(skip_locked=True) e adia o next_attempt_at delas por
+CLAIM_LEASE antes de soltar o lock: outros workers pulam essas linhas, e se
+este morrer no meio do envio elas voltam sozinhas depois do prazo. O envio ao
+FCM acontece fora da transação, sem prender locks durante a rede.
+
+Falhas temporárias voltam com backoff exponencial com jitter. Token não
+registrado/inválido ou PUSH_OUTBOX_MAX_ATTEMPTS esgotadas: a linha vira
+'dead' e fica visível no admin, de onde pode ser reenfileirada; tokens
+mortos também são removidos (appointments/push_tokens.py).
+"""
+import datetime
+import random
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .fcm import PUSH_INVALID, PUSH_SENT, PUSH_UNREGISTERED, send_push_batch
+from .models import PushOutbox
+from .push_tokens import prune_tokens
+
+CLAIM_LEASE = datetime.timedelta(minutes=5)
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_CAP_SECONDS = 3600
+
+
+def backoff(attempts, rng=random):
+    """Espera antes da próxima tentativa: 30 s, 1 min, 2 min... até 1 h, com jitter de até metade."""
+    delay = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** max(0, attempts - 1))
+    return datetime.timedelta(seconds=rng.uniform(delay / 2, delay))
+
+
+def claim(now=None, batch_size=None):
+    """Reivindica um lote de envios vencidos para este worker."""
+    now = now or timezone.now()
+    batch_size = batch_size or settings.PUSH_OUTBOX_BATCH_SIZE
+    with transaction.atomic():
+        rows = list(
+            PushOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status=PushOutbox.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if rows:
+            PushOutbox.objects.filter(pk__in=[r.pk for r in rows]).update(next_attempt_at=now + CLAIM_LEASE)
+    return rows
+
+
+def deliver_batch(now=None, batch_size=None):
+    """Entrega um lote. Retorna {'sent': n, 'retry': n, 'dead': n, 'pruned': n, 'claimed': n}."""
+    rows = claim(now, batch_size)
+    counts = {'sent': 0, 'retry': 0, 'dead': 0, 'pruned': 0, 'claimed': len(rows)}
+    if not rows:
+        return counts
+    results = send_push_batch((r.token, r.title, r.body, r.data) for r in rows)
+
+    finished = timezone.now()
+    sent_ids = []
+    failed = []
+    dead_tokens = {PUSH_UNREGISTERED: set(), PUSH_INVALID: set()}
+    for row, result in zip(rows, results):
+        if result == PUSH_SENT:
+            sent_ids.append(row.pk)
+            continue
+        row.attempts += 1
+        row.last_error = result
+        if result in dead_tokens:
+            dead_tokens[result].add(row.token)
+        if result in dead_tokens or row.attempts >= settings.PUSH_OUTBOX_MAX_ATTEMPTS:
+            row.status = PushOutbox.STATUS_DEAD
+            counts['dead'] += 1
+        else:
+            row.next_attempt_at = finished + backoff(row.attempts)
+            counts['retry'] += 1
+        failed.append(row)
+
+    if sent_ids:
+        PushOutbox.objects.filter(pk__in=sent_ids).update(
+            status=PushOutbox.STATUS_SENT, sent_at=finished, attempts=F('attempts') + 1, last_error='',
+        )
+    PushOutbox.objects.bulk_update(failed, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+    counts['sent'] = len(sent_ids)
+
+    # Tokens mortos saem das tabelas de tokens. INVALID_ARGUMENT também pode
+    # ser erro de payload: só confia nele se algo do mesmo lote foi aceito.
+    prune = dead_tokens[PUSH_UNREGISTERED] | (dead_tokens[PUSH_INVALID] if sent_ids else set())
+    counts['pruned'] = prune_tokens(prune) if prune else 0
+    return counts
@@ -0,0 +1,45 @@
+"""Limpeza de tokens FCM mortos (ClientToken e NotificationSubscription).
+
+prune_tokens remove de uma vez os tokens que o FCM reportou como não
+registrados/inválidos e encerra os envios ainda pendentes para eles na
+PushOutbox. expire_stale_tokens apaga, em lotes, os tokens que não aparecem
+há PUSH_TOKEN_TTL_DAYS dias (last_seen_at é renovado a cada inscrição).
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ClientToken, NotificationSubscription, PushOutbox
+
+PRUNE_BATCH_SIZE = 1000
+
+
+def prune_tokens(tokens, reason='unregistered'):
+    """Apaga os tokens das duas tabelas. Retorna quantos ClientToken saíram."""
+    tokens = list(set(tokens))
+    removed = 0
+    for i in range(0, len(tokens), PRUNE_BATCH_SIZE):
+        chunk = tokens[i:i + PRUNE_BATCH_SIZE]
+        with transaction.atomic():
+            removed += ClientToken.objects.filter(token__in=chunk).delete()[0]
+            NotificationSubscription.objects.filter(token__in=chunk).delete()
+            PushOutbox.objects.filter(token__in=chunk, status=PushOutbox.STATUS_PENDING).update(
+                status=PushOutbox.STATUS_DEAD, last_error=reason,
+            )
+    return removed
+
+
+def expire_stale_tokens(days=None, batch_size=PRUNE_BATCH_SIZE, now=None):
+    """Apaga, em lotes de batch_size, os tokens não vistos há `days` dias. Retorna quantos."""
+    days = settings.PUSH_TOKEN_TTL_DAYS if days is None else days
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=days)
+    total = 0
+    while True:
+        chunk = list(
+            ClientToken.objects.filter(last_seen_at__lt=cutoff).order_by('pk').values_list('token', flat=True)[:batch_size]
+        )
+        if not chunk:
+            return total
+        total += prune_tokens(chunk, reason='expired')
@@ -0,0 +1,240 @@
+"""Lembretes push com horário exato (ScheduledNotification) e o agendador que os enfileira.
+
+Cada agendamento 'scheduled' tem uma linha por lembrete ainda por vir, com o
+instante de envio (due_at). Os sinais (audit/signals.py) chamam
+sync_reminders após o commit de criação, remarcação, cancelamento e de novas
+inscrições de push.
+
+O comando run_notification_scheduler mantém os due_at num heap em memória e
+dorme até o próximo. A cada NOTIFICATION_SCHEDULER_REFRESH_SECONDS lê só as
+linhas alteradas desde a leitura anterior (updated_at, com a mesma folga de
+CHANGES_OVERLAP do feed de mudanças); no Postgres um NOTIFY acorda o agendador
+na hora. Na hora de enviar, a linha e o agendamento são relidos do banco (o
+heap só decide quando acordar) e as mensagens vão para a fila PushOutbox
+(appointments/outbox.py). Lembretes atrasados mais que
+NOTIFICATION_CATCHUP_SECONDS (agendador parado) são descartados sem envio.
+"""
+import datetime
+import heapq
+import select
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .changes import CHANGES_OVERLAP
+from .models import Appointment, AppointmentNotification, NotificationSubscription, PushOutbox, ScheduledNotification
+
+CHANNEL = 'appointments_reminders'
+
+# Confirmação: 30 s após a criação, enquanto o agendamento tiver menos de 5 min
+CONFIRMATION_DELAY = datetime.timedelta(seconds=30)
+CONFIRMATION_LIMIT = datetime.timedelta(minutes=5)
+
+
+def _names(appt):
+    barber_name = getattr(appt.barber, 'display_name', None) or getattr(appt.barber, 'username', '')
+    service_title = getattr(appt.service, 'title', '')
+    return barber_name, service_title
+
+
+def confirmation_message(appt):
+    barber_name, service_title = _names(appt)
+    start_local = timezone.localtime(appt.start_datetime).strftime('%d/%m às %H:%M')
+    title = '✅ Agendamento Confirmado!'
+    body = f'Tudo certo! Seu horário para {service_title} com {barber_name} está confirmado para {start_local}.'
+    data = {'type': 'confirmation', 'appointmentId': str(appt.id)}
+    return title, body, data
+
+
+def greeting_30_message(appt):
+    barber_name, service_title = _names(appt)
+    start_local = timezone.localtime(appt.start_datetime).strftime('%H:%M')
+    title = f'Lembrete: {service_title} às {start_local}'
+    body = f'Olá! {barber_name} te espera para {service_title} em 30 minutos.'
+    data = {'type': 'greeting_30', 'appointmentId': str(appt.id), 'service': service_title}
+    return title, body, data
+
+
+def alert_15_message(appt):
+    barber_name, service_title = _names(appt)
+    title = '⏰ 15 minutos para seu corte!'
+    body = f'Seu horário com {barber_name} é daqui a pouco. Estamos te aguardando!'
+    data = {'type': 'alert_15', 'appointmentId': str(appt.id), 'service': service_title}
+    return title, body, data
+
+
+def alert_0_message(appt):
+    barber_name, service_title = _names(appt)
+    title = '✂️ Chegou a hora!'
+    body = f'Seu horário para {service_title} com {barber_name} é agora. Bom corte!'
+    data = {'type': 'alert_0', 'appointmentId': str(appt.id), 'service': service_title}
+    return title, body, data
+
+
+MESSAGES = {
+    AppointmentNotification.TYPE_CONFIRMATION: confirmation_message,
+    AppointmentNotification.TYPE_GREETING_30: greeting_30_message,
+    AppointmentNotification.TYPE_ALERT_15: alert_15_message,
+    AppointmentNotification.TYPE_ALERT_0: alert_0_message,
+}
+
+# Lembretes antes do início: tipo -> antecedência
+BEFORE_START = {
+    AppointmentNotification.TYPE_GREETING_30: datetime.timedelta(minutes=30),
+    AppointmentNotification.TYPE_ALERT_15: datetime.timedelta(minutes=15),
+    AppointmentNotification.TYPE_ALERT_0: datetime.timedelta(0),
+}
+
+
+def reminder_times(appt, now=None):
+    """{tipo: due_at} dos lembretes ainda por vir de um agendamento."""
+    now = now or timezone.now()
+    if appt.status != Appointment.STATUS_SCHEDULED:
+        return {}
+    due = {}
+    if appt.created_at and now <= appt.created_at + CONFIRMATION_LIMIT:
+        # Inscrição feita depois dos 30 s: confirma assim que possível
+        due[AppointmentNotification.TYPE_CONFIRMATION] = max(appt.created_at + CONFIRMATION_DELAY, now)
+    for type_, offset in BEFORE_START.items():
+        at = appt.start_datetime - offset
+        if at >= now:
+            due[type_] = at
+    return due
+
+
+def sync_reminders(appt, created=False):
+    """Regrava as linhas de ScheduledNotification do agendamento e avisa o agendador.
+
+    Chamado após o commit. Num agendamento recém-criado não há lembretes
+    enviados nem linhas antigas, então basta o upsert.
+    """
+    due = reminder_times(appt)
+    if not created:
+        sent = set(AppointmentNotification.objects.filter(appointment=appt).values_list('type', flat=True))
+        due = {t: at for t, at in due.items() if t not in sent}
+        ScheduledNotification.objects.filter(appointment=appt).exclude(type__in=list(due)).delete()
+    if due:
+        ScheduledNotification.objects.bulk_create(
+            [ScheduledNotification(appointment=appt, type=t, due_at=at) for t, at in due.items()],
+            update_conflicts=True,
+            unique_fields=['appointment', 'type'],
+            update_fields=['due_at', 'updated_at'],
+        )
+    notify_scheduler()
+
+
+def notify_scheduler():
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'NOTIFY {CHANNEL}')
+
+
+def send_due(rows, now):
+    """Enfileira (PushOutbox) os lembretes das linhas vencidas e os registra. Retorna quantos saíram."""
+    catchup = datetime.timedelta(seconds=settings.NOTIFICATION_CATCHUP_SECONDS)
+    live = [
+        r for r in rows
+        if r.appointment.status == Appointment.STATUS_SCHEDULED and now - r.due_at <= catchup
+    ]
+    ids = {r.appointment_id for r in live}
+    already_sent = set(
+        AppointmentNotification.objects.filter(appointment_id__in=ids).values_list('appointment_id', 'type')
+    ) if ids else set()
+    tokens = {}
+    if ids:
+        for appt_id, token in NotificationSubscription.objects.filter(appointment_id__in=ids).values_list('appointment_id', 'token'):
+            tokens.setdefault(appt_id, []).append(token)
+
+    outbox = []
+    sent = {}
+    for r in live:
+        key = (r.appointment_id, r.type)
+        if key in already_sent or not tokens.get(r.appointment_id):
+            continue
+        title, body, data = MESSAGES[r.type](r.appointment)
+        outbox.extend(
+            PushOutbox(token=token, title=title, body=body, data=data, appointment_id=r.appointment_id)
+            for token in tokens[r.appointment_id]
+        )
+        sent[key] = AppointmentNotification(appointment_id=r.appointment_id, type=r.type)
+
+    # Entregue à fila de push (com novas tentativas) = lembrete enviado
+    with transaction.atomic():
+        PushOutbox.objects.bulk_create(outbox)
+        AppointmentNotification.objects.bulk_create(list(sent.values()), ignore_conflicts=True)
+        # Linhas remarcadas para o futuro enquanto enfileirávamos continuam pendentes
+        ScheduledNotification.objects.filter(pk__in=[r.pk for r in rows], due_at__lte=now).delete()
+    return len(sent)
+
+
+class Scheduler:
+    """Heap de (due_at, id) das linhas pendentes, atualizado de forma incremental."""
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._synced_at = None
+        self._listening = False
+
+    def refresh(self, now):
+        qs = ScheduledNotification.objects.all()
+        if self._synced_at is not None:
+            qs = qs.filter(updated_at__gte=self._synced_at - CHANGES_OVERLAP)
+        self._synced_at = now
+        for pk, due_at in qs.values_list('pk', 'due_at'):
+            if self._due.get(pk) != due_at:
+                self._due[pk] = due_at
+                heapq.heappush(self._heap, (due_at, pk))
+
+    def next_due(self):
+        # Descarta entradas velhas (linha remarcada depois de entrar no heap)
+        while self._heap and self._due.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now):
+        ids = []
+        while self.next_due() is not None and self._heap[0][0] <= now:
+            _due_at, pk = heapq.heappop(self._heap)
+            del self._due[pk]
+            ids.append(pk)
+        return ids
+
+    def run_once(self, now=None):
+        """Lê as mudanças e envia o que venceu. Retorna quantos lembretes saíram."""
+        now = now or timezone.now()
+        self.refresh(now)
+        ids = self.pop_due(now)
+        if not ids:
+            return 0
+        rows = list(
+            ScheduledNotification.objects.filter(pk__in=ids, due_at__lte=now)
+            .select_related('appointment__barber', 'appointment__service')
+        )
+        return send_due(rows, now)
+
+    def wait(self, now):
+        """Dorme até o próximo lembrete, a próxima leitura de mudanças ou um NOTIFY."""
+        timeout = settings.NOTIFICATION_SCHEDULER_REFRESH_SECONDS
+        next_due = self.next_due()
+        if next_due is not None:
+            timeout = min(timeout, (next_due - now).total_seconds())
+        timeout = max(0.0, timeout)
+        if connection.vendor != 'postgresql':
+            time.sleep(timeout)
+            return
+        if not self._listening or connection.connection is None:
+            connection.ensure_connection()
+            with connection.cursor() as cursor:
+                cursor.execute(f'LISTEN {CHANNEL}')
+            self._listening = True
+        conn = connection.connection
+        if select.select([conn], [], [], timeout) != ([], [], []):
+            conn.poll()
+            conn.notifies.clear()
+
+    def reset_connection(self):
+        connection.close()
+        self._listening = False
@@ -0,0 +1,167 @@
+"""Cálculo de horários livres (available_slots) por varredura linear.
+
+Os intervalos ocupados (agendamentos + bloqueios, já com o buffer) são
+ordenados e mesclados uma única vez; os inícios candidatos são então emitidos
+em uma passada só, pulando direto para o fim de cada intervalo ocupado. O
+resultado é idêntico ao laço original, que testava cada passo contra todos os
+intervalos (ver naive_free_slots, usado nos testes e em scripts/bench_slots.py).
+"""
+import datetime
+
+from django.utils import timezone
+
+DEFAULT_STEP = datetime.timedelta(minutes=10)
+DEFAULT_BUFFER = datetime.timedelta(minutes=5)
+DEFAULT_OPEN = datetime.time(8, 0)
+DEFAULT_CLOSE = datetime.time(20, 0)
+
+
+def day_window(day, now_local=None, step=DEFAULT_STEP, open_time=DEFAULT_OPEN, close_time=DEFAULT_CLOSE):
+    """Janela de atendimento (início, fim) do dia, em horário local.
+
+    No dia corrente o início avança para o próximo múltiplo de `step` após agora.
+    """
+    tz = timezone.get_current_timezone()
+    window_start = timezone.make_aware(datetime.datetime.combine(day, open_time), tz)
+    window_end = timezone.make_aware(datetime.datetime.combine(day, close_time), tz)
+    now_local = now_local or timezone.localtime()
+    if day == now_local.date():
+        step_min = max(1, int(step.total_seconds() // 60))
+        minutes = (now_local.minute + step_min - 1) // step_min * step_min
+        now_rounded = now_local.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(minutes=minutes)
+        if now_rounded > window_start:
+            window_start = now_rounded
+    return window_start, window_end
+
+
+def busy_ranges_by_day(barber_ids, windows):
+    """Intervalos ocupados (horário local, sem buffer) por (barbeiro, dia).
+
+    `windows` mapeia cada dia para sua janela (início, fim). São só duas
+    consultas para todos os barbeiros e dias: uma de bloqueios e uma de
+    agendamentos. Cada dia recebe os agendamentos que cruzam sua janela, como
+    na consulta original de available_slots. Dias com bloqueio de dia inteiro
+    ficam com None.
+    """
+    from .models import Appointment, TimeBlock
+
+    barber_ids = [int(b) for b in barber_ids]
+    result = {(b, day): [] for b in barber_ids for day in windows}
+    if not result:
+        return result
+    tz = timezone.get_current_timezone()
+
+    for b in TimeBlock.objects.filter(barber_id__in=barber_ids, date__in=list(windows)):
+        key = (b.barber_id, b.date)
+        if result[key] is None:
+            continue
+        if b.full_day:
+            result[key] = None
+        elif b.start_time and b.end_time:
+            result[key].append((
+                timezone.make_aware(datetime.datetime.combine(b.date, b.start_time), tz),
+                timezone.make_aware(datetime.datetime.combine(b.date, b.end_time), tz),
+            ))
+
+    range_start = min(ws for ws, _ in windows.values())
+    range_end = max(we for _, we in windows.values())
+    existing = Appointment.objects.filter(
+        barber_id__in=barber_ids,
+        start_datetime__lt=range_end,
+        end_datetime__gt=range_start,
+    ).exclude(status=Appointment.STATUS_CANCELLED).values_list('barber_id', 'start_datetime', 'end_datetime')
+    for barber_id, start, end in existing:
+        start = timezone.localtime(start, tz)
+        end = timezone.localtime(end, tz)
+        day = start.date()
+        while day <= end.date():
+            window = windows.get(day)
+            ranges = result.get((barber_id, day))
+            if window and ranges is not None and start < window[1] and end > window[0]:
+                ranges.append((start, end))
+            day += datetime.timedelta(days=1)
+    return result
+
+
+def busy_ranges(barber_id, day, window_start, window_end):
+    """Intervalos ocupados do barbeiro no dia (ver busy_ranges_by_day); None se bloqueado o dia todo."""
+    return busy_ranges_by_day([barber_id], {day: (window_start, window_end)})[(int(barber_id), day)]
+
+
+def slots_by_barber_day(barber_ids, days, duration, step=DEFAULT_STEP, buffer=DEFAULT_BUFFER, now_local=None):
+    """{(barber_id, dia): [inícios livres]} para vários barbeiros e dias com duas consultas."""
+    now_local = now_local or timezone.localtime()
+    windows = {day: day_window(day, now_local=now_local, step=step) for day in days}
+    busy = busy_ranges_by_day(barber_ids, windows)
+    out = {}
+    for (barber_id, day), ranges in busy.items():
+        if ranges is None:
+            out[(barber_id, day)] = []
+        else:
+            window_start, window_end = windows[day]
+            out[(barber_id, day)] = free_slots(window_start, window_end, duration, ranges, step, buffer)
+    return out
+
+
+def merge_busy(ranges, buffer=DEFAULT_BUFFER):
+    """Aplica o buffer, ordena e mescla intervalos que se sobrepõem ou se tocam.
+
+    Retorna (merged, inverted): intervalos com fim antes do início (dados
+    inconsistentes) não podem ser mesclados e voltam à parte, para serem
+    testados individualmente como no laço original.
+    """
+    expanded = sorted((s - buffer, e + buffer) for s, e in ranges)
+    merged = []
+    inverted = []
+    for s, e in expanded:
+        if e < s:
+            inverted.append((s, e))
+        elif merged and s <= merged[-1][1]:
+            if e > merged[-1][1]:
+                merged[-1] = (merged[-1][0], e)
+        else:
+            merged.append((s, e))
+    return merged, inverted
+
+
+def free_slots(window_start, window_end, duration, ranges, step=DEFAULT_STEP, buffer=DEFAULT_BUFFER):
+    """Inícios dos slots de `duration` que cabem em [window_start, window_end] sem conflito.
+
+    Um slot [ini, ini + duration) conflita com um intervalo ocupado quando se
+    sobrepõe a ele expandido pelo buffer. Os candidatos são window_start + k * step.
+    """
+    if duration <= datetime.timedelta(0) or step <= datetime.timedelta(0):
+        return []
+    merged, inverted = merge_busy(ranges, buffer)
+    slots = []
+    i = 0
+    n = len(merged)
+    k = 0
+    cur = window_start
+    while cur + duration <= window_end:
+        end = cur + duration
+        while i < n and merged[i][1] <= cur:
+            i += 1
+        if i < n and merged[i][0] < end:
+            # Conflita até o início do slot alcançar o fim do intervalo ocupado
+            busy_end = merged[i][1]
+            k = max(k + 1, -(-(busy_end - window_start) // step))
+            cur = window_start + k * step
+            continue
+        if not any(s < end and e > cur for s, e in inverted):
+            slots.append(cur)
+        k += 1
+        cur = window_start + k * step
+    return slots
+
+
+def naive_free_slots(window_start, window_end, duration, ranges, step=DEFAULT_STEP, buffer=DEFAULT_BUFFER):
+    """Implementação de referência (laço original de available_slots): O(passos x intervalos)."""
+    slots = []
+    cur = window_start
+    while cur + duration <= window_end:
+        proposed_end = cur + duration
+        if not any((rs - buffer) < proposed_end and (re + buffer) > cur for rs, re in ranges):
+            slots.append(cur)
+        cur += step
+    return slots
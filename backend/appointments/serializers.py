@@ -1,5 +1,15 @@
+from operator import itemgetter
+
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Appointment
+from .models import Appointment, TimeBlock
+
+# Relações que ?expand= troca pelo objeto compacto (uma junção via select_related/values)
+EXPANDABLE = ('barber', 'service')
+EXPAND_COLUMNS = {
+    'barber': ('barber__display_name', 'barber__username'),
+    'service': ('service__title',),
+}
 
 
 class AppointmentSerializer(serializers.ModelSerializer):
@@ -7,8 +17,121 @@ class AppointmentSerializer(serializers.ModelSerializer):
         model = Appointment
         fields = [
             'id', 'barber', 'client_name', 'client_phone', 'service',
-            'start_datetime', 'end_datetime', 'status', 'notes', 'created_at'
+            'start_datetime', 'end_datetime', 'status', 'notes', 'created_at', 'updated_at'
         ]
         extra_kwargs = {
             'notes': {'required': False, 'allow_blank': True}
         }
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Listagens anotadas com with_effective_status já mostram vencidos como concluídos
+        effective = getattr(instance, 'effective_status', None)
+        if effective:
+            data['status'] = effective
+        expand = self.context.get('expand') or ()
+        if 'barber' in expand:
+            data['barber'] = _barber_compact(instance.barber_id, instance.barber.display_name, instance.barber.username)
+        if 'service' in expand:
+            data['service'] = _service_compact(instance.service_id, instance.service.title)
+        return data
+
+
+def _barber_compact(barber_id, display_name, username):
+    return {'id': barber_id, 'name': display_name or username}
+
+
+def _service_compact(service_id, title):
+    return {'id': service_id, 'title': title}
+
+
+def parse_sparse_params(query_params):
+    """Lê ?fields= e ?expand= (listas separadas por vírgula).
+
+    Retorna (fields, expand): fields é None quando ausente (resposta completa).
+    Nomes desconhecidos geram erro de validação (400).
+    """
+    allowed = AppointmentSerializer.Meta.fields
+    fields = None
+    raw = (query_params.get('fields') or '').strip()
+    if raw:
+        fields = [f.strip() for f in raw.split(',') if f.strip()]
+        unknown = [f for f in fields if f not in allowed]
+        if unknown:
+            raise serializers.ValidationError({'fields': f'Campos inválidos: {", ".join(unknown)}.'})
+    expand = [e.strip() for e in (query_params.get('expand') or '').split(',') if e.strip()]
+    unknown = [e for e in expand if e not in EXPANDABLE]
+    if unknown:
+        raise serializers.ValidationError({'expand': f'Só é possível expandir: {", ".join(EXPANDABLE)}.'})
+    if fields is not None:
+        # Relações expandidas entram na resposta mesmo se não listadas em fields
+        fields += [e for e in expand if e not in fields]
+    return fields, expand
+
+
+def compact_rows(queryset, fields, expand=()):
+    """Queryset de dicts (values()) só com as colunas pedidas, sem ModelSerializer.
+
+    Sempre inclui start_datetime e id, usados pelo cursor da paginação. O
+    queryset deve vir de with_effective_status() quando 'status' for pedido.
+    """
+    columns = {'id', 'start_datetime'}
+    for f in fields:
+        if f == 'status':
+            columns.add('effective_status')
+        elif f in EXPANDABLE:
+            columns.add(f'{f}_id')
+            if f in expand:
+                columns.update(EXPAND_COLUMNS[f])
+        else:
+            columns.add(f)
+    return queryset.values(*sorted(columns))
+
+
+def compact_converter(fields, expand=()):
+    """Função linha -> dict no mesmo formato do AppointmentSerializer.
+
+    Montada uma vez por listagem: o fuso e a leitura de cada campo são
+    resolvidos antes, e cada linha só aplica a lista de conversões.
+    """
+    tz = timezone.get_current_timezone()
+
+    def as_iso(column):
+        # Mesmo formato do DateTimeField do DRF (fuso atual, ISO 8601, 'Z' para UTC)
+        def get(row):
+            value = row[column]
+            if value is None:
+                return None
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return get
+
+    getters = []
+    for f in fields:
+        if f == 'status':
+            get = itemgetter('effective_status')
+        elif f == 'barber' and f in expand:
+            get = lambda row: _barber_compact(row['barber_id'], row['barber__display_name'], row['barber__username'])
+        elif f == 'service' and f in expand:
+            get = lambda row: _service_compact(row['service_id'], row['service__title'])
+        elif f in EXPANDABLE:
+            get = itemgetter(f'{f}_id')
+        elif f in ('start_datetime', 'end_datetime', 'created_at', 'updated_at'):
+            get = as_iso(f)
+        else:
+            get = itemgetter(f)
+        getters.append((f, get))
+    return lambda row: {f: get(row) for f, get in getters}
+
+
+class PublicAppointmentSerializer(AppointmentSerializer):
+    """Reserva pública: barbeiro e serviço já resolvidos pela view (save(barber=, service=))."""
+
+    class Meta(AppointmentSerializer.Meta):
+        read_only_fields = ['barber', 'service', 'status']
+
+
+class TimeBlockSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = TimeBlock
+        fields = ['id', 'barber', 'date', 'start_time', 'end_time', 'full_day', 'reason', 'updated_at']
@@ -0,0 +1,146 @@
+"""Cache dos horários livres por (barbeiro, dia local, duração).
+
+Cada (barbeiro, dia) tem um token de versão no cache; as listas de horários
+ficam sob chaves que incluem esse token. Invalidar é só trocar o token, feito
+após o commit pelos sinais de Appointment e TimeBlock (audit/signals.py). Se
+o token for descartado pelo cache, um novo é criado e as entradas antigas
+simplesmente deixam de ser lidas. Acertos/erros são contados no próprio cache
+(`manage.py slots_cache_stats`); os contadores são aproximados, pois o incr do
+FileBasedCache não é atômico entre threads/processos e pode perder incrementos.
+
+O cache precisa ser o mesmo para todos os processos que gravam agendamentos
+(ver CACHE_LOCATION em settings.py); com LocMemCache cada processo invalida só
+o próprio cache.
+"""
+import datetime
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .scheduling import DEFAULT_BUFFER, DEFAULT_STEP, day_window, slots_by_barber_day
+
+HITS_KEY = 'slots:stats:hits'
+MISSES_KEY = 'slots:stats:misses'
+
+
+def _minutes(td):
+    return int(td.total_seconds() // 60)
+
+
+def _version_key(barber_id, day):
+    return f'slots:v:{barber_id}:{day.isoformat()}'
+
+
+def _to_local_date(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).date()
+    return value
+
+
+def _incr(key, n):
+    if not n:
+        return
+    if cache.add(key, n, None):
+        return
+    try:
+        cache.incr(key, n)
+    except ValueError:
+        cache.set(key, n, None)
+
+
+def _versions(pairs):
+    keys = {pair: _version_key(*pair) for pair in pairs}
+    found = cache.get_many(list(keys.values()))
+    versions = {}
+    for pair, key in keys.items():
+        token = found.get(key)
+        if token is None:
+            token = uuid.uuid4().hex
+            if not cache.add(key, token, None):
+                token = cache.get(key) or token
+        versions[pair] = token
+    return versions
+
+
+def cached_slots(barber_ids, days, duration, step=DEFAULT_STEP, buffer=DEFAULT_BUFFER, now_local=None):
+    """Mesmo resultado de scheduling.slots_by_barber_day, consultando o banco só para os pares fora do cache."""
+    now_local = now_local or timezone.localtime()
+    pairs = [(int(b), day) for b in barber_ids for day in days]
+    versions = _versions(pairs)
+    keys = {}
+    for barber_id, day in pairs:
+        window_start, _ = day_window(day, now_local=now_local, step=step)
+        keys[(barber_id, day)] = (
+            f'slots:{barber_id}:{day.isoformat()}:{_minutes(duration)}:{window_start:%H%M}'
+            f':{_minutes(step)}:{_minutes(buffer)}:{versions[(barber_id, day)]}'
+        )
+    found = cache.get_many(list(keys.values()))
+    out = {pair: found[key] for pair, key in keys.items() if key in found}
+    missing = [pair for pair in pairs if pair not in out]
+    _incr(HITS_KEY, len(out))
+    _incr(MISSES_KEY, len(missing))
+    if missing:
+        computed = slots_by_barber_day(
+            sorted({b for b, _ in missing}), sorted({d for _, d in missing}), duration, step, buffer, now_local,
+        )
+        cache.set_many({keys[pair]: computed[pair] for pair in missing}, getattr(settings, 'SLOTS_CACHE_TIMEOUT', 600))
+        for pair in missing:
+            out[pair] = computed[pair]
+    return out
+
+
+def invalidate(keys):
+    """Descarta os horários em cache de (barbeiro, data ou datetime) após o commit."""
+    pairs = {(int(b), _to_local_date(d)) for b, d in keys if b and d}
+    if not pairs:
+        return
+
+    def _bump():
+        cache.set_many({_version_key(*pair): uuid.uuid4().hex for pair in pairs}, None)
+
+    transaction.on_commit(_bump)
+
+
+def stats():
+    values = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = int(values.get(HITS_KEY) or 0)
+    misses = int(values.get(MISSES_KEY) or 0)
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': (hits / total) if total else 0.0}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def next_available(barber_ids, duration, after_local, limit=5, horizon_days=60, chunk_days=7, now_local=None):
+    """Primeiros `limit` horários livres a partir de after_local, entre todos os barbeiros.
+
+    Varre blocos de `chunk_days` dias (uma consulta de agendamentos e uma de
+    bloqueios por bloco, só para o que não estiver em cache) e para assim que
+    um dia completo fecha a lista. Retorna [(início, barber_id)] em ordem
+    cronológica; empates seguem a ordem de barber_ids.
+    """
+    order = {int(b): i for i, b in enumerate(barber_ids)}
+    first_day = after_local.date()
+    found = []
+    offset = 0
+    while offset < horizon_days:
+        days = [first_day + datetime.timedelta(days=offset + i) for i in range(min(chunk_days, horizon_days - offset))]
+        slots = cached_slots(list(order), days, duration, now_local=now_local)
+        for day in days:
+            day_slots = [
+                (start, barber_id)
+                for barber_id in order
+                for start in slots[(barber_id, day)]
+                if start >= after_local
+            ]
+            day_slots.sort(key=lambda x: (x[0], order[x[1]]))
+            found.extend(day_slots)
+            if len(found) >= limit:
+                return found[:limit]
+        offset += chunk_days
+    return found[:limit]
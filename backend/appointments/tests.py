@@ -1,3 +1,763 @@
-from django.test import TestCase
+import datetime
+import io
+import logging
+import random
+import threading
+from contextlib import contextmanager
 
-# Create your tests here.
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from audit.models import AuditLog
+from sales.models import DailyBarberStats
+from services.catalog import get_catalog
+from services.models import Service
+from users.models import User
+from . import fcm, outbox, push_tokens, reminders
+from .models import Appointment, AppointmentNotification, ClientToken, NotificationSubscription, PushOutbox, ScheduledNotification, TimeBlock
+from .scheduling import day_window, free_slots, merge_busy, naive_free_slots
+
+
+def _local(day, minutes):
+    tz = timezone.get_current_timezone()
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time(0, 0)), tz) + datetime.timedelta(minutes=minutes)
+
+
+class FreeSlotsPropertyTests(SimpleTestCase):
+    """free_slots deve reproduzir exatamente o laço original (naive_free_slots)."""
+
+    def _random_case(self, rnd):
+        day = datetime.date(2025, 1, 1) + datetime.timedelta(days=rnd.randint(0, 365))
+        open_min = rnd.choice([0, 6 * 60, 8 * 60, 8 * 60 + 7])
+        window_start = _local(day, open_min)
+        window_end = window_start + datetime.timedelta(minutes=rnd.randint(0, 14 * 60))
+        ranges = []
+        for _ in range(rnd.randint(0, 25)):
+            s = rnd.randint(open_min - 120, open_min + 15 * 60)
+            length = rnd.choice([0, 5, 10, 15, 30, 45, 60, 90, 240, rnd.randint(-60, 300)])
+            ranges.append((_local(day, s), _local(day, s + length)))
+        duration = datetime.timedelta(minutes=rnd.choice([1, 5, 10, 15, 30, 45, 60, 120, 600, rnd.randint(1, 200)]))
+        step = datetime.timedelta(minutes=rnd.choice([1, 5, 10, 15, 30, 7]))
+        buffer = datetime.timedelta(minutes=rnd.choice([0, 5, 10, rnd.randint(0, 30)]))
+        return window_start, window_end, duration, ranges, step, buffer
+
+    def test_matches_naive_implementation(self):
+        rnd = random.Random(20240601)
+        for _ in range(2000):
+            window_start, window_end, duration, ranges, step, buffer = self._random_case(rnd)
+            expected = naive_free_slots(window_start, window_end, duration, ranges, step, buffer)
+            got = free_slots(window_start, window_end, duration, ranges, step, buffer)
+            self.assertEqual(got, expected, (window_start, window_end, duration, ranges, step, buffer))
+
+    def test_merge_busy_returns_sorted_disjoint_intervals(self):
+        rnd = random.Random(7)
+        for _ in range(500):
+            *_, ranges, _step, buffer = self._random_case(rnd)
+            merged, inverted = merge_busy(ranges, buffer)
+            for (s1, e1), (s2, e2) in zip(merged, merged[1:]):
+                self.assertLess(e1, s2)
+            self.assertTrue(all(s <= e for s, e in merged))
+            self.assertTrue(all(e < s for s, e in inverted))
+
+    def test_day_window_rounds_now_up_to_step(self):
+        day = datetime.date(2025, 3, 10)
+        now_local = _local(day, 9 * 60 + 41)
+        start, end = day_window(day, now_local=now_local)
+        self.assertEqual((start.hour, start.minute), (9, 50))
+        self.assertEqual((end.hour, end.minute), (20, 0))
+        start, _ = day_window(day, now_local=_local(day, 6 * 60))
+        self.assertEqual((start.hour, start.minute), (8, 0))
+
+
+class AvailableSlotsViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.client = APIClient()
+        self.client.force_authenticate(self.barber)
+        self.day = timezone.localdate() + datetime.timedelta(days=3)
+
+    def _slots(self, **params):
+        params.setdefault('date', self.day.isoformat())
+        params.setdefault('serviceId', self.service.id)
+        resp = self.client.get('/api/appointments/available-slots/', params)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()['slots']
+
+    def test_matches_naive_slots_with_appointments_and_blocks(self):
+        for start_min, length in [(9 * 60, 30), (9 * 60 + 40, 45), (14 * 60, 60)]:
+            Appointment.objects.create(
+                barber=self.barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+                start_datetime=_local(self.day, start_min), end_datetime=_local(self.day, start_min + length),
+            )
+        TimeBlock.objects.create(barber=self.barber, date=self.day, start_time=datetime.time(12, 0), end_time=datetime.time(13, 0))
+        cancelled = Appointment.objects.create(
+            barber=self.barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+            start_datetime=_local(self.day, 16 * 60), end_datetime=_local(self.day, 16 * 60 + 30),
+        )
+        Appointment.objects.filter(pk=cancelled.pk).update(status=Appointment.STATUS_CANCELLED)
+
+        ranges = [(_local(self.day, s), _local(self.day, s + l)) for s, l in [(9 * 60, 30), (9 * 60 + 40, 45), (14 * 60, 60), (12 * 60, 60)]]
+        expected = [
+            cur.strftime('%H:%M')
+            for cur in naive_free_slots(_local(self.day, 8 * 60), _local(self.day, 20 * 60), datetime.timedelta(minutes=30), ranges)
+        ]
+        self.assertEqual(self._slots(), expected)
+        self.assertIn('16:00', expected)
+        self.assertNotIn('09:00', expected)
+
+    def test_full_day_block_returns_no_slots(self):
+        TimeBlock.objects.create(barber=self.barber, date=self.day, full_day=True)
+        self.assertEqual(self._slots(), [])
+
+    def test_availability_matches_available_slots_per_day(self):
+        other = User.objects.create_user(username='outro', password='x', role=User.BARBER)
+        Appointment.objects.create(
+            barber=other, client_name='Cliente', client_phone='11999999999', service=self.service,
+            start_datetime=_local(self.day, 10 * 60), end_datetime=_local(self.day, 10 * 60 + 30),
+        )
+        Appointment.objects.create(
+            barber=self.barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+            start_datetime=_local(self.day + datetime.timedelta(days=1), 19 * 60 + 30),
+            end_datetime=_local(self.day + datetime.timedelta(days=2), 8 * 60 + 30),
+        )
+        TimeBlock.objects.create(barber=other, date=self.day + datetime.timedelta(days=1), full_day=True)
+        params = {
+            'from': self.day.isoformat(),
+            'to': (self.day + datetime.timedelta(days=2)).isoformat(),
+            'barberIds': f'{self.barber.id},{other.id}',
+            'serviceId': self.service.id,
+        }
+        get_catalog()
+        with self.assertNumQueries(2):  # bloqueios + agendamentos de todos os barbeiros e dias
+            resp = self.client.get('/api/appointments/availability/', params)
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()['slots']
+        for barber in (self.barber, other):
+            for offset in range(3):
+                day = self.day + datetime.timedelta(days=offset)
+                self.assertEqual(data[str(barber.id)][day.isoformat()], self._slots(date=day.isoformat(), barberId=barber.id))
+        self.assertEqual(data[str(other.id)][(self.day + datetime.timedelta(days=1)).isoformat()], [])
+
+
+class PublicAppointmentCreateTests(TestCase):
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER, display_name='Zé')
+        self.service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+        self.client = APIClient()
+        self.day = timezone.localdate() + datetime.timedelta(days=4)
+
+    def _post(self, **extra):
+        payload = {'date': self.day.isoformat(), 'time': '10:00', 'clientName': 'Cliente', 'clientPhone': '11999999999'}
+        payload.update(extra)
+        return self.client.post('/api/appointments/public/', payload, format='json')
+
+    @contextmanager
+    def _assert_data_queries(self, expected):
+        # BEGIN/COMMIT (ou SAVEPOINT/RELEASE, dentro do TestCase) não contam no orçamento
+        with CaptureQueriesContext(connection) as ctx:
+            yield
+        sqls = [q['sql'] for q in ctx.captured_queries]
+        data = [sql for sql in sqls if sql.split(' ', 1)[0].upper() not in ('BEGIN', 'COMMIT', 'SAVEPOINT', 'RELEASE', 'ROLLBACK')]
+        self.assertEqual(len(data), expected, '\n'.join(data))
+
+    def test_query_budget_by_id_and_by_name(self):
+        # Orçamento (<= 5, contando o que roda após o commit): bloqueios do dia,
+        # INSERT do agendamento, INSERT do AuditLog e o upsert dos lembretes
+        # (ScheduledNotification); no Postgres, mais o NOTIFY do agendador.
+        # Reserva agendada não recalcula o resumo diário.
+        get_catalog()
+        with self._assert_data_queries(4), self.captureOnCommitCallbacks(execute=True):
+            resp = self._post(barberId=self.barber.id, serviceId=self.service.id)
+        self.assertEqual(resp.status_code, 201, resp.content)
+        with self._assert_data_queries(4), self.captureOnCommitCallbacks(execute=True):
+            resp = self._post(barberName='zé', serviceTitle='corte teste', time='11:00')
+        self.assertEqual(resp.status_code, 201, resp.content)
+        data = resp.json()
+        self.assertEqual((data['barber'], data['service']), (self.barber.id, self.service.id))
+        self.assertTrue(data['end_datetime'].startswith(f'{self.day.isoformat()}T11:30'))
+        log = AuditLog.objects.get(target_id=str(data['id']))
+        self.assertEqual((log.payload['barber_label'], log.payload['service_title']), ('Zé', 'Corte Teste'))
+        self.assertEqual(ScheduledNotification.objects.filter(appointment_id=data['id']).count(), 4)
+        self.assertFalse(DailyBarberStats.objects.exists())
+
+    def test_catalog_reload_is_outside_the_budget(self):
+        # Catálogo frio (após uma mudança de barbeiro/serviço): versão, barbeiros
+        # e serviços, uma vez por processo; fica fora do orçamento da reserva
+        with self._assert_data_queries(4 + 3), self.captureOnCommitCallbacks(execute=True):
+            resp = self._post(barberId=self.barber.id, serviceId=self.service.id)
+        self.assertEqual(resp.status_code, 201, resp.content)
+
+    def test_conflict_and_unknown_references(self):
+        self.assertEqual(self._post(barberId=self.barber.id, serviceId=self.service.id).status_code, 201)
+        resp = self._post(barberId=self.barber.id, serviceId=self.service.id, time='10:20')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('Conflito', resp.json()['detail'])
+        self.assertEqual(self._post(barberId=999, serviceId=self.service.id).status_code, 400)
+        self.assertEqual(self._post(barberId=self.barber.id, serviceId='x').status_code, 400)
+        self.assertEqual(self._post(barberName='ninguém', serviceId=self.service.id).status_code, 400)
+
+
+class EffectiveStatusTests(TestCase):
+    """Appointment.objects.with_effective_status(): vencidos contam como concluídos antes do sweeper."""
+
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+        now = timezone.now()
+        self.appts = {}
+        for name, end, status in (
+            ('past_scheduled', now - datetime.timedelta(hours=1), Appointment.STATUS_SCHEDULED),
+            ('future_scheduled', now + datetime.timedelta(hours=2), Appointment.STATUS_SCHEDULED),
+            ('past_cancelled', now - datetime.timedelta(hours=3), Appointment.STATUS_CANCELLED),
+            ('past_done', now - datetime.timedelta(hours=5), Appointment.STATUS_DONE),
+        ):
+            self.appts[name] = Appointment.objects.create(
+                barber=self.barber, client_name=name, client_phone='1', service=service, status=status,
+                start_datetime=end - datetime.timedelta(minutes=30), end_datetime=end,
+            )
+
+    def test_annotation(self):
+        effective = dict(Appointment.objects.with_effective_status().values_list('client_name', 'effective_status'))
+        self.assertEqual(effective, {
+            'past_scheduled': Appointment.STATUS_DONE,
+            'future_scheduled': Appointment.STATUS_SCHEDULED,
+            'past_cancelled': Appointment.STATUS_CANCELLED,
+            'past_done': Appointment.STATUS_DONE,
+        })
+        # O status gravado não muda; `now` pode ser fixado
+        self.assertEqual(Appointment.objects.get(pk=self.appts['past_scheduled'].pk).status, Appointment.STATUS_SCHEDULED)
+        earlier = timezone.now() - datetime.timedelta(days=1)
+        self.assertEqual(
+            Appointment.objects.with_effective_status(now=earlier).get(pk=self.appts['past_scheduled'].pk).effective_status,
+            Appointment.STATUS_SCHEDULED,
+        )
+
+    def test_status_filter_on_api_uses_effective_status(self):
+        client = APIClient()
+        client.force_authenticate(self.barber)
+
+        def names(status):
+            resp = client.get('/api/appointments/', {'status': status})
+            self.assertEqual(resp.status_code, 200)
+            return {(item['client_name'], item['status']) for item in resp.json()['results']}
+
+        self.assertEqual(names('done'), {('past_scheduled', 'done'), ('past_done', 'done')})
+        self.assertEqual(names('scheduled'), {('future_scheduled', 'scheduled')})
+        self.assertEqual(names('cancelled'), {('past_cancelled', 'cancelled')})
+
+
+class AppointmentListPaginationTests(TestCase):
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.client = APIClient()
+        self.client.force_authenticate(self.barber)
+        self.day = timezone.localdate() - datetime.timedelta(days=10)
+        appts = []
+        for i in range(25):
+            # vários agendamentos no mesmo início para exercitar o desempate por id
+            day = self.day + datetime.timedelta(days=i // 10)
+            start = _local(day, 9 * 60 + (i % 10) // 3 * 60)
+            appts.append(Appointment(
+                barber=self.barber, client_name=f'Cliente {i}', client_phone='11999999999', service=self.service,
+                start_datetime=start, end_datetime=start + datetime.timedelta(minutes=30),
+                status=Appointment.STATUS_CANCELLED,
+            ))
+        Appointment.objects.bulk_create(appts)
+
+    def _all_pages(self, params):
+        url, ids = '/api/appointments/', []
+        while url:
+            resp = self.client.get(url, params)
+            self.assertEqual(resp.status_code, 200)
+            data = resp.json()
+            ids.extend(item['id'] for item in data['results'])
+            url, params = data['next'], None
+        return ids
+
+    def test_pages_cover_every_appointment_once_in_keyset_order(self):
+        ids = self._all_pages({'page_size': 4})
+        expected = list(Appointment.objects.order_by('start_datetime', 'id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_range_filters_still_apply(self):
+        params = {'page_size': 3, 'start': self.day.isoformat(), 'end': self.day.isoformat()}
+        ids = self._all_pages(params)
+        self.assertEqual(len(ids), 10)
+        self.assertEqual(self._all_pages({'page_size': 3, 'status': 'scheduled'}), [])
+
+    def test_sparse_fields_match_full_serializer(self):
+        full = self.client.get('/api/appointments/', {'page_size': 5}).json()['results']
+        fields = 'id,start_datetime,end_datetime,status,barber,created_at'
+        with self.assertNumQueries(1):
+            slim = self.client.get('/api/appointments/', {'page_size': 5, 'fields': fields}).json()['results']
+        self.assertEqual(slim, [{k: row[k] for k in fields.split(',')} for row in full])
+        self.assertEqual(self.client.get('/api/appointments/', {'fields': 'id,senha'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/appointments/', {'expand': 'notes'}).status_code, 400)
+
+    def test_expand_uses_one_join_in_both_paths(self):
+        with self.assertNumQueries(1):
+            full = self.client.get('/api/appointments/', {'page_size': 5, 'expand': 'barber,service'}).json()['results']
+        self.assertEqual(full[0]['barber'], {'id': self.barber.id, 'name': 'barbeiro'})
+        self.assertEqual(full[0]['service'], {'id': self.service.id, 'title': 'Corte'})
+        with self.assertNumQueries(1):
+            slim = self.client.get('/api/appointments/', {'page_size': 5, 'fields': 'id', 'expand': 'barber,service'}).json()['results']
+        self.assertEqual(slim, [{k: row[k] for k in ('id', 'barber', 'service')} for row in full])
+
+class ChangesEndpointTests(TestCase):
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.other = User.objects.create_user(username='outro', password='x', role=User.BARBER)
+        self.service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.client = APIClient()
+        self.client.force_authenticate(self.barber)
+        self.day = timezone.localdate() + datetime.timedelta(days=6)
+
+    def _book(self, barber, start_min):
+        return Appointment.objects.create(
+            barber=barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+            start_datetime=_local(self.day, start_min), end_datetime=_local(self.day, start_min + 30),
+        )
+
+    def _changes(self, token, **params):
+        resp = self.client.get('/api/appointments/changes/', {'since': token, **params})
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_returns_only_rows_changed_since_token(self):
+        old = self._book(self.barber, 9 * 60)
+        past = timezone.now() - datetime.timedelta(minutes=10)
+        Appointment.objects.filter(pk=old.pk).update(updated_at=past)
+        token = self.client.get('/api/appointments/changes/').json()['token']
+
+        appt = self._book(self.barber, 11 * 60)
+        self._book(self.other, 11 * 60)  # outro barbeiro: fora do escopo
+        block = TimeBlock.objects.create(barber=self.barber, date=self.day, start_time=datetime.time(14, 0), end_time=datetime.time(15, 0))
+        data = self._changes(token)
+        self.assertEqual([a['id'] for a in data['appointments']], [appt.id])
+        self.assertEqual([b['id'] for b in data['timeBlocks']], [block.id])
+
+        token = data['token']
+        Appointment.objects.filter(pk__in=[appt.pk]).update(updated_at=past)
+        TimeBlock.objects.filter(pk=block.pk).update(updated_at=past)
+        block_id = block.id
+        block.delete()
+        appt.status = Appointment.STATUS_CANCELLED
+        appt.save()
+        data = self._changes(token)
+        self.assertEqual([(a['id'], a['status']) for a in data['appointments']], [(appt.id, 'cancelled')])
+        self.assertEqual(data['deleted'], {'appointments': [], 'timeBlocks': [block_id]})
+
+    def test_invalid_and_expired_tokens(self):
+        from .changes import CHANGES_RETENTION, encode_token
+        resp = self.client.get('/api/appointments/changes/', {'since': 'não-é-cursor'})
+        self.assertEqual(resp.status_code, 400)
+        expired = encode_token(timezone.now() - CHANGES_RETENTION - datetime.timedelta(days=1))
+        resp = self.client.get('/api/appointments/changes/', {'since': expired})
+        self.assertEqual(resp.status_code, 410)
+        self.assertIn('token', resp.json())
+
+class SlotCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.client = APIClient()
+        self.day = timezone.localdate() + datetime.timedelta(days=2)
+        self.params = {'date': self.day.isoformat(), 'barberId': self.barber.id, 'serviceId': self.service.id}
+
+    def _slots(self):
+        return self.client.get('/api/appointments/available-slots/', self.params).json()['slots']
+
+    def test_second_call_is_served_from_cache(self):
+        from .slot_cache import stats
+        first = self._slots()
+        with self.assertNumQueries(0):  # serviço do catálogo em memória, horários do cache
+            self.assertEqual(self._slots(), first)
+        self.assertEqual(stats()['hits'], 1)
+
+    def test_appointment_and_time_block_changes_invalidate(self):
+        self.assertIn('10:00', self._slots())
+        with self.captureOnCommitCallbacks(execute=True):
+            appt = Appointment.objects.create(
+                barber=self.barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+                start_datetime=_local(self.day, 10 * 60), end_datetime=_local(self.day, 10 * 60 + 30),
+            )
+        self.assertNotIn('10:00', self._slots())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            appt.status = Appointment.STATUS_CANCELLED
+            appt.save()
+        self.assertIn('10:00', self._slots())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            block = TimeBlock.objects.create(barber=self.barber, date=self.day, full_day=True)
+        self.assertEqual(self._slots(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            block.delete()
+        self.assertIn('10:00', self._slots())
+
+    def test_next_available_picks_earliest_across_barbers(self):
+        other = User.objects.create_user(username='outro', password='x', role=User.BARBER)
+        # barbeiro ocupado das 8h às 10h; outro bloqueado o dia todo
+        Appointment.objects.create(
+            barber=self.barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+            start_datetime=_local(self.day, 8 * 60), end_datetime=_local(self.day, 10 * 60),
+        )
+        TimeBlock.objects.create(barber=other, date=self.day, full_day=True)
+        resp = self.client.get('/api/appointments/next-available/', {
+            'serviceId': self.service.id, 'after': self.day.isoformat(), 'limit': 3,
+        })
+        self.assertEqual(resp.status_code, 200)
+        results = resp.json()['results']
+        self.assertEqual([(r['barberId'], r['date'], r['time']) for r in results], [
+            (self.barber.id, self.day.isoformat(), t) for t in ('10:10', '10:20', '10:30')
+        ])
+
+        resp = self.client.get('/api/appointments/next-available/', {
+            'serviceId': self.service.id, 'after': f'{self.day.isoformat()}T19:35', 'limit': 4,
+        })
+        results = resp.json()['results']
+        next_day = (self.day + datetime.timedelta(days=1)).isoformat()
+        self.assertEqual([(r['date'], r['time']) for r in results], [(next_day, '08:00')] * 2 + [(next_day, '08:10')] * 2)
+        # empates seguem a ordem por nome: 'barbeiro' antes de 'outro'
+        self.assertEqual([r['barberId'] for r in results[:2]], [self.barber.id, other.id])
+
+
+class AppointmentOverlapTests(TransactionTestCase):
+    """Não sobreposição garantida pelo banco (migração 0008), inclusive sob concorrência."""
+
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.day = timezone.localdate() + datetime.timedelta(days=5)
+
+    def _book(self, start_min, length=30, **kwargs):
+        return Appointment.objects.create(
+            barber=self.barber, client_name='Cliente', client_phone='11999999999', service=self.service,
+            start_datetime=_local(self.day, start_min), end_datetime=_local(self.day, start_min + length), **kwargs,
+        )
+
+    def test_overlap_rejected_by_database_without_clean(self):
+        first = self._book(10 * 60)
+        with self.assertRaises(ValidationError):
+            self._book(10 * 60 + 30)  # dentro da folga de 5 min
+        self._book(10 * 60 + 35)  # encosta na folga: permitido
+        # mesmo pulando Model.save(), o banco recusa
+        with self.assertRaises(IntegrityError):
+            Appointment.objects.filter(pk=first.pk).update(
+                start_datetime=_local(self.day, 10 * 60 + 20), end_datetime=_local(self.day, 10 * 60 + 50),
+            )
+        first.status = Appointment.STATUS_CANCELLED
+        first.save()
+        self._book(10 * 60)
+        self.assertEqual(Appointment.objects.filter(status=Appointment.STATUS_SCHEDULED).count(), 2)
+
+    def test_time_block_conflict_is_raised(self):
+        TimeBlock.objects.create(barber=self.barber, date=self.day, start_time=datetime.time(12, 0), end_time=datetime.time(13, 0))
+        with self.assertRaises(ValidationError):
+            self._book(12 * 60 + 30)
+
+    def test_concurrent_bookings_of_same_slot(self):
+        threads_count = 8
+        barrier = threading.Barrier(threads_count)
+        outcomes = []
+        lock = threading.Lock()
+
+        def worker(i):
+            try:
+                barrier.wait()
+                for _ in range(50):
+                    try:
+                        # inícios diferentes, todos sobrepostos entre si
+                        self._book(15 * 60 + i * 2)
+                        result = 'ok'
+                        break
+                    except OperationalError as exc:
+                        # SQLite: banco ocupado por outro escritor; tenta de novo
+                        if 'locked' in str(exc):
+                            continue
+                        result = f'error: {exc}'
+                        break
+                    except ValidationError:
+                        result = 'conflict'
+                        break
+                else:
+                    result = 'busy'
+                with lock:
+                    outcomes.append(result)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+        # Lembretes pós-commit (robust=True) também esbarram no lock do SQLite e
+        # o Django registra cada falha com traceback; não interessam aqui
+        with mock.patch.object(logging.getLogger('django.db.backends.base'), 'disabled', True):
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(outcomes.count('ok'), 1, outcomes)
+        self.assertEqual(outcomes.count('conflict'), threads_count - 1, outcomes)
+        self.assertEqual(Appointment.objects.filter(barber=self.barber, status=Appointment.STATUS_SCHEDULED).count(), 1)
+
+
+class ReminderCommandTests(TestCase):
+    """send_appointment_notifications: uma passada em lote para todos os lembretes."""
+
+    def setUp(self):
+        self.service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=5)
+
+    def _book(self, count):
+        now = timezone.now()
+        expected = set()
+        for i in range(count):
+            barber = User.objects.create_user(username=f'r{count}_{i}', password='x', role=User.BARBER)
+            for offset, type_ in ((20, AppointmentNotification.TYPE_ALERT_0),
+                                  (15 * 60 + 20, AppointmentNotification.TYPE_ALERT_15),
+                                  (30 * 60 + 20, AppointmentNotification.TYPE_GREETING_30)):
+                start = now + datetime.timedelta(seconds=offset)
+                appt = Appointment.objects.create(
+                    barber=barber, client_name='c', service=self.service,
+                    start_datetime=start, end_datetime=start + datetime.timedelta(minutes=5),
+                )
+                NotificationSubscription.objects.create(appointment=appt, token=f't{appt.id}')
+                expected.add((appt.id, type_))
+            # criado há 1 min: também recebe a confirmação
+            Appointment.objects.filter(pk=appt.pk).update(created_at=now - datetime.timedelta(minutes=1))
+            expected.add((appt.id, AppointmentNotification.TYPE_CONFIRMATION))
+        return expected
+
+    def _run(self):
+        queued = PushOutbox.objects.count()
+        with CaptureQueriesContext(connection) as ctx:
+            call_command('send_appointment_notifications', stdout=io.StringIO())
+        return len(ctx.captured_queries), PushOutbox.objects.count() - queued
+
+    def test_query_count_is_flat_and_reminders_are_not_repeated(self):
+        small = self._book(1)
+        queries_small, pushes = self._run()
+        self.assertEqual(pushes, len(small))
+        self.assertEqual(set(AppointmentNotification.objects.values_list('appointment_id', 'type')), small)
+
+        large = self._book(6)
+        queries_large, pushes = self._run()
+        self.assertEqual(queries_large, queries_small)
+        self.assertEqual(pushes, len(large))
+        self.assertEqual(set(AppointmentNotification.objects.values_list('appointment_id', 'type')), small | large)
+        self.assertEqual(self._run()[1], 0)
+
+
+class FakeMessaging:
+    """Substituto mínimo de firebase_admin.messaging (send_each + exceções)."""
+
+    class UnregisteredError(Exception):
+        code = 'NOT_FOUND'
+
+    class SenderIdMismatchError(Exception):
+        code = 'PERMISSION_DENIED'
+
+    class UnavailableError(Exception):
+        code = 'UNAVAILABLE'
+
+    class InvalidArgumentError(Exception):
+        code = 'INVALID_ARGUMENT'
+
+    class Notification:
+        def __init__(self, title, body):
+            self.title, self.body = title, body
+
+    class Message:
+        def __init__(self, token, notification, data):
+            self.token, self.notification, self.data = token, notification, data
+
+    def __init__(self):
+        self.batches = []
+
+    def send_each(self, messages):
+        self.batches.append(len(messages))
+        errors = {'dead': self.UnregisteredError(), 'busy': self.UnavailableError(), 'bad': ValueError(),
+                  'inv': self.InvalidArgumentError()}
+
+        def response(m):
+            exc = errors.get(m.token.split('-')[0])
+            return mock.Mock(success=exc is None, exception=exc)
+        return mock.Mock(responses=[response(m) for m in messages])
+
+
+class SendPushManyTests(SimpleTestCase):
+    def test_batches_of_500_with_per_token_results(self):
+        fake = FakeMessaging()
+        tokens = [f'ok-{i}' for i in range(1198)] + ['dead-1', 'busy-1', 'bad-1', 'inv-1']
+        with mock.patch.object(fcm, '_ensure_firebase', return_value=True), mock.patch.object(fcm, 'messaging', fake):
+            results = fcm.send_push_many(tokens, 'Promo', 'Corte com desconto')
+        self.assertEqual(fake.batches, [500, 500, 202])
+        self.assertEqual(results[:1198], [fcm.PUSH_SENT] * 1198)
+        self.assertEqual(results[1198:], [fcm.PUSH_UNREGISTERED, fcm.PUSH_RETRYABLE, fcm.PUSH_FAILED, fcm.PUSH_INVALID])
+
+    def test_without_firebase_every_token_fails(self):
+        with mock.patch.object(fcm, '_ensure_firebase', return_value=False):
+            self.assertEqual(fcm.send_push_many(['a', 'b'], 't', 'b'), [fcm.PUSH_FAILED] * 2)
+
+
+class NotificationSchedulerTests(TestCase):
+    """ScheduledNotification mantida pelos sinais e consumida pelo Scheduler (appointments/reminders.py)."""
+
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+
+    def _book(self, start):
+        with self.captureOnCommitCallbacks(execute=True):
+            appt = Appointment.objects.create(
+                barber=self.barber, client_name='c', service=self.service,
+                start_datetime=start, end_datetime=start + datetime.timedelta(minutes=30),
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationSubscription.objects.create(appointment=appt, token=f't{appt.id}')
+        return appt
+
+    def _due(self, appt):
+        return dict(ScheduledNotification.objects.filter(appointment=appt).values_list('type', 'due_at'))
+
+    def test_rows_follow_booking_reschedule_and_cancel(self):
+        start = timezone.now() + datetime.timedelta(hours=2)
+        appt = self._book(start)
+        due = self._due(appt)
+        self.assertEqual(due[AppointmentNotification.TYPE_GREETING_30], start - datetime.timedelta(minutes=30))
+        self.assertEqual(due[AppointmentNotification.TYPE_ALERT_0], start)
+        self.assertIn(AppointmentNotification.TYPE_CONFIRMATION, due)
+
+        appt.start_datetime = start + datetime.timedelta(hours=1)
+        appt.end_datetime = appt.start_datetime + datetime.timedelta(minutes=30)
+        with self.captureOnCommitCallbacks(execute=True):
+            appt.save()
+        self.assertEqual(self._due(appt)[AppointmentNotification.TYPE_ALERT_15], appt.start_datetime - datetime.timedelta(minutes=15))
+
+        appt.status = Appointment.STATUS_CANCELLED
+        with self.captureOnCommitCallbacks(execute=True):
+            appt.save()
+        self.assertEqual(self._due(appt), {})
+
+    def test_scheduler_sends_at_due_time_and_bounds_catchup(self):
+        now = timezone.now()
+        soon = self._book(now + datetime.timedelta(minutes=40))
+        late = self._book(now + datetime.timedelta(minutes=120))
+        ScheduledNotification.objects.filter(appointment=late, type=AppointmentNotification.TYPE_GREETING_30).update(
+            due_at=now - datetime.timedelta(hours=1))
+        scheduler = reminders.Scheduler()
+        # Confirmações (30 s após a criação) e o lembrete muito atrasado vencem aqui
+        self.assertEqual(scheduler.run_once(now + datetime.timedelta(minutes=1)), 2)
+        self.assertEqual({(d['type'], d['appointmentId']) for d in PushOutbox.objects.values_list('data', flat=True)},
+                         {('confirmation', str(soon.id)), ('confirmation', str(late.id))})
+        self.assertFalse(ScheduledNotification.objects.filter(appointment=late, type=AppointmentNotification.TYPE_GREETING_30).exists())
+        self.assertEqual(scheduler.next_due(), soon.start_datetime - datetime.timedelta(minutes=30))
+
+        # Ocioso: só a leitura incremental das mudanças
+        with self.assertNumQueries(1):
+            self.assertEqual(scheduler.run_once(now + datetime.timedelta(minutes=2)), 0)
+
+        self.assertEqual(scheduler.run_once(soon.start_datetime - datetime.timedelta(minutes=30)), 1)
+        self.assertEqual(PushOutbox.objects.latest('pk').data['type'], 'greeting_30')
+        self.assertTrue(AppointmentNotification.objects.filter(appointment=soon, type=AppointmentNotification.TYPE_GREETING_30).exists())
+
+
+class PushOutboxTests(TestCase):
+    """Entrega da fila PushOutbox (appointments/outbox.py)."""
+
+    def _deliver(self, results, now):
+        def send_batch(items):
+            return [results[token] for token, _title, _body, _data in items]
+        with mock.patch.object(outbox, 'send_push_batch', side_effect=send_batch):
+            return outbox.deliver_batch(now=now)
+
+    def test_sent_retried_with_backoff_and_dead_letters(self):
+        now = timezone.now()
+        PushOutbox.objects.bulk_create(PushOutbox(token=t, title='t', body='b', next_attempt_at=now) for t in ('ok', 'busy', 'gone'))
+        results = {'ok': fcm.PUSH_SENT, 'busy': fcm.PUSH_RETRYABLE, 'gone': fcm.PUSH_UNREGISTERED}
+        self.assertEqual(self._deliver(results, now), {'sent': 1, 'retry': 1, 'dead': 1, 'pruned': 0, 'claimed': 3})
+        rows = {r.token: r for r in PushOutbox.objects.all()}
+        self.assertEqual((rows['ok'].status, rows['ok'].attempts), (PushOutbox.STATUS_SENT, 1))
+        self.assertEqual((rows['gone'].status, rows['gone'].last_error), (PushOutbox.STATUS_DEAD, fcm.PUSH_UNREGISTERED))
+        busy = rows['busy']
+        self.assertEqual((busy.status, busy.attempts), (PushOutbox.STATUS_PENDING, 1))
+        wait = (busy.next_attempt_at - now).total_seconds()
+        self.assertTrue(outbox.BACKOFF_BASE_SECONDS / 2 <= wait <= outbox.BACKOFF_BASE_SECONDS + 5, wait)
+
+        # Antes do backoff vencer nada é reivindicado; depois, esgota as tentativas
+        self.assertEqual(self._deliver(results, now)['claimed'], 0)
+        with override_settings(PUSH_OUTBOX_MAX_ATTEMPTS=2):
+            self.assertEqual(self._deliver(results, busy.next_attempt_at)['dead'], 1)
+        self.assertEqual(PushOutbox.objects.get(token='busy').status, PushOutbox.STATUS_DEAD)
+
+    def test_claim_leases_rows_and_backoff_is_capped(self):
+        now = timezone.now()
+        PushOutbox.objects.create(token='a', title='t', body='b', next_attempt_at=now)
+        self.assertEqual(len(outbox.claim(now)), 1)
+        # Reivindicada: outro worker não pega até o prazo do lease
+        self.assertEqual(outbox.claim(now), [])
+        self.assertEqual(len(outbox.claim(now + outbox.CLAIM_LEASE)), 1)
+        rng = random.Random(24)
+        for attempts in range(1, 30):
+            delay = outbox.backoff(attempts, rng).total_seconds()
+            expected = min(outbox.BACKOFF_CAP_SECONDS, outbox.BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+            self.assertTrue(expected / 2 <= delay <= expected)
+
+
+class PushTokenPruningTests(TestCase):
+    """Tokens mortos saem de ClientToken e NotificationSubscription (appointments/push_tokens.py)."""
+
+    def setUp(self):
+        barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+        start = timezone.now() + datetime.timedelta(days=1)
+        self.appt = Appointment.objects.create(
+            barber=barber, client_name='c', service=service,
+            start_datetime=start, end_datetime=start + datetime.timedelta(minutes=30),
+        )
+        for token in ('ok', 'gone', 'malformed'):
+            ClientToken.objects.create(token=token)
+            NotificationSubscription.objects.create(appointment=self.appt, token=token)
+
+    def _deliver(self, results, tokens):
+        now = timezone.now()
+        PushOutbox.objects.bulk_create(PushOutbox(token=t, title='t', body='b', next_attempt_at=now) for t in tokens)
+        with mock.patch.object(outbox, 'send_push_batch', side_effect=lambda items: [results[t] for t, *_ in items]):
+            return outbox.deliver_batch(now=now)
+
+    def test_unregistered_and_invalid_tokens_are_pruned(self):
+        # Mais um envio pendente para o token morto: também é encerrado
+        PushOutbox.objects.create(token='gone', title='t', body='b', next_attempt_at=timezone.now() + datetime.timedelta(hours=1))
+        results = {'ok': fcm.PUSH_SENT, 'gone': fcm.PUSH_UNREGISTERED, 'malformed': fcm.PUSH_INVALID}
+        self.assertEqual(self._deliver(results, ['ok', 'gone', 'malformed'])['pruned'], 2)
+        self.assertEqual(list(ClientToken.objects.values_list('token', flat=True)), ['ok'])
+        self.assertEqual(list(NotificationSubscription.objects.values_list('token', flat=True)), ['ok'])
+        self.assertFalse(PushOutbox.objects.filter(token='gone', status=PushOutbox.STATUS_PENDING).exists())
+
+    def test_invalid_alone_does_not_prune(self):
+        # Lote inteiro recusado como inválido pode ser erro de payload, não de token
+        counts = self._deliver({'malformed': fcm.PUSH_INVALID}, ['malformed'])
+        self.assertEqual((counts['dead'], counts['pruned']), (1, 0))
+        self.assertTrue(ClientToken.objects.filter(token='malformed').exists())
+
+    def test_cleanup_command_expires_stale_tokens_in_batches(self):
+        now = timezone.now()
+        ClientToken.objects.bulk_create(ClientToken(token=f'old-{i}') for i in range(25))
+        ClientToken.objects.filter(token__startswith='old-').update(last_seen_at=now - datetime.timedelta(days=200))
+        NotificationSubscription.objects.create(appointment=self.appt, token='old-3')
+        with mock.patch.object(push_tokens, 'prune_tokens', wraps=push_tokens.prune_tokens) as prune:
+            call_command('cleanup_push_tokens', '--days', '120', '--batch-size', '10', stdout=io.StringIO())
+        self.assertEqual(prune.call_count, 3)
+        self.assertFalse(ClientToken.objects.filter(token__startswith='old-').exists())
+        self.assertFalse(NotificationSubscription.objects.filter(token='old-3').exists())
+        self.assertEqual(ClientToken.objects.count(), 3)
@@ -2,16 +2,20 @@ from rest_framework import viewsets, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action, authentication_classes
 from rest_framework.views import APIView
+from rest_framework.pagination import CursorPagination
 from rest_framework import status
+from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from .models import Appointment
-from .models import TimeBlock
-from .models import NotificationSubscription, AppointmentNotification, ClientToken
-from services.models import Service
-from django.db.models import Q
-from .serializers import AppointmentSerializer
+from .models import NotificationSubscription, AppointmentNotification, ClientToken, Tombstone
+from .changes import CHANGES_RETENTION, changes_since, decode_token, encode_token
+from .push_tokens import prune_tokens
+from services.catalog import get_catalog
+from .serializers import AppointmentSerializer, PublicAppointmentSerializer, TimeBlockSerializer, compact_converter, compact_rows, parse_sparse_params
+from .slot_cache import cached_slots, next_available as find_next_available
 from sales.models import Sale
+from sales.rollups import schedule_refresh
 from users.models import User
 from decimal import Decimal
 from django.utils.text import slugify
@@ -30,16 +34,53 @@ class IsAdminOrOwnRecords(permissions.BasePermission):
         return obj.barber_id == request.user.id
 
 
+def _requested_duration(request):
+    """Duração pedida (serviceId ou durationMinutes). Retorna (minutos, None) ou (None, resposta 400)."""
+    duration_minutes = None
+    service_id = request.query_params.get('serviceId')
+    if service_id:
+        svc = get_catalog().service(service_id)
+        duration_minutes = getattr(svc, 'duration_minutes', None)
+    if duration_minutes is None:
+        dm = request.query_params.get('durationMinutes')
+        if dm:
+            try:
+                duration_minutes = int(dm)
+            except ValueError:
+                return None, Response({'detail': 'durationMinutes inválido.'}, status=400)
+    if not duration_minutes or duration_minutes <= 0:
+        return None, Response({'detail': 'Duração do serviço é obrigatória.'}, status=400)
+    return duration_minutes, None
+
+
+class AppointmentCursorPagination(CursorPagination):
+    """Paginação por cursor (keyset) em (start_datetime, id).
+
+    Cada página filtra a partir da última posição em vez de usar OFFSET, então o
+    custo não cresce com o histórico. Tamanho padrão em APPOINTMENTS_PAGE_SIZE,
+    ajustável por ?page_size= até max_page_size.
+    """
+    ordering = ('start_datetime', 'id')
+    page_size = settings.APPOINTMENTS_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
 class AppointmentViewSet(viewsets.ModelViewSet):
     queryset = Appointment.objects.all().order_by('start_datetime')
     serializer_class = AppointmentSerializer
     permission_classes = [IsAdminOrOwnRecords]
+    pagination_class = AppointmentCursorPagination
 
     def get_queryset(self):
         qs = super().get_queryset()
         if 'pk' in getattr(self, 'kwargs', {}):
             return qs
 
+        qs = qs.with_effective_status()
+        expand = self._sparse_params()[1]
+        if expand:
+            qs = qs.select_related(*expand)
         user = self.request.user
         barber_id = self.request.query_params.get('barberId')
         all_param = str(self.request.query_params.get('all') or '').lower() in ('1', 'true', 'on', 'yes')
@@ -53,7 +94,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             qs = qs.filter(start_datetime__date=date)
         status_param = self.request.query_params.get('status')
         if status_param:
-            qs = qs.filter(status=status_param)
+            qs = qs.filter(effective_status=status_param)
         start_param = self.request.query_params.get('start')
         end_param = self.request.query_params.get('end')
         tz = timezone.get_current_timezone()
@@ -81,6 +122,32 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             qs = qs.filter(end_datetime__gte=timezone.now())
         return qs
 
+    def _sparse_params(self):
+        if not hasattr(self, '_sparse'):
+            self._sparse = parse_sparse_params(self.request.query_params)
+        return self._sparse
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['expand'] = self._sparse_params()[1]
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """Listagem paginada; ?fields= (colunas) e ?expand=barber,service (objetos compactos).
+
+        Com ?fields= as linhas saem direto de values(), sem instanciar o
+        ModelSerializer; sem ele, o serializer completo com select_related nas
+        relações expandidas.
+        """
+        fields, expand = self._sparse_params()
+        if fields is None:
+            return super().list(request, *args, **kwargs)
+        qs = compact_rows(self.filter_queryset(self.get_queryset()), fields, expand)
+        page = self.paginate_queryset(qs)
+        convert = compact_converter(fields, expand)
+        return self.get_paginated_response([convert(row) for row in page])
+
     def perform_create(self, serializer):
         serializer.save()
 
@@ -94,7 +161,10 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         try:
             new_status = request.data.get('status')
             if new_status == Appointment.STATUS_CANCELLED:
-                Sale.objects.filter(appointment=appt).update(status='cancelled')
+                linked_sales = Sale.objects.filter(appointment=appt)
+                keys = set(linked_sales.values_list('barber_id', 'created_at'))
+                linked_sales.update(status='cancelled')
+                schedule_refresh(keys)
         except Exception:
             pass
         return resp
@@ -138,21 +208,61 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if total == 0:
             return Response({'ok': False, 'detail': 'Nenhum token inscrito para este agendamento.'}, status=404)
         try:
-            from .fcm import send_push
+            from .fcm import PUSH_SENT, PUSH_UNREGISTERED, send_push_many
         except Exception:
             return Response({'ok': False, 'detail': 'FCM não configurado no servidor.'}, status=500)
-        sent = 0
-        for s in subs:
-            try:
-                if send_push(s.token, title, body, data):
-                    sent += 1
-            except Exception:
-                pass
-        return Response({'ok': True, 'sent': sent, 'total': total})
+        tokens = list(subs.values_list('token', flat=True))
+        results = send_push_many(tokens, title, body, data)
+        dead = [t for t, r in zip(tokens, results) if r == PUSH_UNREGISTERED]
+        if dead:
+            prune_tokens(dead)
+        return Response({'ok': True, 'sent': results.count(PUSH_SENT), 'total': total})
+
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        """Mudanças desde o cursor ?since= (ver appointments/changes.py).
+
+        Sem since, devolve só o cursor atual: pegue-o antes de carregar a lista
+        completa. barberId/all seguem as mesmas regras da listagem. Cursores
+        mais antigos que CHANGES_RETENTION recebem 410 e devem recarregar tudo.
+        """
+        now = timezone.now()
+        token = encode_token(now)
+        since_param = (request.query_params.get('since') or '').strip()
+        if not since_param:
+            return Response({'token': token, 'appointments': [], 'timeBlocks': [], 'deleted': {'appointments': [], 'timeBlocks': []}})
+        try:
+            since = decode_token(since_param)
+        except ValueError:
+            return Response({'detail': 'Parâmetro "since" inválido.'}, status=400)
+        if since < now - CHANGES_RETENTION:
+            return Response({'detail': 'Cursor expirado; recarregue a lista completa.', 'token': token}, status=410)
+
+        user = request.user
+        barber_id = None
+        all_param = str(request.query_params.get('all') or '').lower() in ('1', 'true', 'on', 'yes')
+        if not all_param:
+            if user.role == User.BARBER:
+                barber_id = user.id
+            elif request.query_params.get('barberId'):
+                try:
+                    barber_id = int(request.query_params['barberId'])
+                except ValueError:
+                    return Response({'detail': 'barberId inválido.'}, status=400)
+        appointments, blocks, tombstones = changes_since(since, barber_id)
+        deleted = {'appointments': [], 'timeBlocks': []}
+        for target_type, target_id in tombstones.values_list('target_type', 'target_id'):
+            deleted['appointments' if target_type == Tombstone.TYPE_APPOINTMENT else 'timeBlocks'].append(target_id)
+        return Response({
+            'token': token,
+            'appointments': AppointmentSerializer(appointments, many=True).data,
+            'timeBlocks': TimeBlockSerializer(blocks, many=True).data,
+            'deleted': deleted,
+        })
 
     @action(detail=False, methods=['get'], url_path='barbers')
     def list_barbers(self, request):
-        barbers = User.objects.filter(role=User.BARBER).order_by('display_name', 'username')
+        barbers = get_catalog().barbers
         data = [
             {
                 'id': b.id,
@@ -180,9 +290,7 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if not barber_id:
             barber_name = request.query_params.get('barberName')
             if barber_name:
-                candidate = User.objects.filter(role=User.BARBER).filter(
-                    Q(username__iexact=barber_name.strip()) | Q(display_name__iexact=barber_name.strip())
-                ).first()
+                candidate = get_catalog().barber_by_name(barber_name)
                 if candidate:
                     barber_id = candidate.id
                 else:
@@ -190,71 +298,138 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             else:
                 return Response({'detail': 'Parâmetro "barberId" ou "barberName" é obrigatório.'}, status=400)
 
-        duration_minutes = None
-        service_id = request.query_params.get('serviceId')
-        if service_id:
-            svc = Service.objects.filter(pk=service_id).first()
-            duration_minutes = getattr(svc, 'duration_minutes', None)
-        if duration_minutes is None:
-            dm = request.query_params.get('durationMinutes')
-            if dm:
-                try:
-                    duration_minutes = int(dm)
-                except ValueError:
-                    return Response({'detail': 'durationMinutes inválido.'}, status=400)
-        if not duration_minutes or duration_minutes <= 0:
-            return Response({'detail': 'Duração do serviço é obrigatória.'}, status=400)
+        duration_minutes, error = _requested_duration(request)
+        if error:
+            return error
 
-        tz = timezone.get_current_timezone()
-        window_start_naive = datetime.datetime.combine(day, datetime.time(8, 0))
-        window_end_naive = datetime.datetime.combine(day, datetime.time(20, 0))
-        window_start = timezone.make_aware(window_start_naive, tz)
-        window_end = timezone.make_aware(window_end_naive, tz)
+        try:
+            barber_id = int(barber_id)
+        except (TypeError, ValueError):
+            return Response({'detail': 'barberId inválido.'}, status=400)
+        found = cached_slots([barber_id], [day], datetime.timedelta(minutes=duration_minutes))
+        slots = [cur.strftime('%H:%M') for cur in found[(barber_id, day)]]
+
+        return Response({'slots': slots})
 
+    @action(detail=False, methods=['get'], url_path='availability', permission_classes=[permissions.AllowAny], authentication_classes=[])
+    def availability(self, request):
+        """Horários livres de vários barbeiros e dias em uma só chamada.
+
+        Query params: from/to (YYYY-MM-DD, padrão: hoje + 6 dias, máx. 31 dias),
+        barberIds (lista separada por vírgula, padrão: todos os barbeiros) e
+        serviceId ou durationMinutes. Resposta: {"slots": {barberId: {data: ["HH:MM", ...]}}}.
+        """
+        today = timezone.localdate()
+        try:
+            date_from = datetime.date.fromisoformat(request.query_params.get('from') or today.isoformat())
+            date_to = datetime.date.fromisoformat(request.query_params.get('to') or (date_from + datetime.timedelta(days=6)).isoformat())
+        except ValueError:
+            return Response({'detail': 'Data inválida.'}, status=400)
+        if date_to < date_from:
+            return Response({'detail': 'Parâmetro "to" deve ser posterior a "from".'}, status=400)
+        if (date_to - date_from).days >= 31:
+            return Response({'detail': 'Intervalo máximo de 31 dias.'}, status=400)
+
+        barber_ids_param = (request.query_params.get('barberIds') or '').strip()
+        barbers = get_catalog().barbers
+        if barber_ids_param:
+            try:
+                ids = {int(x) for x in barber_ids_param.split(',') if x.strip()}
+            except ValueError:
+                return Response({'detail': 'barberIds inválido.'}, status=400)
+            barbers = [b for b in barbers if b.id in ids]
+        barber_ids = [b.id for b in barbers]
+
+        duration_minutes, error = _requested_duration(request)
+        if error:
+            return error
+
+        days = [date_from + datetime.timedelta(days=i) for i in range((date_to - date_from).days + 1)]
+        found = cached_slots(barber_ids, days, datetime.timedelta(minutes=duration_minutes))
+        slots = {
+            str(b): {day.isoformat(): [cur.strftime('%H:%M') for cur in found[(b, day)]] for day in days}
+            for b in barber_ids
+        }
+        return Response({
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'durationMinutes': duration_minutes,
+            'slots': slots,
+        })
+
+    @action(detail=False, methods=['get'], url_path='next-available', permission_classes=[permissions.AllowAny], authentication_classes=[])
+    def next_available(self, request):
+        """Primeiros horários livres com qualquer barbeiro.
+
+        Query params: serviceId ou durationMinutes, after (YYYY-MM-DD ou
+        YYYY-MM-DDTHH:MM, padrão: agora), limit (padrão 5, máx. 50) e barberIds
+        opcional. Mesmas regras de available-slots (08–20h, passos de 10 min,
+        buffer de 5 min e bloqueios).
+        """
         now_local = timezone.localtime()
-        if day == now_local.date():
-            minutes = (now_local.minute + 9) // 10 * 10
-            now_rounded = now_local.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(minutes=minutes)
-            if now_rounded > window_start:
-                window_start = now_rounded
-
-        existing = Appointment.objects.filter(
-            barber_id=barber_id,
-            start_datetime__lt=window_end,
-            end_datetime__gt=window_start,
-        ).exclude(status=Appointment.STATUS_CANCELLED).values('start_datetime', 'end_datetime')
-
-        blocks = TimeBlock.objects.filter(barber_id=barber_id, date=day)
-        if blocks.filter(full_day=True).exists():
-            return Response({'slots': []})
-
-        step = datetime.timedelta(minutes=10)
-        duration = datetime.timedelta(minutes=duration_minutes)
-        slots = []
-        cur = window_start
-        ranges = [(timezone.localtime(r['start_datetime']), timezone.localtime(r['end_datetime'])) for r in existing]
-        tz = timezone.get_current_timezone()
-        for b in blocks:
-            if not b.full_day and b.start_time and b.end_time:
-                bs_naive = datetime.datetime.combine(day, b.start_time)
-                be_naive = datetime.datetime.combine(day, b.end_time)
-                bs = timezone.make_aware(bs_naive, tz)
-                be = timezone.make_aware(be_naive, tz)
-                ranges.append((timezone.localtime(bs), timezone.localtime(be)))
-        while cur + duration <= window_end:
-            proposed_start = cur
-            proposed_end = cur + duration
-            buf = datetime.timedelta(minutes=5)
-            conflict = any((rs - buf) < proposed_end and (re + buf) > proposed_start for rs, re in ranges)
-            if not conflict:
-                slots.append(proposed_start.strftime('%H:%M'))
-            cur += step
+        after_param = (request.query_params.get('after') or '').strip()
+        after_local = now_local
+        if after_param:
+            try:
+                if 'T' in after_param or ' ' in after_param:
+                    after_dt = datetime.datetime.fromisoformat(after_param)
+                else:
+                    after_dt = datetime.datetime.combine(datetime.date.fromisoformat(after_param), datetime.time(0, 0))
+            except ValueError:
+                return Response({'detail': 'Parâmetro "after" inválido.'}, status=400)
+            if timezone.is_naive(after_dt):
+                after_dt = timezone.make_aware(after_dt, timezone.get_current_timezone())
+            after_local = max(timezone.localtime(after_dt), now_local)
 
-        return Response({'slots': slots})
+        try:
+            limit = int(request.query_params.get('limit') or 5)
+        except ValueError:
+            return Response({'detail': 'limit inválido.'}, status=400)
+        limit = max(1, min(limit, 50))
+
+        barbers = get_catalog().barbers
+        barber_ids_param = (request.query_params.get('barberIds') or '').strip()
+        if barber_ids_param:
+            try:
+                ids = {int(x) for x in barber_ids_param.split(',') if x.strip()}
+            except ValueError:
+                return Response({'detail': 'barberIds inválido.'}, status=400)
+            barbers = [b for b in barbers if b.id in ids]
+
+        duration_minutes, error = _requested_duration(request)
+        if error:
+            return error
+
+        names = {b.id: (b.display_name or b.username) for b in barbers}
+        found = find_next_available(list(names), datetime.timedelta(minutes=duration_minutes), after_local, limit, now_local=now_local)
+        results = [
+            {
+                'barberId': barber_id,
+                'barberName': names[barber_id],
+                'date': start.date().isoformat(),
+                'time': start.strftime('%H:%M'),
+                'start': start.isoformat(),
+            }
+            for start, barber_id in found
+        ]
+        return Response({'durationMinutes': duration_minutes, 'results': results})
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class PublicAppointmentCreate(APIView):
+    """Reserva pública.
+
+    Orçamento de até 5 consultas (coberto por teste), fora o controle de
+    transação e contando o que roda após o commit: bloqueios do dia, INSERT do
+    agendamento, INSERT do AuditLog e o upsert dos lembretes (mais o NOTIFY do
+    agendador no Postgres). Uma reserva agendada não mexe no resumo diário, então
+    não há recálculo. Barbeiro e serviço vêm do catálogo em memória
+    (services.catalog); a recarga dele (até 3 consultas, só depois de uma
+    mudança de barbeiro/serviço ou a cada CATALOG_CHECK_SECONDS para conferir a
+    versão) fica fora do orçamento. Os objetos do catálogo são reaproveitados
+    pela validação, pelo Model.save e pelo sinal de auditoria. O conflito de
+    horário é garantido pelo banco (ver Appointment.save).
+    """
     permission_classes = [permissions.AllowAny]
     authentication_classes = []
 
@@ -264,35 +439,33 @@ class PublicAppointmentCreate(APIView):
         barber_id = data.get('barber') or data.get('barberId')
         service_id = data.get('service') or data.get('serviceId')
 
-        if not barber_id:
+        catalog = get_catalog()
+        if barber_id:
+            barber = catalog.barber(barber_id)
+            if not barber:
+                return Response({'detail': 'Barbeiro inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
             barber_name = data.get('barber_name') or data.get('barberName') or data.get('barberUsername')
             if barber_name:
-                candidate = User.objects.filter(role=User.BARBER).filter(
-                    Q(username__iexact=barber_name.strip()) | Q(display_name__iexact=barber_name.strip())
-                ).first()
-                if candidate:
-                    barber_id = candidate.id
-                else:
+                barber = catalog.barber_by_name(barber_name)
+                if not barber:
                     return Response({'detail': f'Barbeiro "{barber_name}" não encontrado.'}, status=status.HTTP_400_BAD_REQUEST)
             else:
                 return Response({'detail': 'Barbeiro é obrigatório.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not service_id:
+        if service_id:
+            svc = catalog.service(service_id)
+            if not svc:
+                return Response({'detail': 'Serviço inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+        else:
             service_title = data.get('service_title') or data.get('serviceTitle')
             if service_title:
-                candidate_svc = Service.objects.filter(title__iexact=service_title.strip()).first()
-                if candidate_svc:
-                    service_id = candidate_svc.id
-                else:
+                svc = catalog.service_by_title(service_title)
+                if not svc:
                     return Response({'detail': f'Serviço "{service_title}" não encontrado.'}, status=status.HTTP_400_BAD_REQUEST)
             else:
                 return Response({'detail': 'Serviço é obrigatório.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            barber = User.objects.get(pk=barber_id, role=User.BARBER)
-        except User.DoesNotExist:
-            return Response({'detail': 'Barbeiro inválido.'}, status=status.HTTP_400_BAD_REQUEST)
-
         start_dt = data.get('start_datetime') or data.get('startDatetime')
         end_dt = data.get('end_datetime') or data.get('endDatetime')
         if not start_dt:
@@ -310,34 +483,28 @@ class PublicAppointmentCreate(APIView):
             except Exception:
                 return Response({'detail': 'Data/horário inválidos.'}, status=status.HTTP_400_BAD_REQUEST)
         if not end_dt:
+            duration_minutes = getattr(svc, 'duration_minutes', None) or 30
             try:
-                svc = Service.objects.filter(pk=service_id).first()
-                duration_minutes = getattr(svc, 'duration_minutes', None) or 30
-                try:
-                    start_parsed = datetime.datetime.fromisoformat(str(start_dt))
-                except Exception:
-                    return Response({'detail': 'Início inválido.'}, status=status.HTTP_400_BAD_REQUEST)
-                if timezone.is_naive(start_parsed):
-                    start_parsed = timezone.make_aware(start_parsed, timezone.get_current_timezone())
-                end_parsed = start_parsed + datetime.timedelta(minutes=duration_minutes)
-                end_dt = end_parsed.isoformat(timespec='seconds')
+                start_parsed = datetime.datetime.fromisoformat(str(start_dt))
             except Exception:
-                return Response({'detail': 'Falha ao calcular término.'}, status=status.HTTP_400_BAD_REQUEST)
+                return Response({'detail': 'Início inválido.'}, status=status.HTTP_400_BAD_REQUEST)
+            if timezone.is_naive(start_parsed):
+                start_parsed = timezone.make_aware(start_parsed, timezone.get_current_timezone())
+            end_parsed = start_parsed + datetime.timedelta(minutes=duration_minutes)
+            end_dt = end_parsed.isoformat(timespec='seconds')
 
         payload = {
-            'barber': barber.id,
             'client_name': data.get('client_name') or data.get('clientName') or data.get('nome'),
             'client_phone': data.get('client_phone') or data.get('clientPhone') or data.get('telefone'),
-            'service': service_id,
             'start_datetime': start_dt,
             'end_datetime': end_dt,
             'notes': data.get('notes') or data.get('obs') or ''
         }
         
-        serializer = AppointmentSerializer(data=payload)
+        serializer = PublicAppointmentSerializer(data=payload)
         if serializer.is_valid():
             try:
-                appt = serializer.save()
+                appt = serializer.save(barber=barber, service=svc)
                 return Response(AppointmentSerializer(appt).data, status=status.HTTP_201_CREATED)
             except Exception as e:
                 return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -362,7 +529,10 @@ class PublicAppointmentCancel(APIView):
         appt.status = Appointment.STATUS_CANCELLED
         appt.save()
         try:
-            Sale.objects.filter(appointment=appt).update(status='cancelled')
+            linked_sales = Sale.objects.filter(appointment=appt)
+            keys = set(linked_sales.values_list('barber_id', 'created_at'))
+            linked_sales.update(status='cancelled')
+            schedule_refresh(keys)
         except Exception:
             pass
         return Response(AppointmentSerializer(appt).data, status=status.HTTP_200_OK)
@@ -0,0 +1,136 @@
+"""Broker de eventos de agendamento para o stream SSE do painel (/painel/stream/).
+
+A fonte dos eventos é o próprio AuditLog que os sinais de Appointment
+(audit/signals.py) e o sweeper já gravam. Cada processo tem uma única thread
+que consulta o AuditLog por pk crescente e reparte o resultado entre todas as
+conexões abertas naquele processo: N abas abertas custam uma consulta
+indexada a cada LIVE_POLL_SECONDS, não N re-renderizações da página. Os sinais
+acordam a thread após o commit, então eventos gerados no mesmo processo saem
+na hora; os dos outros workers e do sweeper chegam no próximo ciclo.
+
+Transações podem confirmar fora da ordem dos pks; por isso cada consulta
+recua LOOKBACK ids e ignora os já vistos. A entrega às conexões usa uma
+sequência local (seq), não o pk, para que esses atrasados não se percam.
+
+O id de cada evento SSE é o pk do AuditLog: ao reconectar, o EventSource
+manda Last-Event-ID e o stream reenvia (replay) o que foi gravado depois dele.
+"""
+import collections
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from .models import AuditLog
+
+LOOKBACK = 100
+BUFFER_SIZE = 500
+
+# change_type do payload do AuditLog -> tipo do evento enviado ao cliente
+EVENT_TYPES = {'reschedule': 'reschedule', 'cancel': 'cancel', 'done': 'done'}
+
+
+def _event_type(action, payload):
+    if action == 'create':
+        return 'create'
+    return EVENT_TYPES.get((payload or {}).get('change_type'), 'update')
+
+
+def to_event(pk, action, target_id, payload):
+    payload = payload or {}
+    return {
+        'id': pk,
+        'type': _event_type(action, payload),
+        'barbers': {b for b in (payload.get('barber'), payload.get('old_barber')) if b},
+        'data': {
+            'appointmentId': int(target_id) if str(target_id).isdigit() else target_id,
+            'barberId': payload.get('barber'),
+            'status': payload.get('status'),
+            'start': payload.get('start'),
+            'end': payload.get('end'),
+            'clientName': payload.get('client_name'),
+            'serviceTitle': payload.get('service_title'),
+        },
+    }
+
+
+def replay(after_pk, limit=BUFFER_SIZE):
+    """Eventos gravados depois do pk after_pk (Last-Event-ID), no máximo `limit`."""
+    rows = (
+        AuditLog.objects.filter(pk__gt=after_pk, target_type='Appointment')
+        .order_by('pk').values_list('pk', 'action', 'target_id', 'payload')[:limit]
+    )
+    return [to_event(*row) for row in rows]
+
+
+class Broker:
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._wake = threading.Event()
+        self._events = collections.deque(maxlen=BUFFER_SIZE)
+        self._seen = collections.deque(maxlen=BUFFER_SIZE)
+        self._last_pk = 0
+        self._seq = 0
+        self._subscribers = 0
+        self._thread = None
+
+    def subscribe(self):
+        """Registra uma conexão; retorna a seq a partir da qual ela recebe eventos."""
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None:
+                # Thread parada (sem conexões): recomeça do fim, sem reenviar o intervalo
+                self._last_pk = AuditLog.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+                self._seen.clear()
+                self._thread = threading.Thread(target=self._run, name='live-broker', daemon=True)
+                self._thread.start()
+            return self._seq
+
+    def unsubscribe(self):
+        with self._cond:
+            self._subscribers -= 1
+
+    def wake(self):
+        self._wake.set()
+
+    def wait(self, after_seq, timeout):
+        """Eventos com seq > after_seq; bloqueia até `timeout` segundos se não houver."""
+        with self._cond:
+            if self._seq <= after_seq:
+                self._cond.wait(timeout)
+            return [e for e in self._events if e['seq'] > after_seq]
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if self._subscribers <= 0:
+                        self._thread = None
+                        return
+                self._wake.wait(settings.LIVE_POLL_SECONDS)
+                self._wake.clear()
+                try:
+                    self._poll()
+                except Exception:
+                    # Conexão perdida etc.: descarta e tenta no próximo ciclo
+                    connection.close()
+        finally:
+            connection.close()
+
+    def _poll(self):
+        recent = AuditLog.objects.filter(pk__gt=max(0, self._last_pk - LOOKBACK), target_type='Appointment')
+        seen = set(self._seen)
+        new_pks = [pk for pk in recent.values_list('pk', flat=True) if pk not in seen]
+        if not new_pks:
+            return
+        rows = AuditLog.objects.filter(pk__in=new_pks).order_by('pk').values_list('pk', 'action', 'target_id', 'payload')
+        with self._cond:
+            for row in rows:
+                self._seq += 1
+                self._events.append({'seq': self._seq, **to_event(*row)})
+            self._seen.extend(new_pks)
+            self._last_pk = max(self._last_pk, max(new_pks))
+            self._cond.notify_all()
+
+
+broker = Broker()
@@ -1,9 +1,13 @@
 from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
 from .models import MaintenanceRun, AuditLog
-from appointments.models import Appointment, TimeBlock, NotificationSubscription, AppointmentNotification
+from appointments.changes import CHANGES_OVERLAP, CHANGES_RETENTION
+from appointments.models import Appointment, TimeBlock, NotificationSubscription, AppointmentNotification, PushOutbox, Tombstone
+from appointments.push_tokens import expire_stale_tokens
 from sales.models import Sale
+from sales.rollups import schedule_refresh
 
 
 def monthly_purge_if_due():
@@ -24,6 +28,71 @@ def monthly_purge_if_due():
         TimeBlock.objects.filter(date__lt=cutoff_date).delete()
         NotificationSubscription.objects.filter(created_at__lt=cutoff_dt).delete()
         AppointmentNotification.objects.filter(sent_at__lt=cutoff_dt).delete()
+        PushOutbox.objects.filter(created_at__lt=cutoff_dt).exclude(status=PushOutbox.STATUS_PENDING).delete()
+        expire_stale_tokens()
+        Tombstone.objects.filter(deleted_at__lt=timezone.now() - CHANGES_RETENTION).delete()
 
         mr.last_run_date = today
         mr.save(update_fields=['last_run_date'])
+
+
+def sweep_past_appointments(now=None, full=False, batch_size=500):
+    """Conclui agendamentos 'scheduled' cujo fim já passou. Retorna quantos foram concluídos.
+
+    MaintenanceRun('appointment_sweep').last_run_at é a marca d'água: cada
+    execução só olha agendamentos que terminaram ou foram alterados desde a
+    anterior, o que inclui os criados ou remarcados já no passado (full=True
+    varre todo o histórico). Os registros de auditoria são gravados em lote,
+    com o mesmo payload que o sinal de Appointment gera para status 'done'.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        mr, _ = MaintenanceRun.objects.select_for_update().get_or_create(name='appointment_sweep')
+        qs = Appointment.objects.filter(status=Appointment.STATUS_SCHEDULED, end_datetime__lte=now)
+        if mr.last_run_at and not full:
+            wm = mr.last_run_at
+            # updated_at com folga: gravações ainda não commitadas na execução anterior
+            qs = qs.filter(Q(end_datetime__gt=wm) | Q(updated_at__gt=wm - CHANGES_OVERLAP))
+        rows = list(qs.values(
+            'id', 'barber_id', 'barber__display_name', 'barber__username', 'client_name',
+            'start_datetime', 'end_datetime', 'service_id', 'service__title',
+        ))
+
+        ids = [r['id'] for r in rows]
+        for i in range(0, len(ids), batch_size):
+            Appointment.objects.filter(pk__in=ids[i:i + batch_size], status=Appointment.STATUS_SCHEDULED).update(
+                status=Appointment.STATUS_DONE, updated_at=timezone.now(),
+            )
+
+        AuditLog.objects.bulk_create([
+            AuditLog(
+                actor=None,
+                action='update',
+                target_type='Appointment',
+                target_id=str(r['id']),
+                payload={
+                    'barber': r['barber_id'],
+                    'barber_label': r['barber__display_name'] or r['barber__username'],
+                    'client_name': r['client_name'],
+                    'start': r['start_datetime'].isoformat(),
+                    'end': r['end_datetime'].isoformat(),
+                    'status': Appointment.STATUS_DONE,
+                    'service_id': r['service_id'],
+                    'service_title': r['service__title'] or '',
+                    'change_type': 'done',
+                    'old_status': Appointment.STATUS_SCHEDULED,
+                },
+            )
+            for r in rows
+        ], batch_size=batch_size)
+
+        keys = set()
+        for r in rows:
+            keys.add((r['barber_id'], r['start_datetime']))
+            keys.add((r['barber_id'], r['end_datetime']))
+        schedule_refresh(keys)
+
+        mr.last_run_at = now
+        mr.last_run_date = timezone.localdate(now)
+        mr.save(update_fields=['last_run_at', 'last_run_date'])
+    return len(rows)
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from audit.maintenance import sweep_past_appointments
+
+
+class Command(BaseCommand):
+    help = 'Marca como concluídos os agendamentos cujo horário de término já passou.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Fica em execução, varrendo a cada --interval segundos')
+        parser.add_argument('--interval', type=int, default=60, help='Intervalo entre varreduras no modo --loop (segundos)')
+        parser.add_argument('--full', action='store_true', help='Ignora a marca d\'água e varre todo o histórico')
+
+    def handle(self, *args, **options):
+        full = options['full']
+        while True:
+            close_old_connections()
+            try:
+                count = sweep_past_appointments(full=full)
+                if count or not options['loop']:
+                    self.stdout.write(self.style.SUCCESS(f'Agendamentos concluídos: {count}'))
+            except Exception as e:
+                if not options['loop']:
+                    raise
+                self.stderr.write(f'Falha na varredura: {e}')
+            if not options['loop']:
+                return
+            full = False
+            time.sleep(max(1, options['interval']))
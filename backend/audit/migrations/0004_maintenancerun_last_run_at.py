@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('audit', '0003_maintenancerun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maintenancerun',
+            name='last_run_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
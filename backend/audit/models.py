@@ -30,6 +30,8 @@ class AuditLog(models.Model):
 class MaintenanceRun(models.Model):
     name = models.CharField(max_length=64, unique=True)
     last_run_date = models.DateField(null=True, blank=True)
+    # Marca d'água de tarefas incrementais (ex.: sweep_past_appointments)
+    last_run_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f"{self.name} last={self.last_run_date}"
@@ -1,10 +1,18 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.db import transaction
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 
+from .live import broker as live_broker
 from .models import AuditLog
-from appointments.models import Appointment
-from sales.models import Sale
+from appointments.models import Appointment, NotificationSubscription, TimeBlock, Tombstone
+from appointments.reminders import sync_reminders
+from appointments.slot_cache import invalidate as invalidate_slots
+from sales.models import Sale, Withdrawal
+from services.catalog import bump_version as bump_catalog_version
+from services.models import Service
+from users.models import User
+from sales.rollups import affects_stats, appointment_keys, sale_keys, schedule_refresh
 
 
 @receiver(pre_save, sender=Appointment)
@@ -39,6 +47,13 @@ def log_appointment_change(sender, instance: Appointment, created, **kwargs):
         'service_id': getattr(getattr(instance, 'service', None), 'id', None),
         'service_title': getattr(getattr(instance, 'service', None), 'title', ''),
     }
+    keys = appointment_keys(instance, getattr(instance, '_orig', None))
+    # Reserva nova (agendada) não altera o resumo: nada a recalcular após o commit
+    if affects_stats(instance, getattr(instance, '_orig', None)):
+        schedule_refresh(keys)
+    invalidate_slots(keys)
+    # Stream do painel: entrega imediata aos clientes conectados a este processo
+    transaction.on_commit(live_broker.wake)
     if created:
         AuditLog.objects.create(
             actor=getattr(instance, '_actor', None),
@@ -98,8 +113,59 @@ def log_appointment_change(sender, instance: Appointment, created, **kwargs):
     )
 
 
+@receiver(post_save, sender=Appointment)
+def schedule_appointment_reminders(sender, instance: Appointment, created, **kwargs):
+    orig = getattr(instance, '_orig', {}) or {}
+    if created or orig.get('status') != instance.status or orig.get('start') != instance.start_datetime:
+        transaction.on_commit(lambda: sync_reminders(instance, created=created), robust=True)
+
+
+@receiver(post_save, sender=NotificationSubscription)
+def schedule_reminders_on_subscribe(sender, instance: NotificationSubscription, created, **kwargs):
+    # A confirmação só sai com token; inscrições tardias ainda a recebem
+    if created:
+        transaction.on_commit(lambda: sync_reminders(instance.appointment), robust=True)
+
+
+@receiver(post_delete, sender=Appointment)
+def refresh_stats_on_appointment_delete(sender, instance: Appointment, **kwargs):
+    keys = appointment_keys(instance)
+    if affects_stats(instance):
+        schedule_refresh(keys)
+    invalidate_slots(keys)
+
+
+@receiver(post_save, sender=TimeBlock)
+@receiver(post_delete, sender=TimeBlock)
+def invalidate_slots_on_time_block_change(sender, instance: TimeBlock, **kwargs):
+    invalidate_slots({(instance.barber_id, instance.date)})
+
+
+@receiver(post_delete, sender=Appointment)
+@receiver(post_delete, sender=TimeBlock)
+def record_tombstone(sender, instance, **kwargs):
+    Tombstone.objects.create(
+        target_type=Tombstone.TYPE_APPOINTMENT if sender is Appointment else Tombstone.TYPE_TIME_BLOCK,
+        target_id=instance.pk,
+        barber_id=instance.barber_id,
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+def bump_catalog_on_change(sender, instance, **kwargs):
+    # Login só atualiza last_login; não muda o catálogo
+    update_fields = kwargs.get('update_fields')
+    if sender is User and update_fields and set(update_fields) <= {'last_login'}:
+        return
+    bump_catalog_version()
+
+
 @receiver(post_save, sender=Sale)
 def log_sale_change(sender, instance: Sale, created, **kwargs):
+    schedule_refresh(sale_keys(instance))
     AuditLog.objects.create(
         actor=getattr(instance, '_actor', None),
         action='create' if created else 'update',
@@ -114,6 +180,17 @@ def log_sale_change(sender, instance: Sale, created, **kwargs):
     )
 
 
+@receiver(post_delete, sender=Sale)
+def refresh_stats_on_sale_delete(sender, instance: Sale, **kwargs):
+    schedule_refresh(sale_keys(instance))
+
+
+@receiver(post_save, sender=Withdrawal)
+@receiver(post_delete, sender=Withdrawal)
+def refresh_stats_on_withdrawal_change(sender, instance: Withdrawal, **kwargs):
+    schedule_refresh({(instance.user_id, instance.created_at)})
+
+
 @receiver(user_logged_in)
 def log_login(sender, user, request, **kwargs):
     AuditLog.objects.create(
@@ -1,3 +1,76 @@
+import datetime
+import io
+
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from appointments.models import Appointment
+from services.models import Service
+from users.models import User
+from .maintenance import sweep_past_appointments
+from .models import AuditLog, MaintenanceRun
+
+
+class SweepPastAppointmentsTests(TestCase):
+    """Varredura de agendamentos vencidos (audit/maintenance.py)."""
+
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER, display_name='Zé')
+        self.service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+
+    def _appt(self, end, updated_at=None):
+        appt = Appointment.objects.create(
+            barber=self.barber, client_name='Cliente', client_phone='1', service=self.service,
+            start_datetime=end - datetime.timedelta(minutes=30), end_datetime=end,
+        )
+        if updated_at:
+            Appointment.objects.filter(pk=appt.pk).update(updated_at=updated_at)
+        return appt
+
+    def _status(self, appt):
+        return Appointment.objects.get(pk=appt.pk).status
+
+    def test_watermark_skips_old_rows_but_catches_backdated_ones(self):
+        wm = timezone.now() - datetime.timedelta(minutes=10)
+        old = self._appt(wm - datetime.timedelta(days=2), updated_at=wm - datetime.timedelta(days=2))
+        MaintenanceRun.objects.create(name='appointment_sweep', last_run_at=wm)
+        # Criado/remarcado depois da última execução com fim já no passado
+        backdated = self._appt(wm - datetime.timedelta(hours=3))
+        recent = self._appt(wm + datetime.timedelta(minutes=5), updated_at=wm - datetime.timedelta(days=1))
+        future = self._appt(timezone.now() + datetime.timedelta(hours=1))
+
+        self.assertEqual(sweep_past_appointments(), 2)
+        self.assertEqual(self._status(backdated), Appointment.STATUS_DONE)
+        self.assertEqual(self._status(recent), Appointment.STATUS_DONE)
+        self.assertEqual(self._status(old), Appointment.STATUS_SCHEDULED)
+        self.assertEqual(self._status(future), Appointment.STATUS_SCHEDULED)
+        self.assertGreater(MaintenanceRun.objects.get(name='appointment_sweep').last_run_at, wm)
+
+    def test_full_ignores_watermark(self):
+        wm = timezone.now()
+        old = self._appt(wm - datetime.timedelta(days=2), updated_at=wm - datetime.timedelta(days=2))
+        MaintenanceRun.objects.create(name='appointment_sweep', last_run_at=wm)
+        self.assertEqual(sweep_past_appointments(), 0)
+        out = io.StringIO()
+        call_command('sweep_appointments', '--full', stdout=out)
+        self.assertIn('Agendamentos concluídos: 1', out.getvalue())
+        self.assertEqual(self._status(old), Appointment.STATUS_DONE)
 
-# Create your tests here.
+    def test_bulk_audit_payload_matches_signal(self):
+        appt = self._appt(timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(sweep_past_appointments(), 1)
+        log = AuditLog.objects.get(target_type='Appointment', target_id=str(appt.pk), action='update')
+        self.assertIsNone(log.actor)
+        self.assertEqual(log.payload, {
+            'barber': self.barber.id,
+            'barber_label': 'Zé',
+            'client_name': 'Cliente',
+            'start': appt.start_datetime.isoformat(),
+            'end': appt.end_datetime.isoformat(),
+            'status': Appointment.STATUS_DONE,
+            'service_id': self.service.id,
+            'service_title': 'Corte',
+            'change_type': 'done',
+            'old_status': Appointment.STATUS_SCHEDULED,
+        })
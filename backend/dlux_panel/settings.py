@@ -109,6 +109,44 @@ else:
     }
 
 
+# Cache (horários livres do agendamento). Sem CACHE_LOCATION usa memória local
+# do processo; apontar para um diretório compartilha o cache entre os workers.
+# Todo processo que grava agendamentos (backend, sweeper, notifier, push_worker)
+# precisa apontar para o MESMO diretório (volume compartilhado no compose), senão
+# as invalidações feitas por ele não chegam ao backend.
+CACHE_LOCATION = config('CACHE_LOCATION', default='')
+if CACHE_LOCATION:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_LOCATION,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+SLOTS_CACHE_TIMEOUT = config('SLOTS_CACHE_TIMEOUT', default=600, cast=int)
+# Intervalo (s) entre conferências da versão do catálogo de barbeiros/serviços no banco
+CATALOG_CHECK_SECONDS = config('CATALOG_CHECK_SECONDS', default=5, cast=int)
+# Stream SSE do painel (/painel/stream/): intervalo de consulta do AuditLog e
+# duração máxima de cada conexão (o navegador reconecta sozinho)
+LIVE_POLL_SECONDS = config('LIVE_POLL_SECONDS', default=2, cast=float)
+LIVE_STREAM_MAX_SECONDS = config('LIVE_STREAM_MAX_SECONDS', default=300, cast=int)
+# Agendador de lembretes push (run_notification_scheduler): intervalo máximo
+# entre leituras das mudanças e atraso máximo tolerado após uma parada
+NOTIFICATION_SCHEDULER_REFRESH_SECONDS = config('NOTIFICATION_SCHEDULER_REFRESH_SECONDS', default=30, cast=float)
+NOTIFICATION_CATCHUP_SECONDS = config('NOTIFICATION_CATCHUP_SECONDS', default=300, cast=int)
+# Fila de push (run_push_outbox): tamanho do lote, intervalo entre consultas
+# quando ociosa e tentativas antes de marcar o envio como falho
+PUSH_OUTBOX_BATCH_SIZE = config('PUSH_OUTBOX_BATCH_SIZE', default=500, cast=int)
+PUSH_OUTBOX_POLL_SECONDS = config('PUSH_OUTBOX_POLL_SECONDS', default=2, cast=float)
+PUSH_OUTBOX_MAX_ATTEMPTS = config('PUSH_OUTBOX_MAX_ATTEMPTS', default=8, cast=int)
+# Tokens FCM sem inscrição nova há mais que isso são apagados (cleanup_push_tokens)
+PUSH_TOKEN_TTL_DAYS = config('PUSH_TOKEN_TTL_DAYS', default=120, cast=int)
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -165,6 +203,8 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
     ],
 }
+# Tamanho padrão das páginas (cursor) de GET /api/appointments/
+APPOINTMENTS_PAGE_SIZE = config('APPOINTMENTS_PAGE_SIZE', default=100, cast=int)
 
 CORS_ALLOWED_ORIGINS = config(
     'CORS_ALLOWED_ORIGINS',
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Sale, Withdrawal
+from .models import Sale, Withdrawal, DailyBarberStats
 
 
 @admin.register(Sale)
@@ -14,4 +14,12 @@ class WithdrawalAdmin(admin.ModelAdmin):
     list_filter = ('user',)
     search_fields = ('user__username',)
 
+
+
+@admin.register(DailyBarberStats)
+class DailyBarberStatsAdmin(admin.ModelAdmin):
+    list_display = ('date', 'barber', 'service', 'done_count', 'cancelled_count', 'service_revenue', 'paid_sales', 'withdrawals')
+    list_filter = ('barber', 'service')
+    date_hierarchy = 'date'
+
 # Register your models here.
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sales.models import DailyBarberStats
+from sales.rollups import replace_stats
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o resumo diário (DailyBarberStats) usado pelos painéis financeiros.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Reconstruir apenas os últimos N dias (padrão: todo o histórico)')
+        parser.add_argument('--if-empty', action='store_true', help='Não faz nada se o resumo já estiver populado')
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and DailyBarberStats.objects.exists():
+            self.stdout.write('Resumo diário já populado; nada a fazer.')
+            return
+        start_date = None
+        days = options['days']
+        if days:
+            start_date = timezone.localdate() - timezone.timedelta(days=days)
+        count = replace_stats(start_date=start_date)
+        self.stdout.write(self.style.SUCCESS(f'Resumo diário reconstruído: {count} linhas.'))
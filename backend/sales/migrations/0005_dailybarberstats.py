@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 09:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_withdrawal_note'),
+        ('services', '0010_seed_featured_descriptions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBarberStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('done_count', models.PositiveIntegerField(default=0)),
+                ('done_without_sale', models.PositiveIntegerField(default=0)),
+                ('cancelled_count', models.PositiveIntegerField(default=0)),
+                ('service_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('service_revenue_without_sale', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('paid_sales', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('withdrawals', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('done_by_hour', models.JSONField(blank=True, default=dict)),
+                ('barber', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+                ('service', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='services.service')),
+            ],
+            options={
+                'verbose_name': 'Resumo diário',
+                'verbose_name_plural': 'Resumos diários',
+                'indexes': [models.Index(fields=['date', 'barber'], name='sales_daily_date_31f30a_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.8 on 2026-10-18 10:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0005_dailybarberstats'),
+        ('services', '0011_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dailybarberstats',
+            name='service',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='services.service'),
+        ),
+    ]
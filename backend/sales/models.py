@@ -33,4 +33,33 @@ class Withdrawal(models.Model):
     def __str__(self):
         return f"Retirada #{self.id} - {self.user.username} - {self.amount}"
 
-# Create your models here.
+
+
+class DailyBarberStats(models.Model):
+    """Resumo diário por (data local, barbeiro, serviço) usado pelos painéis financeiros.
+    Mantido pelos sinais em audit/signals.py (ver sales/rollups.py) e reconstruído
+    com `manage.py rebuild_rollups`. Vendas sem serviço e retiradas usam service=None;
+    remover um serviço também zera o vínculo (SET_NULL) sem perder os totais do dia.
+    """
+    date = models.DateField()
+    barber = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_stats')
+    service = models.ForeignKey(Service, on_delete=models.SET_NULL, null=True, blank=True)
+    done_count = models.PositiveIntegerField(default=0)
+    done_without_sale = models.PositiveIntegerField(default=0)
+    cancelled_count = models.PositiveIntegerField(default=0)
+    service_revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    service_revenue_without_sale = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    paid_sales = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    withdrawals = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    # Concluídos por hora local de início: {"8": 2, "14": 1, ...}
+    done_by_hour = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['date', 'barber']),
+        ]
+        verbose_name = 'Resumo diário'
+        verbose_name_plural = 'Resumos diários'
+
+    def __str__(self):
+        return f"{self.date} - {self.barber_id} - {self.service_id}"
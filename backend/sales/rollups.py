@@ -0,0 +1,230 @@
+"""Manutenção do resumo diário (DailyBarberStats) usado pelos painéis financeiros.
+
+Cada (barbeiro, data local) é recalculado por inteiro a partir das tabelas de
+origem, o que mantém o resumo idempotente mesmo com remarcações, trocas de
+barbeiro ou mudanças de status. Os sinais em audit/signals.py agendam o
+recálculo para depois do commit; `manage.py rebuild_rollups` faz o backfill.
+
+Conta o status gravado: agendados cujo fim já passou só entram como concluídos
+quando o sweeper os marca (ele agenda o recálculo dos dias afetados). Os
+painéis financeiros seguem a mesma regra e ficam até um ciclo do sweeper atrás.
+"""
+import datetime
+import logging
+import threading
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, Q, Sum
+from django.db.models.functions import ExtractHour, TruncDate
+from django.utils import timezone
+
+from appointments.models import Appointment
+from users.models import User
+from .models import DailyBarberStats, Sale, Withdrawal
+
+logger = logging.getLogger(__name__)
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min), timezone.get_current_timezone())
+
+
+def _to_local_date(value):
+    if isinstance(value, datetime.datetime):
+        return timezone.localtime(value).date()
+    return value
+
+
+def _empty_row():
+    return {
+        'done_count': 0,
+        'done_without_sale': 0,
+        'cancelled_count': 0,
+        'service_revenue': Decimal('0'),
+        'service_revenue_without_sale': Decimal('0'),
+        'paid_sales': Decimal('0'),
+        'withdrawals': Decimal('0'),
+        'done_by_hour': {},
+    }
+
+
+def collect_stats(start_date=None, end_date=None, barber_id=None):
+    """Agrega Appointment/Sale/Withdrawal por (data local, barbeiro, serviço).
+
+    Uma consulta agrupada por tabela. Datas em [start_date, end_date); sem
+    datas cobre todo o histórico.
+    """
+    tz = timezone.get_current_timezone()
+
+    def window(field):
+        flt = {}
+        if start_date:
+            flt[f'{field}__gte'] = _local_midnight(start_date)
+        if end_date:
+            flt[f'{field}__lt'] = _local_midnight(end_date)
+        return flt
+
+    barber_flt = {'barber_id': barber_id} if barber_id else {}
+    rows = defaultdict(_empty_row)
+
+    without_sale = ~Exists(Sale.objects.filter(appointment=OuterRef('pk')))
+    done = (
+        Appointment.objects.filter(status=Appointment.STATUS_DONE, **window('end_datetime'), **barber_flt)
+        .annotate(
+            day=TruncDate('end_datetime', tzinfo=tz),
+            hour=ExtractHour('start_datetime', tzinfo=tz),
+            no_sale=without_sale,
+        )
+        .values('day', 'barber', 'service', 'hour')
+        .annotate(
+            c=Count('id'),
+            c_no_sale=Count('id', filter=Q(no_sale=True)),
+            revenue=Sum('service__price'),
+            revenue_no_sale=Sum('service__price', filter=Q(no_sale=True)),
+        )
+        .order_by()
+    )
+    for r in done:
+        row = rows[(r['day'], r['barber'], r['service'])]
+        row['done_count'] += r['c']
+        row['done_without_sale'] += r['c_no_sale']
+        row['service_revenue'] += r['revenue'] or 0
+        row['service_revenue_without_sale'] += r['revenue_no_sale'] or 0
+        hour = str(r['hour'])
+        row['done_by_hour'][hour] = row['done_by_hour'].get(hour, 0) + r['c']
+
+    cancelled = (
+        Appointment.objects.filter(status=Appointment.STATUS_CANCELLED, **window('start_datetime'), **barber_flt)
+        .annotate(day=TruncDate('start_datetime', tzinfo=tz))
+        .values('day', 'barber', 'service')
+        .annotate(c=Count('id'))
+        .order_by()
+    )
+    for r in cancelled:
+        rows[(r['day'], r['barber'], r['service'])]['cancelled_count'] += r['c']
+
+    sales = (
+        Sale.objects.filter(status='paid', **window('created_at'), **barber_flt)
+        .annotate(day=TruncDate('created_at', tzinfo=tz))
+        .values('day', 'barber', 'service')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for r in sales:
+        rows[(r['day'], r['barber'], r['service'])]['paid_sales'] += r['total'] or 0
+
+    withdrawals = (
+        Withdrawal.objects.filter(**window('created_at'), **({'user_id': barber_id} if barber_id else {}))
+        .annotate(day=TruncDate('created_at', tzinfo=tz))
+        .values('day', 'user')
+        .annotate(total=Sum('amount'))
+        .order_by()
+    )
+    for r in withdrawals:
+        rows[(r['day'], r['user'], None)]['withdrawals'] += r['total'] or 0
+
+    return rows
+
+
+def replace_stats(start_date=None, end_date=None, barber_id=None, batch_size=500):
+    """Recalcula e substitui os resumos do intervalo. Retorna o número de linhas gravadas."""
+    rows = collect_stats(start_date, end_date, barber_id)
+    objs = [
+        DailyBarberStats(date=day, barber_id=b_id, service_id=s_id, **values)
+        for (day, b_id, s_id), values in rows.items()
+    ]
+    with transaction.atomic():
+        if barber_id:
+            # Serializa recálculos concorrentes do mesmo barbeiro
+            list(User.objects.select_for_update().filter(pk=barber_id).values_list('pk', flat=True))
+        existing = DailyBarberStats.objects.all()
+        if start_date:
+            existing = existing.filter(date__gte=start_date)
+        if end_date:
+            existing = existing.filter(date__lt=end_date)
+        if barber_id:
+            existing = existing.filter(barber_id=barber_id)
+        existing.delete()
+        DailyBarberStats.objects.bulk_create(objs, batch_size=batch_size)
+    return len(objs)
+
+
+def refresh_day(barber_id, day):
+    return replace_stats(day, day + datetime.timedelta(days=1), barber_id)
+
+
+_pending = threading.local()
+
+
+def _flush_pending():
+    keys = getattr(_pending, 'keys', None) or set()
+    _pending.keys = None
+    for barber_id, day in sorted(keys):
+        try:
+            refresh_day(barber_id, day)
+        except Exception:
+            logger.exception('Falha ao atualizar resumo diário (barbeiro=%s, data=%s)', barber_id, day)
+
+
+def _flush_registered():
+    """O _flush_pending ainda está na fila de on_commit da transação corrente?
+
+    Um rollback (da transação ou do savepoint em que ele foi registrado) tira o
+    callback da fila; nesse caso as chaves pendentes ficaram órfãs.
+    """
+    return any(func is _flush_pending for _sids, func, *_ in connection.run_on_commit)
+
+
+def schedule_refresh(keys):
+    """Agenda o recálculo de (barbeiro, data/datetime) para depois do commit.
+
+    Chaves repetidas dentro da mesma transação são recalculadas uma vez só.
+    """
+    keys = {(b_id, _to_local_date(d)) for b_id, d in keys if b_id and d}
+    if not keys:
+        return
+    pending = getattr(_pending, 'keys', None)
+    if pending is not None and connection.in_atomic_block and _flush_registered():
+        pending.update(keys)
+        return
+    # Nova transação (ou autocommit): o flush anterior, se existia, foi descartado por rollback
+    _pending.keys = set(keys)
+    transaction.on_commit(_flush_pending)
+
+
+def affects_stats(appt, orig=None):
+    """Só concluídos e cancelados entram no resumo; agendado -> agendado não muda nada."""
+    counted = (Appointment.STATUS_DONE, Appointment.STATUS_CANCELLED)
+    return appt.status in counted or (orig or {}).get('status') in counted
+
+
+def appointment_keys(appt, orig=None):
+    """Chaves afetadas por um agendamento: concluídos contam pelo fim, cancelados pelo início."""
+    keys = {
+        (appt.barber_id, appt.start_datetime),
+        (appt.barber_id, appt.end_datetime),
+    }
+    orig = orig or {}
+    if orig.get('barber_id'):
+        keys.add((orig['barber_id'], orig.get('start')))
+        keys.add((orig['barber_id'], orig.get('end')))
+    return keys
+
+
+def queryset_keys(qs):
+    """Chaves afetadas por um queryset de Appointment (antes de um update em massa)."""
+    keys = set()
+    for barber_id, start, end in qs.values_list('barber_id', 'start_datetime', 'end_datetime'):
+        keys.add((barber_id, start))
+        keys.add((barber_id, end))
+    return keys
+
+
+def sale_keys(sale):
+    keys = {(sale.barber_id, sale.created_at)}
+    if sale.appointment_id:
+        # Vendas vinculadas alteram a receita "sem venda" do dia do agendamento
+        keys |= queryset_keys(Appointment.objects.filter(pk=sale.appointment_id))
+    return keys
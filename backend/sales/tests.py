@@ -1,3 +1,199 @@
+import datetime
+import io
+import random
+from decimal import Decimal
+
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import Count, Sum
 from django.test import TestCase
+from django.utils import timezone
+
+from appointments.models import Appointment
+from services.models import Service
+from users.models import User
+from . import rollups
+from .models import DailyBarberStats, Sale, Withdrawal
+
+
+def _local(day, minutes):
+    tz = timezone.get_current_timezone()
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time(0, 0)), tz) + datetime.timedelta(minutes=minutes)
+
+
+class RollupTests(TestCase):
+    """Resumo diário (sales/rollups.py) contra as tabelas de origem."""
+
+    def setUp(self):
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        self.other = User.objects.create_user(username='outro', password='x', role=User.BARBER)
+        self.corte = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.barba = Service.objects.create(title='Barba', price=25, duration_minutes=30)
+        self.day = datetime.date(2025, 3, 12)
+
+    def _appt(self, barber, service, day, minutes, status=Appointment.STATUS_DONE):
+        return Appointment.objects.create(
+            barber=barber, client_name='Cliente', client_phone='1', service=service, status=status,
+            start_datetime=_local(day, minutes), end_datetime=_local(day, minutes + 30),
+        )
+
+    def _seed(self):
+        rnd = random.Random(4)
+        for i in range(30):
+            day = self.day + datetime.timedelta(days=rnd.randint(-3, 3))
+            status = rnd.choice([Appointment.STATUS_DONE, Appointment.STATUS_DONE, Appointment.STATUS_CANCELLED])
+            appt = self._appt(rnd.choice([self.barber, self.other]), rnd.choice([self.corte, self.barba]),
+                              day, 8 * 60 + 30 * i, status)
+            if status == Appointment.STATUS_DONE and rnd.random() < 0.3:
+                sale = Sale.objects.create(barber=appt.barber, appointment=appt, service=appt.service,
+                                           amount=Decimal('10.50'), payment_method='pix')
+                Sale.objects.filter(pk=sale.pk).update(created_at=appt.end_datetime)
+        w = Withdrawal.objects.create(user=self.barber, amount=Decimal('15'))
+        Withdrawal.objects.filter(pk=w.pk).update(created_at=_local(self.day, 12 * 60))
+
+    def _raw_totals(self, start, end):
+        done = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=start, end_datetime__lt=end)
+        return {
+            'done_count': done.count(),
+            'cancelled_count': Appointment.objects.filter(
+                status=Appointment.STATUS_CANCELLED, start_datetime__gte=start, start_datetime__lt=end).count(),
+            'service_revenue': done.aggregate(t=Sum('service__price'))['t'] or 0,
+            'paid_sales': Sale.objects.filter(status='paid', created_at__gte=start, created_at__lt=end)
+                                      .aggregate(t=Sum('amount'))['t'] or 0,
+            'withdrawals': Withdrawal.objects.filter(created_at__gte=start, created_at__lt=end)
+                                             .aggregate(t=Sum('amount'))['t'] or 0,
+        }
+
+    def _stats_totals(self, **flt):
+        fields = ('done_count', 'cancelled_count', 'service_revenue', 'paid_sales', 'withdrawals')
+        totals = DailyBarberStats.objects.filter(**flt).aggregate(**{f: Sum(f) for f in fields})
+        return {f: totals[f] or 0 for f in fields}
+
+    def test_replace_stats_matches_source_tables(self):
+        self._seed()
+        rollups.replace_stats()
+        self.assertEqual(self._stats_totals(), self._raw_totals(_local(self.day, -5 * 1440), _local(self.day, 5 * 1440)))
+        for offset in range(-3, 4):
+            day = self.day + datetime.timedelta(days=offset)
+            self.assertEqual(self._stats_totals(date=day), self._raw_totals(_local(day, 0), _local(day, 1440)), day)
+
+    def test_refresh_day_only_touches_that_barber_and_day(self):
+        self._appt(self.barber, self.corte, self.day, 9 * 60)
+        self._appt(self.other, self.corte, self.day, 9 * 60)
+        rollups.replace_stats()
+        Appointment.objects.filter(barber=self.barber).update(status=Appointment.STATUS_CANCELLED)
+        Appointment.objects.filter(barber=self.other).update(status=Appointment.STATUS_CANCELLED)
+        rollups.refresh_day(self.barber.id, self.day)
+        self.assertEqual(self._stats_totals(barber=self.barber)['cancelled_count'], 1)
+        self.assertEqual(self._stats_totals(barber=self.other)['done_count'], 1)
+
+    def test_signals_refresh_after_commit_once_per_key(self):
+        with mock.patch.object(rollups, 'refresh_day', wraps=rollups.refresh_day) as refresh:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                appt = self._appt(self.barber, self.corte, self.day, 9 * 60, Appointment.STATUS_SCHEDULED)
+                appt.status = Appointment.STATUS_DONE
+                appt.save()
+                self.assertFalse(DailyBarberStats.objects.exists())
+        self.assertEqual([cb for cb in callbacks if cb is rollups._flush_pending], [rollups._flush_pending])
+        refresh.assert_called_once_with(self.barber.id, self.day)
+        self.assertEqual(self._stats_totals()['service_revenue'], 40)
+
+    def test_save_after_rolled_back_savepoint_still_refreshes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self._appt(self.barber, self.corte, self.day, 9 * 60)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+            self._appt(self.barber, self.barba, self.day + datetime.timedelta(days=1), 9 * 60)
+        self.assertEqual(self._stats_totals(), {
+            'done_count': 1, 'cancelled_count': 0, 'service_revenue': 25, 'paid_sales': 0, 'withdrawals': 0,
+        })
+
+    def test_save_after_rolled_back_atomic_decorator_still_refreshes(self):
+        @transaction.atomic
+        def create_and_fail(minutes):
+            self._appt(self.barber, self.corte, self.day, minutes)
+            raise RuntimeError
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for minutes in (9 * 60, 10 * 60):
+                with self.assertRaises(RuntimeError):
+                    create_and_fail(minutes)
+            Sale.objects.create(barber=self.barber, amount=Decimal('30'), payment_method='cash')
+        self.assertEqual(self._stats_totals()['paid_sales'], 30)
+        self.assertEqual(self._stats_totals()['done_count'], 0)
+
+    def test_rebuild_rollups_command(self):
+        self._seed()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        expected = self._stats_totals()
+        self.assertEqual(expected, self._raw_totals(_local(self.day, -5 * 1440), _local(self.day, 5 * 1440)))
+        DailyBarberStats.objects.filter(date=self.day).delete()
+        out = io.StringIO()
+        call_command('rebuild_rollups', '--if-empty', stdout=out)
+        self.assertIn('nada a fazer', out.getvalue())
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        self.assertEqual(self._stats_totals(), expected)
+
+    def test_finance_endpoints_match_source_tables(self):
+        self._seed()
+        rollups.replace_stats()
+        admin = User.objects.create_user(username='admin', password='x', role=User.ADMIN)
+        self.client.force_login(admin)
+        month = self.day.strftime('%Y-%m')
+        start, end = _local(self.day.replace(day=1), 0), _local(datetime.date(2025, 4, 1), 0)
+        raw = self._raw_totals(start, end)
+
+        data = self.client.get('/painel/financas/revenue-data/', {'month': month}).json()
+        net = sum(Decimal(str(v)) for _ts, v in data['series'][0]['data'])
+        self.assertEqual(net, raw['service_revenue'] + raw['paid_sales'] - raw['withdrawals'])
+
+        data = self.client.get('/painel/financas/services-breakdown-data/', {'month': month}).json()
+        done = (Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=start, end_datetime__lt=end)
+                .values('service__title').annotate(c=Count('id')))
+        self.assertEqual(dict(zip(data['labels'], data['series'])), {r['service__title']: r['c'] for r in done})
+
+    @mock.patch('services.management.commands.merge_featured_services.trigger_revalidation')
+    def test_merge_featured_services_keeps_and_refreshes_rollups(self, _revalidate):
+        # Primário: o 'Corte' mais antigo (catálogo inicial); a duplicata tem o mesmo preço
+        primary = Service.objects.filter(title__iexact='corte').order_by('id').first()
+        dup = Service.objects.create(title='corte de cabelo', price=primary.price, duration_minutes=30)
+        with self.captureOnCommitCallbacks(execute=True):
+            self._appt(self.barber, dup, self.day, 9 * 60)
+            Sale.objects.create(barber=self.barber, service=dup, amount=Decimal('12'), payment_method='cash')
+        self.assertEqual(self._stats_totals(service=dup)['done_count'], 1)
+        before = self._stats_totals()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('merge_featured_services', stdout=io.StringIO())
+        self.assertFalse(Service.objects.filter(pk=dup.pk).exists())
+        self.assertEqual(self._stats_totals(), before)
+        self.assertFalse(DailyBarberStats.objects.filter(service__isnull=True, done_count__gt=0).exists())
+        self.assertEqual(self._stats_totals(service=primary)['done_count'], 1)
+
+    def test_finance_panels_serve_from_daily_stats(self):
+        # Só o resumo tem dados: o que os painéis mostram vem dele, não das tabelas de origem
+        today = timezone.localdate()
+        DailyBarberStats.objects.create(
+            date=today, barber=self.barber, service=self.corte, done_count=2, done_without_sale=2,
+            service_revenue=Decimal('80'), service_revenue_without_sale=Decimal('80'), cancelled_count=1,
+            done_by_hour={'9': 2},
+        )
+        DailyBarberStats.objects.create(date=today, barber=self.barber, paid_sales=Decimal('15'))
+        admin = User.objects.create_user(username='admin', password='x', role=User.ADMIN)
+        self.client.force_login(admin)
+
+        resp = self.client.get('/painel/financas/')
+        self.assertEqual(resp.status_code, 200)
+        kpis = resp.context['kpis']
+        # Vendas de hoje são lidas da própria tabela Sale; as do mês, do resumo
+        self.assertEqual((kpis['today_revenue'], kpis['month_revenue']), ('80,00', '95,00'))
+        self.assertEqual((kpis['appts_completed'], kpis['appts_cancelled']), (2, 1))
 
-# Create your tests here.
+        data = self.client.get('/painel/financas/revenue-data/', {'range': 'today'}).json()
+        self.assertEqual(sum(v for _ts, v in data['series'][0]['data']), 95.0)
+        data = self.client.get('/painel/financas/services-breakdown-data/', {'range': 'today'}).json()
+        self.assertEqual((data['labels'], data['series']), (['Corte'], [2]))
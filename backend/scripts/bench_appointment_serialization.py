@@ -0,0 +1,60 @@
+# Serialização da listagem de agendamentos: completa x ?expand= x ?fields= (values()).
+# Uso: python manage.py shell < scripts/bench_appointment_serialization.py
+# Cria 10k agendamentos dentro de uma transação que é desfeita no final.
+import datetime
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from appointments.models import Appointment
+from appointments.serializers import AppointmentSerializer, compact_converter, compact_rows
+from services.models import Service
+from users.models import User
+
+print('Running bench_appointment_serialization...')
+
+N = 10_000
+
+
+def timed(label, fn, baseline=None, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        rows = fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    ratio = f'  ({baseline / best:5.1f}x)' if baseline else ''
+    print(f'{label:<38} {len(rows):6d} linhas  {best * 1000:8.1f} ms{ratio}')
+    return best
+
+
+with transaction.atomic():
+    barber = User.objects.create_user(username='bench_serial', password='x', role=User.BARBER)
+    service = Service.objects.create(title='Bench', price=10, duration_minutes=30)
+    start = timezone.now() - datetime.timedelta(days=400)
+    Appointment.objects.bulk_create([
+        Appointment(
+            barber=barber, client_name=f'Cliente {i}', client_phone='11999999999', service=service,
+            start_datetime=start + datetime.timedelta(minutes=40 * i),
+            end_datetime=start + datetime.timedelta(minutes=40 * i + 30),
+            status=Appointment.STATUS_CANCELLED,
+        )
+        for i in range(N)
+    ], batch_size=1000)
+    base = Appointment.objects.filter(barber=barber).with_effective_status().order_by('start_datetime', 'id')
+    slim = ['id', 'start_datetime', 'end_datetime', 'status']
+    expand = ['barber', 'service']
+
+    t_full = timed('completo (ModelSerializer)', lambda: AppointmentSerializer(list(base), many=True).data)
+    timed('expand=barber,service (serializer)', lambda: AppointmentSerializer(
+        list(base.select_related(*expand)), many=True, context={'expand': expand}).data, t_full)
+
+
+    def fast(fields, expand=()):
+        convert = compact_converter(fields, expand)
+        return [convert(r) for r in compact_rows(base, fields, expand)]
+
+    timed('fields=id,start,end,status (values)', lambda: fast(slim), t_full)
+    timed('fields=... + expand (values)', lambda: fast(slim + expand, expand), t_full)
+    transaction.set_rollback(True)
@@ -0,0 +1,37 @@
+# Micro-benchmark do cálculo de horários livres (appointments.scheduling).
+# Uso: python manage.py shell < scripts/bench_slots.py
+import datetime
+import random
+import timeit
+
+from django.utils import timezone
+
+from appointments.scheduling import free_slots, naive_free_slots
+
+print('Running bench_slots...')
+
+tz = timezone.get_current_timezone()
+day = datetime.date(2025, 12, 10)
+window_start = timezone.make_aware(datetime.datetime.combine(day, datetime.time(8, 0)), tz)
+window_end = timezone.make_aware(datetime.datetime.combine(day, datetime.time(20, 0)), tz)
+duration = datetime.timedelta(minutes=30)
+rnd = random.Random(42)
+
+
+def make_ranges(n):
+    ranges = []
+    for _ in range(n):
+        start = window_start + datetime.timedelta(minutes=rnd.randrange(0, 12 * 60, 5))
+        ranges.append((start, start + datetime.timedelta(minutes=rnd.choice([15, 30, 45, 60]))))
+    return ranges
+
+
+for n in (5, 20, 60, 200):
+    ranges = make_ranges(n)
+    assert free_slots(window_start, window_end, duration, ranges) == naive_free_slots(window_start, window_end, duration, ranges)
+    for step_min in (10, 1):
+        step = datetime.timedelta(minutes=step_min)
+        runs = 200
+        t_naive = timeit.timeit(lambda: naive_free_slots(window_start, window_end, duration, ranges, step), number=runs)
+        t_sweep = timeit.timeit(lambda: free_slots(window_start, window_end, duration, ranges, step), number=runs)
+        print(f'intervalos={n:4d} passo={step_min:2d}min  original={t_naive / runs * 1e6:9.1f}us  varredura={t_sweep / runs * 1e6:8.1f}us  ({t_naive / t_sweep:5.1f}x)')
@@ -0,0 +1,116 @@
+"""Snapshot em memória do catálogo (barbeiros e serviços), por processo.
+
+Barbeiros e serviços mudam raramente, mas são consultados em quase toda
+requisição (resolução de barberName/serviceTitle, duração, listas de
+barbeiros). Cada processo guarda um snapshot imutável com índices por id e por
+nome/título (sem diferenciar maiúsculas) e só o recarrega quando o contador
+CatalogVersion no banco muda. O contador é incrementado pelos sinais de User e
+Service (audit/signals.py) e por bump_version() após updates em massa; a
+versão do banco é conferida no máximo a cada CATALOG_CHECK_SECONDS, então
+outros workers enxergam mudanças com esse atraso. No próprio processo a
+mudança vale na hora.
+
+Os objetos do snapshot são compartilhados entre requisições: use-os só para
+leitura (nunca .save()).
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from users.models import User
+from .models import CatalogVersion, Service
+
+_lock = threading.Lock()
+_snapshot = None
+_checked_at = 0.0
+
+
+def _key(name):
+    return (name or '').strip().casefold()
+
+
+class CatalogSnapshot:
+    def __init__(self, version, barbers, services):
+        self.version = version
+        # Ordem de exibição: display_name, username (como nas listas do painel)
+        self.barbers = tuple(barbers)
+        # Ordem por título, como nas listas de serviços
+        self.services = tuple(services)
+        self._barbers_by_id = {b.id: b for b in self.barbers}
+        self._services_by_id = {s.id: s for s in self.services}
+        # Nome -> barbeiro: username ou display_name; empate fica com o menor id
+        self._barbers_by_name = {}
+        for b in sorted(self.barbers, key=lambda u: u.id):
+            for name in (b.username, b.display_name):
+                if _key(name):
+                    self._barbers_by_name.setdefault(_key(name), b)
+        # Título -> serviço; empate segue a ordenação padrão de Service (order)
+        self._services_by_title = {}
+        for s in sorted(self.services, key=lambda x: (x.order, x.id)):
+            self._services_by_title.setdefault(_key(s.title), s)
+
+    def barber(self, barber_id):
+        try:
+            return self._barbers_by_id.get(int(barber_id))
+        except (TypeError, ValueError):
+            return None
+
+    def barber_by_name(self, name):
+        return self._barbers_by_name.get(_key(name))
+
+    def service(self, service_id):
+        try:
+            return self._services_by_id.get(int(service_id))
+        except (TypeError, ValueError):
+            return None
+
+    def service_by_title(self, title):
+        return self._services_by_title.get(_key(title))
+
+    def active_services(self):
+        return [s for s in self.services if s.active]
+
+
+def _db_version():
+    return CatalogVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def _load():
+    version = _db_version()
+    barbers = list(User.objects.filter(role=User.BARBER).order_by('display_name', 'username'))
+    services = list(Service.objects.order_by('title', 'id'))
+    return CatalogSnapshot(version, barbers, services)
+
+
+def get_catalog():
+    """Snapshot atual; confere a versão no banco no máximo a cada CATALOG_CHECK_SECONDS."""
+    global _snapshot, _checked_at
+    snap = _snapshot
+    now = time.monotonic()
+    if snap is not None and now - _checked_at < settings.CATALOG_CHECK_SECONDS:
+        return snap
+    with _lock:
+        if _snapshot is not None and _snapshot is not snap:
+            return _snapshot  # outra thread acabou de recarregar
+        if snap is None or _db_version() != snap.version:
+            snap = _load()
+            _snapshot = snap
+        _checked_at = time.monotonic()
+        return snap
+
+
+def clear_local():
+    """Descarta o snapshot deste processo (recarrega no próximo acesso)."""
+    global _snapshot
+    _snapshot = None
+
+
+def bump_version():
+    """Incrementa a versão no banco e invalida o snapshot local (também após o commit)."""
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1})
+    clear_local()
+    transaction.on_commit(clear_local)
@@ -1,9 +1,11 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 from services.models import Service
 from appointments.models import Appointment
 from sales.models import Sale
+from sales.rollups import queryset_keys, schedule_refresh
 from services.views import trigger_revalidation
 
 
@@ -32,14 +34,18 @@ class Command(BaseCommand):
                 for s in qs:
                     if s.id == primary.id:
                         continue
-                    # reatribui referências
-                    appt_count = Appointment.objects.filter(service=s).count()
+                    # reatribui referências; o update em massa não dispara sinais,
+                    # então os dias afetados do resumo diário são recalculados após o commit
+                    appts = Appointment.objects.filter(service=s)
+                    sales = Sale.objects.filter(service=s)
+                    schedule_refresh(queryset_keys(appts) | set(sales.values_list('barber_id', 'created_at')))
+                    appt_count = appts.count()
                     if appt_count:
-                        Appointment.objects.filter(service=s).update(service=primary)
+                        appts.update(service=primary, updated_at=timezone.now())
                         self.stdout.write(self.style.SUCCESS(f"  - Reatribuidos {appt_count} agendamentos do serviço id={s.id} para id={primary.id}"))
-                    sale_count = Sale.objects.filter(service=s).count()
+                    sale_count = sales.count()
                     if sale_count:
-                        Sale.objects.filter(service=s).update(service=primary)
+                        sales.update(service=primary)
                         self.stdout.write(self.style.SUCCESS(f"  - Reatribuidas {sale_count} vendas do serviço id={s.id} para id={primary.id}"))
 
                     sid = s.id
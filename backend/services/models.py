@@ -15,4 +15,15 @@ class Service(models.Model):
     def __str__(self):
         return self.title
 
-# Create your models here.
+
+class CatalogVersion(models.Model):
+    """Contador único (pk=1) incrementado a cada alteração de barbeiros/serviços.
+
+    Cada processo compara o valor com o do seu snapshot do catálogo
+    (services.catalog) para saber quando recarregar.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Catálogo v{self.version}"
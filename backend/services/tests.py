@@ -1,3 +1,42 @@
-from django.test import TestCase
+from django.db.models import F
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+from users.models import User
+from .catalog import get_catalog
+from .models import CatalogVersion, Service
+
+
+class CatalogSnapshotTests(TestCase):
+    def setUp(self):
+        self.barber = User.objects.create_user(username='joao', password='x', role=User.BARBER, display_name='João Silva')
+        self.service = Service.objects.create(title='Corte Navalhado', price=50, duration_minutes=40)
+
+    def test_resolves_names_and_titles_without_queries(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            catalog = get_catalog()
+            self.assertEqual(catalog.barber_by_name(' JOÃO SILVA '), self.barber)
+            self.assertEqual(catalog.barber_by_name('Joao'), self.barber)
+            self.assertEqual(catalog.service_by_title('corte navalhado').duration_minutes, 40)
+            self.assertEqual(catalog.service(str(self.service.id)), self.service)
+            self.assertIsNone(catalog.barber('abc'))
+
+    def test_local_saves_apply_immediately_and_logins_do_not_bump(self):
+        get_catalog()
+        self.service.duration_minutes = 45
+        self.service.save()
+        self.assertEqual(get_catalog().service(self.service.id).duration_minutes, 45)
+        version = CatalogVersion.objects.get(pk=1).version
+        self.barber.save(update_fields=['last_login'])
+        self.assertEqual(CatalogVersion.objects.get(pk=1).version, version)
+
+    @override_settings(CATALOG_CHECK_SECONDS=0)
+    def test_reloads_when_another_process_bumps_the_version(self):
+        self.assertIsNotNone(get_catalog().service_by_title('corte navalhado'))
+        # outro worker: update sem sinais neste processo + incremento da versão
+        Service.objects.filter(pk=self.service.pk).update(title='Corte Clássico')
+        self.assertIsNotNone(get_catalog().service_by_title('corte navalhado'))
+        CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        catalog = get_catalog()
+        self.assertIsNone(catalog.service_by_title('corte navalhado'))
+        self.assertEqual(catalog.service_by_title('corte clássico'), self.service)
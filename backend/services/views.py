@@ -7,6 +7,7 @@ from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from typing import Optional
 
+from .catalog import bump_version as bump_catalog_version
 from .models import Service
 from .serializers import ServiceSerializer
 
@@ -86,6 +87,7 @@ class UpdateServiceOrderView(APIView):
         with transaction.atomic():
             for index, service_id in enumerate(ordered_ids):
                 Service.objects.filter(id=service_id).update(order=index)
+            bump_catalog_version()
         
         trigger_revalidation()
         return Response(status=status.HTTP_200_OK)
@@ -0,0 +1,284 @@
+"""Consultas agregadas usadas pelos gráficos do painel financeiro.
+
+Séries históricas vêm do resumo diário (sales.DailyBarberStats), carregado uma
+vez por período com load_stats e agregado em Python; a série por hora de
+concluídos ainda consulta Appointment diretamente com um único GROUP BY. Os
+buckets vazios são preenchidos com zero.
+
+Todos os números financeiros usam o status gravado (não o effective_status das
+listagens): um atendimento conta como concluído quando o sweeper
+(manage.py sweep_appointments) o marca, então os painéis ficam até um ciclo do
+sweeper atrás do fim real do atendimento.
+"""
+import datetime
+
+from django.db.models import Count
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth, TruncWeek
+from django.utils import timezone
+
+from appointments.models import Appointment
+from audit.models import AuditLog
+from sales.models import DailyBarberStats
+
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+_TRUNC_FUNCS = {
+    'hour': TruncHour,
+    'day': TruncDay,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def _trunc(field, granularity):
+    func = _TRUNC_FUNCS.get(granularity, TruncDay)
+    return func(field, tzinfo=timezone.get_current_timezone())
+
+
+def floor_local(dt, granularity='day'):
+    """Início do bucket (horário local) que contém dt, igual ao Trunc* do banco."""
+    if granularity == 'hour':
+        return dt.replace(minute=0, second=0, microsecond=0)
+    dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if granularity == 'week':
+        return dt - datetime.timedelta(days=dt.weekday())
+    if granularity == 'month':
+        return dt.replace(day=1)
+    return dt
+
+
+def _next_bucket(cur, granularity):
+    if granularity == 'hour':
+        return cur + datetime.timedelta(hours=1)
+    if granularity == 'week':
+        return cur + datetime.timedelta(days=7)
+    if granularity == 'month':
+        if cur.month == 12:
+            return cur.replace(year=cur.year + 1, month=1)
+        return cur.replace(month=cur.month + 1)
+    return cur + datetime.timedelta(days=1)
+
+
+def bucket_starts(start_local, end_local, granularity='day'):
+    """Lista os inícios (horário local) dos buckets entre start_local e end_local."""
+    starts = []
+    cur = start_local
+    while cur < end_local:
+        starts.append(cur)
+        cur = _next_bucket(cur, granularity)
+    return starts
+
+
+def parse_period(month_str, range_str, now_local=None):
+    """Converte os parâmetros month=YYYY-MM / range=N dos gráficos em (start_local, end_local).
+
+    Sem parâmetros, usa o mês corrente.
+    """
+    now_local = now_local or timezone.localtime()
+    month_str = (month_str or '').strip()
+    range_str = (range_str or '').strip().lower()
+    if month_str or not range_str:
+        try:
+            parts = month_str.split('-')
+            year = int(parts[0]) if len(parts) >= 1 and parts[0] else now_local.year
+            month = int(parts[1]) if len(parts) >= 2 and parts[1] else now_local.month
+            start_local = datetime.datetime(year=year, month=month, day=1, tzinfo=now_local.tzinfo)
+        except Exception:
+            start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        return start_local, _next_bucket(start_local, 'month')
+    if range_str in ('today', 'day'):
+        start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+        return start_local, now_local + datetime.timedelta(days=1)
+    days = {'7': 7, 'week': 7, '15': 15, '30': 30, '60': 60, '90': 90}.get(range_str, 30)
+    return now_local - datetime.timedelta(days=days), now_local
+
+
+def to_ms(dt):
+    return int(dt.astimezone(datetime.timezone.utc).timestamp() * 1000)
+
+
+def done_timeseries(start_local, end_local, granularity='day', appts_filter=None, include_edited=False):
+    """Série de agendamentos concluídos por hora/dia (pelo início do atendimento).
+
+    Retorna (points, details) no formato consumido por panel_finances.html:
+    points = [[ts_ms, count], ...] e details = {ts_ms: [títulos de serviço]}.
+    """
+    starts = bucket_starts(start_local, end_local, granularity)
+    if not starts:
+        return [], {}
+    utc_beg = starts[0].astimezone(datetime.timezone.utc)
+    utc_end = _next_bucket(starts[-1], granularity).astimezone(datetime.timezone.utc)
+
+    counts = {}
+    titles = {}
+    done_ids = {}
+    qs = Appointment.objects.filter(
+        status=Appointment.STATUS_DONE,
+        start_datetime__gte=utc_beg,
+        start_datetime__lt=utc_end,
+        **(appts_filter or {}),
+    ).annotate(bucket=_trunc('start_datetime', granularity))
+    if include_edited:
+        # Precisamos dos ids para unir com os agendamentos editados no mesmo bucket
+        for bucket, appt_id, title in qs.values_list('bucket', 'id', 'service__title'):
+            ts = to_ms(bucket)
+            done_ids.setdefault(ts, set()).add(appt_id)
+            titles.setdefault(ts, set()).add(title or '')
+        edits = AuditLog.objects.filter(
+            action='update',
+            target_type='Appointment',
+            timestamp__gte=utc_beg,
+            timestamp__lt=utc_end,
+        ).annotate(bucket=_trunc('timestamp', granularity)).values_list('bucket', 'target_id').distinct()
+        for bucket, target_id in edits:
+            try:
+                done_ids.setdefault(to_ms(bucket), set()).add(int(target_id))
+            except Exception:
+                pass
+        counts = {ts: len(ids) for ts, ids in done_ids.items()}
+    else:
+        rows = qs.values('bucket', 'service__title').annotate(c=Count('id')).order_by()
+        for r in rows:
+            ts = to_ms(r['bucket'])
+            counts[ts] = counts.get(ts, 0) + int(r['c'] or 0)
+            titles.setdefault(ts, set()).add(r['service__title'] or '')
+
+    points = []
+    details = {}
+    for cur in starts:
+        ts = to_ms(cur)
+        details[ts] = sorted(titles.get(ts, ()))
+        points.append([ts, counts.get(ts, 0)])
+    return points, details
+
+
+def _local_midnight(day):
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min), timezone.get_current_timezone())
+
+
+def stats_qs(start_local, end_local, stats_filter=None):
+    """Linhas do resumo diário (DailyBarberStats) que cobrem [start_local, end_local).
+
+    O resumo é por dia local, então um início/fim no meio do dia inclui o dia inteiro.
+    """
+    start_date = timezone.localtime(start_local).date()
+    end_local = timezone.localtime(end_local)
+    end_date = end_local.date()
+    if end_local != _local_midnight(end_date):
+        end_date += datetime.timedelta(days=1)
+    return DailyBarberStats.objects.filter(date__gte=start_date, date__lt=end_date, **(stats_filter or {}))
+
+
+STATS_FIELDS = (
+    'date', 'barber', 'barber__display_name', 'barber__username', 'service', 'service__title',
+    'done_count', 'cancelled_count', 'service_revenue', 'paid_sales', 'withdrawals', 'done_by_hour',
+)
+
+
+def load_stats(start_local, end_local, stats_filter=None):
+    """Carrega uma única vez as linhas do resumo diário do período.
+
+    As funções abaixo agregam essas linhas em Python, então vários gráficos do
+    mesmo período (ver finances_bundle_data) compartilham uma só consulta.
+    """
+    return list(stats_qs(start_local, end_local, stats_filter).values(*STATS_FIELDS))
+
+
+def rows_for_barber(rows, barber_id):
+    """Restringe as linhas carregadas a um barbeiro (None mantém todas)."""
+    if not barber_id:
+        return rows
+    return [r for r in rows if r['barber'] == barber_id]
+
+
+def _date_bucket(day, granularity):
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def revenue_timeseries(rows, start_local, end_local, granularity='day'):
+    """Receita líquida por bucket: serviços concluídos + vendas pagas - retiradas."""
+    nets = {}
+    for r in rows:
+        ts = to_ms(_local_midnight(_date_bucket(r['date'], granularity)))
+        nets[ts] = nets.get(ts, 0) + (r['service_revenue'] or 0) + (r['paid_sales'] or 0) - (r['withdrawals'] or 0)
+    points = []
+    for cur in bucket_starts(floor_local(start_local, granularity), end_local, granularity):
+        ts = to_ms(cur)
+        points.append([ts, float(nets.get(ts, 0))])
+    return points
+
+
+def status_rate_timeseries(rows, start_local, end_local, by_barber=False):
+    """Taxas diárias de concluídos/cancelados a partir do resumo diário.
+
+    Concluídos contam pelo dia do fim do atendimento e cancelados pelo dia do
+    início, como nos demais painéis. Retorna (labels, done_rates, cancel_rates,
+    barbers), onde barbers só é preenchido quando by_barber=True.
+    """
+    totals = {}
+    per_barber = {}
+    for r in rows:
+        done = r['done_count'] or 0
+        cancelled = r['cancelled_count'] or 0
+        d, c = totals.get(r['date'], (0, 0))
+        totals[r['date']] = (d + done, c + cancelled)
+        if by_barber and (done or cancelled):
+            entry = per_barber.setdefault(r['barber'], {
+                'id': r['barber'],
+                'name': r['barber__display_name'] or r['barber__username'] or 'Barbeiro',
+                'counts': {},
+            })
+            d, c = entry['counts'].get(r['date'], (0, 0))
+            entry['counts'][r['date']] = (d + done, c + cancelled)
+
+    def _rates(counts, starts):
+        done_rates = []
+        cancel_rates = []
+        for cur in starts:
+            d, c = counts.get(cur.date(), (0, 0))
+            total = d + c
+            done_rates.append(round((d / total) * 100, 2) if total else 0.0)
+            cancel_rates.append(round((c / total) * 100, 2) if total else 0.0)
+        return done_rates, cancel_rates
+
+    starts = bucket_starts(floor_local(start_local, 'day'), end_local, 'day')
+    labels = [cur.strftime('%d/%m') for cur in starts]
+    done_rates, cancel_rates = _rates(totals, starts)
+    barbers = []
+    for entry in sorted(per_barber.values(), key=lambda e: e['name'].lower()):
+        b_done, b_cancel = _rates(entry['counts'], starts)
+        barbers.append({'id': entry['id'], 'name': entry['name'], 'done_rate': b_done, 'cancel_rate': b_cancel})
+    return labels, done_rates, cancel_rates, barbers
+
+
+def services_done_counts(rows):
+    """[(título do serviço, concluídos)] em ordem decrescente."""
+    counts = {}
+    for r in rows:
+        if r['service'] is None:
+            continue
+        counts[r['service__title']] = counts.get(r['service__title'], 0) + int(r['done_count'] or 0)
+    items = [(title, c) for title, c in counts.items() if c > 0]
+    items.sort(key=lambda x: (-x[1], x[0] or ''))
+    return items
+
+
+def barber_done_counts(rows):
+    """{barber_id: concluídos} no período."""
+    counts = {}
+    for r in rows:
+        counts[r['barber']] = counts.get(r['barber'], 0) + int(r['done_count'] or 0)
+    return counts
+
+
+def done_by_hour(rows):
+    """{hora local de início: concluídos} no período."""
+    counts = {}
+    for r in rows:
+        for h, c in (r['done_by_hour'] or {}).items():
+            counts[int(h)] = counts.get(int(h), 0) + int(c or 0)
+    return counts
@@ -1,3 +1,328 @@
-from django.test import TestCase
+import datetime
+import random
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from appointments.models import Appointment
+from audit.models import AuditLog
+from sales import rollups
+from sales.models import Sale, Withdrawal
+from services.models import Service
+from .models import User
+
+
+def _local(day, minutes):
+    tz = timezone.get_current_timezone()
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time(0, 0)), tz) + datetime.timedelta(minutes=minutes)
+
+
+@override_settings(LIVE_POLL_SECONDS=0.1)
+class PanelStreamTests(TransactionTestCase):
+    """Stream SSE do painel alimentado pelo AuditLog (audit/live.py)."""
+
+    def test_streams_create_and_cancel_for_visible_barbers(self):
+        barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        other = User.objects.create_user(username='outro', password='x', role=User.BARBER)
+        service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        self.client.force_login(barber)
+        resp = self.client.get('/painel/stream/', {'barberIds': str(barber.id)})
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        chunks = iter(resp.streaming_content)
+        try:
+            self.assertEqual(next(chunks), b'retry: 3000\n\n')
+            day = timezone.localdate() + datetime.timedelta(days=3)
+            Appointment.objects.create(
+                barber=other, client_name='Outro', client_phone='1', service=service,
+                start_datetime=_local(day, 9 * 60), end_datetime=_local(day, 9 * 60 + 30),
+            )
+            appt = Appointment.objects.create(
+                barber=barber, client_name='Cliente', client_phone='1', service=service,
+                start_datetime=_local(day, 10 * 60), end_datetime=_local(day, 10 * 60 + 30),
+            )
+            appt.status = Appointment.STATUS_CANCELLED
+            appt.save()
+            received = []
+            while len(received) < 2:
+                chunk = next(chunks).decode()
+                if not chunk.startswith(':'):
+                    received.extend(part for part in chunk.split('\n\n') if part)
+            self.assertIn('event: create', received[0])
+            self.assertIn(f'"appointmentId": {appt.id}', received[0])
+            self.assertIn('event: cancel', received[1])
+        finally:
+            resp.close()
+
+    def test_reconnect_replays_events_after_last_event_id(self):
+        barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER)
+        other = User.objects.create_user(username='outro', password='x', role=User.BARBER)
+        service = Service.objects.create(title='Corte', price=40, duration_minutes=30)
+        day = timezone.localdate() + datetime.timedelta(days=3)
+        first = Appointment.objects.create(
+            barber=barber, client_name='Cliente', client_phone='1', service=service,
+            start_datetime=_local(day, 9 * 60), end_datetime=_local(day, 9 * 60 + 30),
+        )
+        last_id = AuditLog.objects.get(target_id=str(first.pk), action='create').pk
+        # Gravados enquanto o cliente estava desconectado
+        Appointment.objects.create(
+            barber=other, client_name='Outro', client_phone='1', service=service,
+            start_datetime=_local(day, 9 * 60), end_datetime=_local(day, 9 * 60 + 30),
+        )
+        first.status = Appointment.STATUS_CANCELLED
+        first.save()
+        self.client.force_login(barber)
+        resp = self.client.get('/painel/stream/', {'barberIds': str(barber.id)}, HTTP_LAST_EVENT_ID=str(last_id))
+        chunks = iter(resp.streaming_content)
+        try:
+            self.assertEqual(next(chunks), b'retry: 3000\n\n')
+            replayed = next(chunks).decode()
+            self.assertIn('event: cancel', replayed)
+            self.assertIn(f'"appointmentId": {first.id}', replayed)
+        finally:
+            resp.close()
+
+
+class PanelExportTests(TestCase):
+    """Exportações CSV do painel enviadas em stream."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='x', role=User.ADMIN)
+        self.barber = User.objects.create_user(username='barbeiro', password='x', role=User.BARBER, display_name='Zé')
+        self.service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+        today = timezone.localdate()
+        for days_ago, status in ((40, Appointment.STATUS_SCHEDULED), (20, Appointment.STATUS_SCHEDULED),
+                                 (10, Appointment.STATUS_DONE), (5, Appointment.STATUS_CANCELLED)):
+            day = today - datetime.timedelta(days=days_ago)
+            Appointment.objects.create(
+                barber=self.barber, client_name=f'Cliente {days_ago}', client_phone='(11) 9 1234-5678',
+                service=self.service, status=status,
+                start_datetime=_local(day, 9 * 60), end_datetime=_local(day, 9 * 60 + 30),
+            )
+        rollups.replace_stats()
+        self.client.force_login(self.admin)
+
+    def _csv(self, url, params):
+        resp = self.client.get(url, params)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.streaming)
+        return b''.join(resp.streaming_content).decode().splitlines()
+
+    def test_appointments_export(self):
+        lines = self._csv('/painel/agendamentos/', {'export': 'csv'})
+        self.assertEqual(lines[0], 'Data,Hora,Barbeiro,Cliente,Telefone,Serviço,Status')
+        self.assertEqual(len(lines), 5)
+        day = timezone.localdate() - datetime.timedelta(days=5)
+        self.assertEqual(lines[1], f'{day:%d/%m/%Y},09:00,Zé,Cliente 5,(11) 9 1234-5678,Corte Teste,cancelled')
+
+    def test_clients_export_aggregates_by_phone(self):
+        lines = self._csv('/painel/clientes/', {'export': 'all'})
+        self.assertEqual(len(lines), 2)
+        name, phone, last_visit, total, count_done, freq = lines[1].split(',')
+        self.assertEqual((name, phone, total, count_done), ('Cliente 5', '11912345678', '120.00', '3'))
+        day = timezone.localdate() - datetime.timedelta(days=10)
+        self.assertEqual(last_visit, f'{day:%Y-%m-%d} 09:30')
+        self.assertEqual(self._csv('/painel/clientes/', {'export': 'phone'}), ['Telefone', '11912345678'])
+
+    def test_clients_export_requires_permission(self):
+        self.client.force_login(self.barber)
+        self.assertEqual(self.client.get('/painel/clientes/', {'export': 'all'}).status_code, 403)
+
+    def test_finances_export(self):
+        lines = self._csv('/painel/financas/', {'export': 'csv', 'timeline_range': '15', 'timeline_compare': '1'})
+        self.assertEqual(lines[0], 'Agendamentos concluídos')
+        series = lines[3:lines.index('')]
+        self.assertEqual(len(series), 16)
+        self.assertEqual(sum(int(row.split(',')[1]) for row in series), 1)
+        # Finanças usam o status gravado: o agendado de 20 dias atrás ainda não passou pelo sweeper
+        self.assertIn('Zé,1', lines)
+
+
+class PanelAppointmentsPageTests(TestCase):
+    """Página agrupada por barbeiro: ROW_NUMBER() + COUNT agrupado."""
+
+    def test_groups_match_per_barber_slices_with_constant_queries(self):
+        rng = random.Random(20)
+        service = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+        barbers = [User.objects.create_user(username=f'b{i}', password='x', role=User.BARBER) for i in range(4)]
+        base = timezone.localdate() - datetime.timedelta(days=30)
+        appts = []
+        for i, barber in enumerate(barbers):
+            for k in range([45, 3, 0, 21][i]):
+                day = base + datetime.timedelta(days=rng.randrange(60))
+                start = _local(day, 8 * 60 + k * 10)
+                appts.append(Appointment(
+                    barber=barber, client_name=f'c{k}', service=service,
+                    start_datetime=start, end_datetime=start + datetime.timedelta(minutes=5),
+                ))
+        Appointment.objects.bulk_create(appts)
+        self.client.force_login(barbers[0])
+        self.client.get('/painel/agendamentos/')
+
+        for page in (1, 2, 3, 4):
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get('/painel/agendamentos/', {'page': page})
+            appt_queries = [q for q in ctx.captured_queries if 'appointments_appointment' in q['sql']]
+            self.assertEqual(len(appt_queries), 2)
+            self.assertEqual(resp.context['paginator'].num_pages, 3)
+            groups = {g['barber'].id: [a.id for a in g['list']] for g in resp.context['appointments_groups']}
+            for barber in barbers:
+                expected = list(
+                    Appointment.objects.filter(barber=barber).order_by('-start_datetime', '-id')
+                    .values_list('id', flat=True)[(page - 1) * 20:page * 20]
+                )
+                self.assertEqual(groups[barber.id], expected)
+
+
+def _ms(day):
+    return int(_local(day, 0).timestamp() * 1000)
+
+
+class FinanceEndpointTests(TestCase):
+    """Gráficos do painel financeiro (users/finances.py) sobre o resumo diário."""
+
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='x', role=User.ADMIN)
+        self.ana = User.objects.create_user(username='ana', password='x', role=User.BARBER, display_name='Ana')
+        self.bia = User.objects.create_user(username='bia', password='x', role=User.BARBER, display_name='Bia')
+        corte = Service.objects.create(title='Corte Teste', price=40, duration_minutes=30)
+        barba = Service.objects.create(title='Barba Teste', price=25, duration_minutes=30)
+        self.today = timezone.localdate()
+        for barber, service, days_ago, minutes, status in (
+            (self.ana, corte, 2, 10 * 60, Appointment.STATUS_DONE),
+            (self.ana, barba, 2, 11 * 60, Appointment.STATUS_DONE),
+            (self.bia, corte, 5, 9 * 60, Appointment.STATUS_DONE),
+            (self.ana, corte, 5, 14 * 60, Appointment.STATUS_CANCELLED),
+            (self.bia, barba, 3, 9 * 60, Appointment.STATUS_CANCELLED),
+            # Vencido mas ainda não varrido: fora das finanças (status gravado)
+            (self.ana, corte, 1, 9 * 60, Appointment.STATUS_SCHEDULED),
+        ):
+            day = self.day(days_ago)
+            Appointment.objects.create(
+                barber=barber, client_name=f'Cliente {barber.username}', client_phone=f'11 9{barber.id:04d}',
+                service=service, status=status,
+                start_datetime=_local(day, minutes), end_datetime=_local(day, minutes + 30),
+            )
+        sale = Sale.objects.create(barber=self.ana, amount=Decimal('10'), payment_method='pix')
+        Sale.objects.filter(pk=sale.pk).update(created_at=_local(self.day(2), 12 * 60))
+        withdrawal = Withdrawal.objects.create(user=self.ana, amount=Decimal('5'))
+        Withdrawal.objects.filter(pk=withdrawal.pk).update(created_at=_local(self.day(3), 12 * 60))
+        rollups.replace_stats()
+        self.client.force_login(self.admin)
+
+    def day(self, days_ago):
+        return self.today - datetime.timedelta(days=days_ago)
+
+    def _get(self, name, **params):
+        resp = self.client.get(f'/painel/financas/{name}/', params)
+        self.assertEqual(resp.status_code, 200)
+        return resp.json()
+
+    def test_chart_data_buckets_done_by_local_day_and_hour(self):
+        data = self._get('chart-data', range='15', compare='1')
+        current, previous = data['series']
+        self.assertEqual([p[0] for p in current['data']], [_ms(self.day(14 - i)) for i in range(15)])
+        points = dict(current['data'])
+        self.assertEqual(sum(points.values()), 3)
+        self.assertEqual((points[_ms(self.day(2))], points[_ms(self.day(5))], points[_ms(self.day(1))]), (2, 1, 0))
+        self.assertEqual(data['details']['current'][str(_ms(self.day(2)))], ['Barba Teste', 'Corte Teste'])
+        self.assertEqual([p[0] for p in previous['data']], [_ms(self.day(29 - i)) for i in range(15)])
+        self.assertEqual(sum(v for _ts, v in previous['data']), 0)
+
+        data = self._get('chart-data', range='day')
+        self.assertEqual(len(data['series']), 1)
+        self.assertEqual([p[0] for p in data['series'][0]['data']], [_ms(self.today) + h * 3600000 for h in range(24)])
+
+    def test_chart_data_is_scoped_for_regular_barbers(self):
+        self.client.force_login(self.bia)
+        points = dict(self._get('chart-data', range='15')['series'][0]['data'])
+        self.assertEqual(sum(points.values()), 1)
+        self.assertEqual(points[_ms(self.day(5))], 1)
+
+
+    def test_revenue_data_by_granularity(self):
+        # Serviços concluídos 40 + 25 + 40, venda 10, retirada 5
+        series = self._get('revenue-data', range='30')['series']
+        self.assertEqual(series[0]['name'], 'Receita líquida')
+        points = dict(series[0]['data'])
+        self.assertEqual(list(points), [_ms(self.day(30 - i)) for i in range(31)])
+        self.assertEqual((points[_ms(self.day(2))], points[_ms(self.day(3))], points[_ms(self.day(5))]), (75.0, -5.0, 40.0))
+        self.assertEqual(sum(points.values()), 110.0)
+
+        for granularity, floor in (
+            ('week', lambda d: d - datetime.timedelta(days=d.weekday())),
+            ('month', lambda d: d.replace(day=1)),
+        ):
+            points = dict(self._get('revenue-data', range='30', granularity=granularity)['series'][0]['data'])
+            self.assertEqual(list(points)[0], _ms(floor(self.day(30))), granularity)
+            self.assertEqual(sum(points.values()), 110.0, granularity)
+            expected = {}
+            for days_ago, value in ((2, 75.0), (3, -5.0), (5, 40.0)):
+                ts = _ms(floor(self.day(days_ago)))
+                expected[ts] = expected.get(ts, 0) + value
+            self.assertEqual({ts: v for ts, v in points.items() if v}, {ts: v for ts, v in expected.items() if v}, granularity)
+
+    def test_revenue_data_for_a_barber_and_a_month(self):
+        self.client.force_login(self.bia)
+        points = dict(self._get('revenue-data', range='30')['series'][0]['data'])
+        self.assertEqual(sum(points.values()), 40.0)
+        month = self.day(5)
+        data = self._get('revenue-data', month=month.strftime('%Y-%m'), granularity='month')
+        self.assertEqual(data['series'][0]['data'], [[_ms(month.replace(day=1)), 40.0]])
+
+    def test_no_show_rate_per_day_and_per_barber(self):
+        data = self._get('no-show-rate', range='7')
+        labels = data['labels']
+        self.assertEqual(labels, [self.day(7 - i).strftime('%d/%m') for i in range(8)])
+        done, cancel = data['series']['done_rate'], data['series']['cancel_rate']
+        at = {label: (d, c) for label, d, c in zip(labels, done, cancel)}
+        self.assertEqual(at[self.day(5).strftime('%d/%m')], (50.0, 50.0))
+        self.assertEqual(at[self.day(3).strftime('%d/%m')], (0.0, 100.0))
+        self.assertEqual(at[self.day(2).strftime('%d/%m')], (100.0, 0.0))
+        self.assertEqual(at[self.day(1).strftime('%d/%m')], (0.0, 0.0))
+        self.assertNotIn('barbers', data)
+
+        data = self._get('no-show-rate', range='7', barberId=self.ana.id)
+        at = dict(zip(data['labels'], zip(data['series']['done_rate'], data['series']['cancel_rate'])))
+        self.assertEqual(at[self.day(5).strftime('%d/%m')], (0.0, 100.0))
+        self.assertEqual(at[self.day(3).strftime('%d/%m')], (0.0, 0.0))
+
+        data = self._get('no-show-rate', range='7', breakdown='barber')
+        barbers = {b['name']: b for b in data['barbers']}
+        self.assertEqual(list(barbers), ['Ana', 'Bia'])
+        i = data['labels'].index(self.day(5).strftime('%d/%m'))
+        self.assertEqual((barbers['Ana']['done_rate'][i], barbers['Ana']['cancel_rate'][i]), (0.0, 100.0))
+        self.assertEqual((barbers['Bia']['done_rate'][i], barbers['Bia']['cancel_rate'][i]), (100.0, 0.0))
+        self.assertEqual(barbers['Bia']['id'], self.bia.id)
+
+    def test_no_show_rate_ignores_barber_id_for_regular_barbers(self):
+        self.client.force_login(self.bia)
+        data = self._get('no-show-rate', range='7', barberId=self.ana.id)
+        at = dict(zip(data['labels'], zip(data['series']['done_rate'], data['series']['cancel_rate'])))
+        self.assertEqual(at[self.day(5).strftime('%d/%m')], (100.0, 0.0))
+        self.assertEqual(at[self.day(3).strftime('%d/%m')], (0.0, 100.0))
+
+    def test_bundle_matches_individual_endpoints(self):
+        sections = {
+            'chart': 'chart-data',
+            'revenue': 'revenue-data',
+            'services': 'services-breakdown-data',
+            'barber_stats': 'barber-stats-data',
+            'no_show': 'no-show-rate',
+            'clients_top': 'clients-top-data',
+            'occupancy': 'occupancy-buckets',
+        }
+        for user in (self.admin, self.ana):
+            self.client.force_login(user)
+            for params in ({'range': '30'}, {'range': '7', 'granularity': 'week', 'breakdown': 'barber', 'barberId': self.bia.id}):
+                bundle = self._get('bundle', **params)
+                self.assertEqual(set(bundle), set(sections) | {'withdrawals_funnel'})
+                for key, name in sections.items():
+                    single = dict(params)
+                    if key == 'chart':
+                        single = {'range': {'30': '30', '7': 'week'}[params['range']]}
+                    self.assertEqual(bundle[key], self._get(name, **single), (user.username, params, key))
+        self.assertEqual(bundle['services']['labels'], ['Barba Teste', 'Corte Teste'])
+        self.assertEqual(bundle['withdrawals_funnel'], self._get('withdrawals-funnel-data'))
@@ -5,6 +5,7 @@ from .views import (
     dashboard_barber,
     dashboard_admin,
     panel_appointments,
+    panel_stream,
     panel_finances,
     panel_clients,
     finances_chart_data,
@@ -15,6 +16,7 @@ from .views import (
     finances_no_show_rate_data,
     finances_clients_top_data,
     finances_occupancy_buckets_data,
+    finances_bundle_data,
     panel_profile,
     panel_history,
 )
@@ -27,6 +29,7 @@ urlpatterns = [
     path('painel/barbeiro/', dashboard_barber, name='dashboard_barber'),
     path('painel/admin/', dashboard_admin, name='dashboard_admin'),
     path('painel/agendamentos/', panel_appointments, name='panel_appointments'),
+    path('painel/stream/', panel_stream, name='panel_stream'),
     path('painel/financas/', panel_finances, name='panel_finances'),
     path('painel/financas/chart-data/', finances_chart_data, name='finances_chart_data'),
     path('painel/financas/revenue-data/', finances_revenue_data, name='finances_revenue_data'),
@@ -36,6 +39,7 @@ urlpatterns = [
     path('painel/financas/no-show-rate/', finances_no_show_rate_data, name='finances_no_show_rate'),
     path('painel/financas/clients-top-data/', finances_clients_top_data, name='finances_clients_top_data'),
     path('painel/financas/occupancy-buckets/', finances_occupancy_buckets_data, name='finances_occupancy_buckets_data'),
+    path('painel/financas/bundle/', finances_bundle_data, name='finances_bundle_data'),
     path('painel/clientes/', panel_clients, name='panel_clients'),
     path('painel/perfil/', panel_profile, name='panel_profile'),
     path('painel/historico/', panel_history, name='panel_history'),
@@ -2,23 +2,65 @@ from django.shortcuts import render, redirect
 import os
 from decimal import Decimal, ROUND_HALF_UP
 from django.contrib.auth.decorators import login_required
-from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+from django.http import HttpRequest, HttpResponseForbidden
 import csv
+import io
 from .models import User
 from django.utils import timezone
 from appointments.models import Appointment, TimeBlock
 import datetime
-from services.models import Service
+from services.catalog import get_catalog
 from sales.models import Sale, Withdrawal
 from audit.models import AuditLog
-from django.db.models import Sum, Count, Q
+from django.db.models import Sum, Count, Q, F, Window
+from django.db.models.functions import RowNumber
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.conf import settings
+from django.db import connection
+import json
+import time
+from audit.live import broker as live_broker, replay as live_replay
 from django.utils import timezone
 from audit.models import AuditLog
 import datetime
 from sales.models import Sale, Withdrawal
 from django.db.models import Sum
+from .finances import (
+    barber_done_counts,
+    done_by_hour,
+    done_timeseries,
+    floor_local,
+    load_stats,
+    parse_period,
+    revenue_timeseries,
+    rows_for_barber,
+    services_done_counts,
+    stats_qs,
+    status_rate_timeseries,
+)
+
+# Exportações CSV são enviadas em blocos (StreamingHttpResponse): a memória do
+# worker fica limitada a um bloco mais o lote do cursor, não ao arquivo inteiro.
+CSV_CHUNK_BYTES = 64 * 1024
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _csv_stream(rows, filename, content_type='text/csv; charset=utf-8'):
+    def content():
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for row in rows:
+            writer.writerow(row)
+            if buf.tell() >= CSV_CHUNK_BYTES:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    response = StreamingHttpResponse(content(), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 
 
@@ -34,12 +76,10 @@ def painel_index(request: HttpRequest):
 def dashboard_barber(request: HttpRequest):
     user: User = request.user  # type: ignore
     now_local = timezone.localtime()
-    # Auto-concluir agendamentos passados (comparação em UTC)
-    Appointment.objects.filter(status='scheduled', end_datetime__lte=timezone.now()).update(status='done')
     today_start = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
     today_end = today_start + timezone.timedelta(days=1)
 
-    appts_today = Appointment.objects.filter(
+    appts_today = Appointment.objects.with_effective_status().filter(
         barber=user,
         start_datetime__gte=today_start,
         start_datetime__lt=today_end,
@@ -52,7 +92,7 @@ def dashboard_barber(request: HttpRequest):
         status='paid'
     )
 
-    appts_done_today = appts_today.filter(status='done')
+    appts_done_today = appts_today.filter(effective_status='done')
     appts_value_today = appts_done_today.filter(sale__isnull=True).aggregate(total=Sum('service__price'))['total'] or 0
     sales_value_today = sales_today.aggregate(total=Sum('amount'))['total'] or 0
     day_revenue = (appts_value_today or 0) + (sales_value_today or 0)
@@ -81,12 +121,10 @@ def dashboard_barber(request: HttpRequest):
 @login_required
 def dashboard_admin(request: HttpRequest):
     now_local = timezone.localtime()
-    # Auto-concluir agendamentos passados (comparação em UTC)
-    Appointment.objects.filter(status='scheduled', end_datetime__lte=timezone.now()).update(status='done')
     today_start = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
     today_end = today_start + timezone.timedelta(days=1)
 
-    appts_today = Appointment.objects.filter(
+    appts_today = Appointment.objects.with_effective_status().filter(
         start_datetime__gte=today_start,
         start_datetime__lt=today_end,
     )
@@ -96,8 +134,11 @@ def dashboard_admin(request: HttpRequest):
         status='paid'
     )
 
-    status_breakdown = appts_today.values('status').annotate(c=Count('id'))
-    appts_done_today = appts_today.filter(status='done')
+    status_breakdown = [
+        {'status': r['effective_status'], 'c': r['c']}
+        for r in appts_today.values('effective_status').annotate(c=Count('id')).order_by()
+    ]
+    appts_done_today = appts_today.filter(effective_status='done')
     appts_value_today = appts_done_today.filter(sale__isnull=True).aggregate(total=Sum('service__price'))['total'] or 0
     sales_value_today = sales_today.aggregate(total=Sum('amount'))['total'] or 0
     sales_total = (appts_value_today or 0) + (sales_value_today or 0)
@@ -120,70 +161,88 @@ def dashboard_admin(request: HttpRequest):
 def panel_appointments(request: HttpRequest):
     user: User = request.user  # type: ignore
     now_local = timezone.localtime()
-    # Auto-concluir agendamentos passados (comparação em UTC)
-    Appointment.objects.filter(status='scheduled', end_datetime__lte=timezone.now()).update(status='done')
     # Histórico completo, incluindo passados, mais recentes primeiro
     special_all_view = (getattr(user, 'username', '') or '').lower() in ['kaue', 'alafy', 'alafi', 'alefi']
     # Ajuste: todos os barbeiros podem ver todos os agendamentos
     # Mantemos is_admin=True para habilitar colunas de "Barbeiro" no CSV quando visualizam tudo
     if user.role in {User.ADMIN, User.BARBER} or special_all_view:
-        qs = Appointment.objects.all().order_by('-start_datetime')
+        qs = Appointment.objects.with_effective_status().order_by('-start_datetime')
         is_admin = True
     else:
-        qs = Appointment.objects.filter(barber=user).order_by('-start_datetime')
+        qs = Appointment.objects.with_effective_status().filter(barber=user).order_by('-start_datetime')
         is_admin = False
 
     # Exportação CSV
     if request.GET.get('export') == 'csv':
-        rows = qs.select_related('barber', 'service').order_by('-start_datetime')
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="agendamentos.csv"'
-        writer = csv.writer(response)
-        if is_admin:
-            writer.writerow(['Data', 'Hora', 'Barbeiro', 'Cliente', 'Telefone', 'Serviço', 'Status'])
-        else:
-            writer.writerow(['Data', 'Hora', 'Cliente', 'Telefone', 'Serviço', 'Status'])
-        for a in rows:
-            date_str = timezone.localtime(a.start_datetime).strftime('%d/%m/%Y')
-            time_str = timezone.localtime(a.start_datetime).strftime('%H:%M')
-            base = [date_str, time_str]
+        tz = timezone.get_current_timezone()
+        rows = qs.values_list(
+            'start_datetime', 'barber__display_name', 'barber__username',
+            'client_name', 'client_phone', 'service__title', 'effective_status',
+        )
+
+        def export_rows():
             if is_admin:
-                base.append(getattr(a.barber, 'display_name', None) or getattr(a.barber, 'username', ''))
-            base.extend([a.client_name, a.client_phone or '', getattr(a.service, 'title', ''), a.status])
-            writer.writerow(base)
-        return response
+                yield ['Data', 'Hora', 'Barbeiro', 'Cliente', 'Telefone', 'Serviço', 'Status']
+            else:
+                yield ['Data', 'Hora', 'Cliente', 'Telefone', 'Serviço', 'Status']
+            for start, barber_name, barber_username, client_name, client_phone, service_title, status in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                local = start.astimezone(tz)
+                base = [local.strftime('%d/%m/%Y'), local.strftime('%H:%M')]
+                if is_admin:
+                    base.append(barber_name or barber_username or '')
+                base.extend([client_name, client_phone or '', service_title or '', status])
+                yield base
+
+        return _csv_stream(export_rows(), 'agendamentos.csv')
 
     # Paginação: 20 por página (por barbeiro)
     PER_PAGE = 20
     try:
-        page_number = int(request.GET.get('page', 1))
+        page_number = max(1, int(request.GET.get('page', 1)))
     except Exception:
         page_number = 1
     # Lista de todos os barbeiros para exibir colunas mesmo sem agendamentos
-    barbers_all = list(User.objects.filter(role=User.BARBER).order_by('display_name', 'username'))
+    barbers_all = list(get_catalog().barbers)
     # Reordenar para que o barbeiro logado apareça primeiro na lista
     if getattr(user, 'role', None) == User.BARBER:
         try:
             barbers_all = [b for b in barbers_all if b.id == user.id] + [b for b in barbers_all if b.id != user.id]
         except Exception:
             pass
-    # Agrupar itens desta página por barbeiro e calcular páginas máximas
+    # Agrupar itens desta página por barbeiro e calcular páginas máximas.
+    # Duas consultas no total, independente do número de barbeiros: a página
+    # de cada barbeiro sai de um ROW_NUMBER() particionado por barbeiro e os
+    # totais de um COUNT agrupado.
+    barber_ids = [b.id for b in barbers_all]
+    start = (page_number - 1) * PER_PAGE
+    end = start + PER_PAGE
+    page_rows = qs.filter(barber_id__in=barber_ids).select_related('service').annotate(
+        barber_row=Window(
+            RowNumber(),
+            partition_by=[F('barber_id')],
+            order_by=[F('start_datetime').desc(), F('id').desc()],
+        ),
+    ).filter(barber_row__gt=start, barber_row__lte=end).order_by('barber_id', 'barber_row')
+    counts = dict(qs.filter(barber_id__in=barber_ids).order_by().values_list('barber_id').annotate(c=Count('id')))
+    by_barber = {}
+    for a in page_rows:
+        by_barber.setdefault(a.barber_id, []).append(a)
+    barbers_by_id = {b.id: b for b in barbers_all}
     max_pages = 1
     appointments_groups = []
     for b in barbers_all:
-        bqs = qs.filter(barber_id=b.id)
-        count_b = bqs.count()
+        count_b = counts.get(b.id, 0)
         pages_b = ((count_b + PER_PAGE - 1) // PER_PAGE) if count_b else 1
         if pages_b > max_pages:
             max_pages = pages_b
-        start = (page_number - 1) * PER_PAGE
-        end = start + PER_PAGE
-        blist = list(bqs[start:end])
+        blist = by_barber.get(b.id, [])
+        for a in blist:
+            # O template usa a.barber.id: reaproveita o barbeiro do catálogo
+            a.barber = barbers_by_id[a.barber_id]
         appointments_groups.append({'barber': b, 'list': blist})
 
-    # Criar um paginator "dummy" apenas para a navegação de páginas no template
-    dummy_items = list(range(max_pages * PER_PAGE))
-    paginator = Paginator(dummy_items, PER_PAGE)
+    # Paginator apenas para a navegação de páginas no template (range não materializa a lista)
+    paginator = Paginator(range(max_pages * PER_PAGE), PER_PAGE)
     page_obj = paginator.get_page(page_number)
 
     return render(request, 'panel_appointments.html', {
@@ -194,11 +253,70 @@ def panel_appointments(request: HttpRequest):
     })
 
 
+@login_required
+def panel_stream(request: HttpRequest):
+    """SSE com eventos de agendamento (create/reschedule/cancel/done/update) dos barbeiros visíveis.
+
+    Alimentado pelo broker de audit/live.py. ?barberIds=1,2 restringe os
+    barbeiros. A conexão dura até LIVE_STREAM_MAX_SECONDS e manda um comentário
+    de keep-alive a cada 15 s; o EventSource reconecta sozinho e, com o
+    cabeçalho Last-Event-ID, recebe primeiro o que perdeu enquanto esteve fora.
+    """
+    user: User = request.user  # type: ignore
+    special_all_view = (getattr(user, 'username', '') or '').lower() in ['kaue', 'alafy', 'alafi', 'alefi']
+    visible = None  # None = todos
+    if not (user.role in {User.ADMIN, User.BARBER} or special_all_view):
+        visible = {user.id}
+    barber_ids_param = (request.GET.get('barberIds') or '').strip()
+    if barber_ids_param:
+        try:
+            wanted = {int(x) for x in barber_ids_param.split(',') if x.strip()}
+        except ValueError:
+            return JsonResponse({'detail': 'barberIds inválido.'}, status=400)
+        visible = wanted if visible is None else (visible & wanted)
+
+    last_event_id = (request.headers.get('Last-Event-ID') or '').strip()
+
+    def is_visible(e):
+        return visible is None or bool(e['barbers'] & visible)
+
+    def fmt(e):
+        return f"id: {e['id']}\nevent: {e['type']}\ndata: {json.dumps(e['data'])}\n\n"
+
+    def events():
+        deadline = time.monotonic() + settings.LIVE_STREAM_MAX_SECONDS
+        after = live_broker.subscribe()
+        try:
+            # Reconexão: o que foi gravado enquanto o cliente esteve fora
+            missed = live_replay(int(last_event_id)) if last_event_id.isdigit() else []
+            replayed = {e['id'] for e in missed}
+            # O stream não usa o banco; não segurar a conexão da requisição por minutos
+            connection.close()
+            yield 'retry: 3000\n\n'
+            for e in missed:
+                if is_visible(e):
+                    yield fmt(e)
+            while time.monotonic() < deadline:
+                batch = live_broker.wait(after, timeout=15)
+                if not batch:
+                    yield ': keep-alive\n\n'
+                    continue
+                after = batch[-1]['seq']
+                for e in batch:
+                    if e['id'] not in replayed and is_visible(e):
+                        yield fmt(e)
+        finally:
+            live_broker.unsubscribe()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def panel_finances(request: HttpRequest):
     user: User = request.user  # type: ignore
-    # Auto-concluir agendamentos passados (comparação em UTC)
-    Appointment.objects.filter(status='scheduled', end_datetime__lte=timezone.now()).update(status='done')
     now = timezone.localtime()
     today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     today_end = today_start + timezone.timedelta(days=1)
@@ -252,24 +370,27 @@ def panel_finances(request: HttpRequest):
                 pass
 
     sales_today = Sale.objects.filter(created_at__gte=today_start, created_at__lt=today_end, **sales_filter)
-    sales_month = Sale.objects.filter(created_at__gte=month_start, created_at__lt=today_end, **sales_filter)
-    # Concluídos hoje: usar end_datetime (momento da conclusão real)
-    appts_completed_today = Appointment.objects.filter(status='done', end_datetime__gte=today_start, end_datetime__lt=today_end, **appts_filter)
-    # Mês: usar end_datetime para refletir receita reconhecida na conclusão
-    appts_month_done = Appointment.objects.filter(status='done', end_datetime__gte=month_start, end_datetime__lt=today_end, **appts_filter)
+    # Agendamentos de hoje e do mês: resumo diário (concluídos pelo end_datetime,
+    # cancelados pelo start_datetime, vendas e retiradas pelo created_at). Ele usa
+    # o status gravado, então acompanha o sweeper (ver sales/rollups.py).
+    today_own = stats_qs(today_start, today_end).filter(**appts_filter).aggregate(
+        done=Sum('done_count'),
+        appts=Sum('service_revenue_without_sale'),
+        cancelled=Sum('cancelled_count'),
+    )
+    stats_month = stats_qs(month_start, today_end)
+    stats_month_own = stats_month.filter(**appts_filter)
+    month_own = stats_month_own.aggregate(
+        appts=Sum('service_revenue_without_sale'),
+        sales=Sum('paid_sales'),
+        services=Sum('service_revenue'),
+    )
 
     # KPIs baseados em agendamentos concluídos + vendas pagas
-    appts_today_value = appts_completed_today.filter(sale__isnull=True).aggregate(total=Sum('service__price'))['total'] or 0
-    appts_month_value = appts_month_done.filter(sale__isnull=True).aggregate(total=Sum('service__price'))['total'] or 0
+    appts_today_value = today_own['appts'] or 0
+    appts_month_value = month_own['appts'] or 0
     sales_today_value = sales_today.filter(status='paid').aggregate(total=Sum('amount'))['total'] or 0
-    sales_month_value = sales_month.filter(status='paid').aggregate(total=Sum('amount'))['total'] or 0
-    # Cancelados hoje (considerando janela pelo start_datetime, como nos painéis)
-    appts_cancelled_today = Appointment.objects.filter(
-        status='cancelled',
-        start_datetime__gte=today_start,
-        start_datetime__lt=today_end,
-        **appts_filter,
-    )
+    sales_month_value = month_own['sales'] or 0
 
     def fmt_money(v):
         if v is None: v = 0
@@ -282,37 +403,30 @@ def panel_finances(request: HttpRequest):
         'today_revenue': fmt_money(today_rev),
         'month_revenue': fmt_money(month_rev),
         'sales_count': sales_today.count(),
-        'appts_completed': appts_completed_today.count() + sales_today.filter(appointment__isnull=True).count(),
-        'appts_cancelled': appts_cancelled_today.count(),
+        'appts_completed': (today_own['done'] or 0) + sales_today.filter(appointment__isnull=True).count(),
+        'appts_cancelled': today_own['cancelled'] or 0,
     }
 
     # Faturamento total do mês (todos os barbeiros) somente para Kaue/Alafy
     if (not is_admin) and is_special_finances_view:
-        appts_month_all_value = Appointment.objects.filter(
-            status='done',
-            end_datetime__gte=month_start,
-            end_datetime__lt=today_end,
-            sale__isnull=True,
-        ).aggregate(total=Sum('service__price'))['total'] or 0
-        sales_month_all_paid_value = Sale.objects.filter(
-            created_at__gte=month_start,
-            created_at__lt=today_end,
-            status='paid',
-        ).aggregate(total=Sum('amount'))['total'] or 0
+        month_all = stats_month.aggregate(
+            appts=Sum('service_revenue_without_sale'),
+            sales=Sum('paid_sales'),
+            withdrawals=Sum('withdrawals'),
+        )
+        appts_month_all_value = month_all['appts'] or 0
+        sales_month_all_paid_value = month_all['sales'] or 0
         # Subtrair retiradas do mês para visão total
-        withdrawals_month_total = Withdrawal.objects.filter(
-            created_at__gte=month_start,
-            created_at__lt=today_end,
-        ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-        
+        withdrawals_month_total = month_all['withdrawals'] or Decimal('0')
+
         total_all = ((appts_month_all_value or 0) + (sales_month_all_paid_value or 0)) - (withdrawals_month_total or Decimal('0'))
         kpis['month_total_all'] = fmt_money(total_all)
 
     # Participação do barbeiro (Mês) baseada somente em serviços concluídos
     if not is_admin:
         uname = (user.username or '').lower()
-        # Total de serviços concluídos do próprio barbeiro no mês (appts_month_done já aplica filtro do barbeiro)
-        self_services_month = appts_month_done.aggregate(total=Sum('service__price'))['total'] or Decimal('0')
+        # Total de serviços concluídos do próprio barbeiro no mês (month_own já aplica filtro do barbeiro)
+        self_services_month = month_own['services'] or Decimal('0')
         share_month: Decimal = Decimal('0')
         if uname in ['rikelv', 'emerson', 'kevin']:
             # 60% do total dos serviços do próprio barbeiro no mês
@@ -320,11 +434,7 @@ def panel_finances(request: HttpRequest):
         elif uname in ['kaue', 'alefi', 'alafy', 'alafi']:
             # 40% dos serviços dos três barbeiros (rikelv, emerson, kevin) no mês + 100% dos próprios serviços no mês
             others_q = Q(barber__username__iexact='rikelv') | Q(barber__username__iexact='emerson') | Q(barber__username__iexact='kevin')
-            others_services_month = Appointment.objects.filter(
-                status='done',
-                end_datetime__gte=month_start,
-                end_datetime__lt=today_end,
-            ).filter(others_q).aggregate(total=Sum('service__price'))['total'] or Decimal('0')
+            others_services_month = stats_month.filter(others_q).aggregate(total=Sum('service_revenue'))['total'] or Decimal('0')
             share_month = (others_services_month * Decimal('0.40')) + (self_services_month * Decimal('1.00'))
         # Garantir duas casas decimais
         kpis['barber_share_month'] = fmt_money(share_month)
@@ -336,19 +446,13 @@ def panel_finances(request: HttpRequest):
     # - Admin: todos os barbeiros
     # - Kaue/Alafy: todos os barbeiros
     # - Demais barbeiros: apenas seus próprios serviços
-    breakdown_source_qs = (
-        Appointment.objects.filter(
-            status='done',
-            end_datetime__gte=month_start,
-            end_datetime__lt=today_end,
-        ) if (is_admin or is_special_finances_view) else appts_month_done
-    )
+    breakdown_source_qs = stats_month if (is_admin or is_special_finances_view) else stats_month_own
 
-    # Quebra por serviço baseada em agendamentos concluídos
-    appt_breakdown = breakdown_source_qs.filter(sale__isnull=True).values('service__id', 'service__title').annotate(
-        count=Count('id'),
-        total_value=Sum('service__price')
-    )
+    # Quebra por serviço baseada em agendamentos concluídos (sem venda vinculada)
+    appt_breakdown = breakdown_source_qs.filter(service__isnull=False).values('service__id', 'service__title').annotate(
+        count=Sum('done_without_sale'),
+        total_value=Sum('service_revenue_without_sale')
+    ).filter(count__gt=0)
     # Apenas serviços concluídos (vendas são produtos avulsos, não entram neste breakdown)
     breakdown_by_service = sorted([
         {
@@ -358,15 +462,12 @@ def panel_finances(request: HttpRequest):
             'total_value': r['total_value'] or 0,
         } for r in appt_breakdown
     ], key=lambda x: x['total_value'], reverse=True)
-    breakdown_by_barber = appts_month_done.exclude(barber__username__iexact='teste').exclude(barber__display_name__iexact='Teste Barber').values('barber__id', 'barber__display_name', 'barber__username').annotate(
-        count=Count('id'),
-        total_value=Sum('service__price')
-    ).order_by('-total_value')
+    breakdown_by_barber = stats_month_own.exclude(barber__username__iexact='teste').exclude(barber__display_name__iexact='Teste Barber').values('barber__id', 'barber__display_name', 'barber__username').annotate(
+        count=Sum('done_count'),
+        total_value=Sum('service_revenue')
+    ).filter(count__gt=0).order_by('-total_value')
 
     if request.GET.get('export') == 'csv':
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="financas_export.csv"'
-        writer = csv.writer(response)
         timeline_range = (request.GET.get('timeline_range') or '30').lower()
         timeline_compare = (request.GET.get('timeline_compare') or '0').lower() in ('1','true','on')
         include_edited = (request.GET.get('include_edited') or '0').lower() in ('1','true','on')
@@ -374,308 +475,151 @@ def panel_finances(request: HttpRequest):
         services_compare = (request.GET.get('services_compare') or '0').lower() in ('1','true','on')
         services_month_compare = request.GET.get('services_month_compare') or ''
         barber_range = (request.GET.get('barber_range') or '30').lower()
+        timeline_filter = {} if (is_admin or is_special_finances_view) else {'barber': user}
 
-        def _mk_timeline(rng):
+        def export_rows():
+            # Série de concluídos: uma consulta agrupada por período (done_timeseries)
+            # em vez de duas consultas por hora/dia.
             now_loc = timezone.localtime()
-            if rng in ('day', 'today'):
+            if timeline_range in ('day', 'today'):
                 start_l = now_loc.replace(hour=0, minute=0, second=0, microsecond=0)
                 end_l = start_l + timezone.timedelta(days=1)
                 gran = 'hour'
-            elif rng in ('week','7'):
-                start_l = now_loc - timezone.timedelta(days=7)
-                end_l = now_loc
-                gran = 'day'
-            elif rng in ('15',):
-                start_l = now_loc - timezone.timedelta(days=15)
-                end_l = now_loc
-                gran = 'day'
+                period_len = timezone.timedelta(days=1)
             else:
-                start_l = now_loc - timezone.timedelta(days=30)
+                days = {'week': 7, '7': 7, '15': 15}.get(timeline_range, 30)
+                start_l = floor_local(now_loc - timezone.timedelta(days=days))
                 end_l = now_loc
                 gran = 'day'
-            apf = {}
-            if not (is_admin or is_special_finances_view):
-                apf['barber'] = user
-            cur = start_l
-            pts = []
-            det = {}
-            if gran == 'hour':
-                step = timezone.timedelta(hours=1)
-            else:
-                step = timezone.timedelta(days=1)
-            while cur < end_l:
-                nxt = cur + step
-                ub = cur.astimezone(datetime.timezone.utc)
-                ue = nxt.astimezone(datetime.timezone.utc)
-                done_qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, start_datetime__gte=ub, start_datetime__lt=ue, **apf)
-                ids = set(done_qs.values_list('id', flat=True))
-                if include_edited:
-                    edits = AuditLog.objects.filter(action='update', target_type='Appointment', timestamp__gte=ub, timestamp__lt=ue)
-                    eids = set()
-                    for t in edits.values_list('target_id', flat=True):
-                        try:
-                            eids.add(int(t))
-                        except Exception:
-                            pass
-                    ids |= eids
-                ts = int(cur.astimezone(datetime.timezone.utc).timestamp()*1000)
-                services = list({getattr(a.service, 'title', '') for a in done_qs})
-                det[ts] = services
-                pts.append([ts, len(ids)])
-                cur = nxt
-            return pts, det
-
-        writer.writerow(['Agendamentos concluídos'])
-        writer.writerow(['Período', timeline_range])
-        pts, det = _mk_timeline(timeline_range)
-        writer.writerow(['Timestamp(ms)', 'Concluídos', 'Serviços'])
-        for ts,val in pts:
-            writer.writerow([ts, val, '; '.join(det.get(ts, []))])
-        if timeline_compare:
-            now_loc = timezone.localtime()
-            if timeline_range in ('day','today'):
-                prev_start = now_loc.replace(hour=0, minute=0, second=0, microsecond=0) - timezone.timedelta(days=1)
-                prev_end = prev_start + timezone.timedelta(days=1)
-            elif timeline_range in ('week','7'):
-                prev_start = now_loc - timezone.timedelta(days=14)
-                prev_end = now_loc - timezone.timedelta(days=7)
-            elif timeline_range in ('15',):
-                prev_start = now_loc - timezone.timedelta(days=30)
-                prev_end = now_loc - timezone.timedelta(days=15)
-            else:
-                prev_start = now_loc - timezone.timedelta(days=60)
-                prev_end = now_loc - timezone.timedelta(days=30)
-            rng_prev = 'compare'
-            writer.writerow([])
-            writer.writerow(['Agendamentos concluídos (comparação)'])
-            writer.writerow(['Período', rng_prev])
-            # shift logic by passing explicit interval
-            def _mk_interval(s_l, e_l, gran):
-                apf = {}
-                if not (is_admin or is_special_finances_view):
-                    apf['barber'] = user
-                cur = s_l
-                pts = []
-                det = {}
-                step = timezone.timedelta(hours=1) if gran=='hour' else timezone.timedelta(days=1)
-                while cur < e_l:
-                    nxt = cur + step
-                    ub = cur.astimezone(datetime.timezone.utc)
-                    ue = nxt.astimezone(datetime.timezone.utc)
-                    done_qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, start_datetime__gte=ub, start_datetime__lt=ue, **apf)
-                    ids = set(done_qs.values_list('id', flat=True))
-                    if include_edited:
-                        edits = AuditLog.objects.filter(action='update', target_type='Appointment', timestamp__gte=ub, timestamp__lt=ue)
-                        eids = set()
-                        for t in edits.values_list('target_id', flat=True):
-                            try:
-                                eids.add(int(t))
-                            except Exception:
-                                pass
-                        ids |= eids
-                    ts = int(cur.astimezone(datetime.timezone.utc).timestamp()*1000)
-                    services = list({getattr(a.service, 'title', '') for a in done_qs})
-                    det[ts] = services
-                    pts.append([ts, len(ids)])
-                    cur = nxt
-                return pts, det
-            gran = 'hour' if timeline_range in ('day','today') else 'day'
-            pts2, det2 = _mk_interval(prev_start, prev_end, gran)
-            writer.writerow(['Timestamp(ms)', 'Concluídos', 'Serviços'])
-            for ts,val in pts2:
-                writer.writerow([ts, val, '; '.join(det2.get(ts, []))])
-
-        writer.writerow([])
-        writer.writerow(['Serviços mais agendados'])
-        month_sel = services_month
-        now_local2 = timezone.localtime()
-        try:
-            parts = (month_sel or '').split('-')
-            year = int(parts[0]) if len(parts)>=1 and parts[0] else now_local2.year
-            month = int(parts[1]) if len(parts)>=2 and parts[1] else now_local2.month
-            start_l = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local2.tzinfo)
-        except Exception:
-            start_l = now_local2.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        end_l = start_l.replace(month=start_l.month + 1) if start_l.month < 12 else start_l.replace(year=start_l.year+1, month=1)
-        apf2 = {}
-        if not (is_admin or is_special_finances_view):
-            apf2['barber'] = user
-        ub = start_l.astimezone(datetime.timezone.utc)
-        ue = end_l.astimezone(datetime.timezone.utc)
-        rows = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=ub, end_datetime__lt=ue, **apf2).values('service__title').annotate(c=Count('id')).order_by('-c')
-        writer.writerow(['Serviço', 'Concluídos'])
-        for r in rows:
-            writer.writerow([r['service__title'] or 'Serviço', int(r['c'] or 0)])
-        if services_compare and services_month_compare:
-            writer.writerow([])
-            writer.writerow(['Serviços mais agendados (comparação)'])
-            parts = (services_month_compare or '').split('-')
+                period_len = timezone.timedelta(days=days)
+
+            yield ['Agendamentos concluídos']
+            yield ['Período', timeline_range]
+            pts, det = done_timeseries(start_l, end_l, gran, timeline_filter, include_edited)
+            yield ['Timestamp(ms)', 'Concluídos', 'Serviços']
+            for ts, val in pts:
+                yield [ts, val, '; '.join(det.get(ts, []))]
+            if timeline_compare:
+                yield []
+                yield ['Agendamentos concluídos (comparação)']
+                yield ['Período', 'compare']
+                pts2, det2 = done_timeseries(start_l - period_len, start_l, gran, timeline_filter, include_edited)
+                yield ['Timestamp(ms)', 'Concluídos', 'Serviços']
+                for ts, val in pts2:
+                    yield [ts, val, '; '.join(det2.get(ts, []))]
+
+            yield []
+            yield ['Serviços mais agendados']
+            month_sel = services_month
+            now_local2 = timezone.localtime()
             try:
+                parts = (month_sel or '').split('-')
                 year = int(parts[0]) if len(parts)>=1 and parts[0] else now_local2.year
                 month = int(parts[1]) if len(parts)>=2 and parts[1] else now_local2.month
-                start_l2 = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local2.tzinfo)
+                start_l = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local2.tzinfo)
             except Exception:
-                start_l2 = now_local2.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            end_l2 = start_l2.replace(month=start_l2.month + 1) if start_l2.month < 12 else start_l2.replace(year=start_l2.year+1, month=1)
-            ub2 = start_l2.astimezone(datetime.timezone.utc)
-            ue2 = end_l2.astimezone(datetime.timezone.utc)
-            rows2 = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=ub2, end_datetime__lt=ue2, **apf2).values('service__title').annotate(c=Count('id')).order_by('-c')
-            writer.writerow(['Serviço', 'Concluídos'])
-            for r in rows2:
-                writer.writerow([r['service__title'] or 'Serviço', int(r['c'] or 0)])
-
-        writer.writerow([])
-        writer.writerow(['Quantidade de serviços por barbeiro'])
-        rng = barber_range
-        now_local3 = timezone.localtime()
-        if rng in ('today','day'):
-            start_l = now_local3.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_l = now_local3
-        elif rng in ('7','week'):
-            start_l = now_local3 - timezone.timedelta(days=7)
-            end_l = now_local3
-        elif rng in ('15',):
-            start_l = now_local3 - timezone.timedelta(days=15)
-            end_l = now_local3
-        elif rng in ('60','2m','2mes','2meses'):
-            start_l = now_local3 - timezone.timedelta(days=60)
-            end_l = now_local3
-        else:
-            start_l = now_local3 - timezone.timedelta(days=30)
-            end_l = now_local3
-        ub3 = start_l.astimezone(datetime.timezone.utc)
-        ue3 = end_l.astimezone(datetime.timezone.utc)
-        qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=ub3, end_datetime__lt=ue3)
-        rows3 = list(qs.values('barber').annotate(c=Count('id')).order_by('-c'))
-        counts_map = {r['barber']: int(r.get('c') or 0) for r in rows3}
-        all_barbers = list(User.objects.filter(role=User.BARBER).order_by('display_name', 'username'))
-        def _norm(s):
-            return (s or '').strip().lower()
-        all_barbers = [u for u in all_barbers if _norm(getattr(u, 'display_name', '')) not in {'teste barber','test barber'} and _norm(getattr(u, 'username', '')) not in {'teste','test'}]
-        all_barbers.sort(key=lambda u: counts_map.get(u.id, 0), reverse=True)
-        writer.writerow(['Barbeiro', 'Concluídos'])
-        for u in all_barbers:
-            writer.writerow([getattr(u, 'display_name', None) or getattr(u, 'username', ''), counts_map.get(u.id, 0)])
-
-        if is_special_finances_view and not is_admin:
-            writer.writerow([])
-            writer.writerow(['Retiradas por motivo (últimos 30 dias)'])
-            now4 = timezone.localtime()
-            start4 = now4 - timezone.timedelta(days=30)
-            end4 = now4
-            ub4 = start4.astimezone(datetime.timezone.utc)
-            ue4 = end4.astimezone(datetime.timezone.utc)
-            cats = ['Fornecedores', 'Itens básicos', 'Aluguel Agua/Luz', 'Produtos Freezer', 'Outros']
-            sums = {c: Decimal('0') for c in cats}
-            for w in Withdrawal.objects.filter(created_at__gte=ub4, created_at__lt=ue4):
-                note = (getattr(w, 'note', '') or '')
-                reason = 'Outros'
-                if note.startswith('['):
-                    try:
-                        end_idx = note.find(']')
-                        if end_idx > 1:
-                            tag = note[1:end_idx].strip()
-                            reason = tag if tag in sums else 'Outros'
-                    except Exception:
-                        reason = 'Outros'
-                amt = getattr(w, 'amount', Decimal('0')) or Decimal('0')
-                sums[reason] = (sums.get(reason, Decimal('0')) + amt)
-            ordered = sorted(((c, sums[c]) for c in cats), key=lambda x: x[1], reverse=True)
-            writer.writerow(['Motivo', 'Valor (R$)'])
-            for c,v in ordered:
-                writer.writerow([c, str(v)])
+                start_l = now_local2.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+            end_l = start_l.replace(month=start_l.month + 1) if start_l.month < 12 else start_l.replace(year=start_l.year+1, month=1)
+            apf2 = {}
+            if not (is_admin or is_special_finances_view):
+                apf2['barber'] = user
+            yield ['Serviço', 'Concluídos']
+            for title, c in services_done_counts(load_stats(start_l, end_l, apf2)):
+                yield [title or 'Serviço', c]
+            if services_compare and services_month_compare:
+                yield []
+                yield ['Serviços mais agendados (comparação)']
+                parts = (services_month_compare or '').split('-')
+                try:
+                    year = int(parts[0]) if len(parts)>=1 and parts[0] else now_local2.year
+                    month = int(parts[1]) if len(parts)>=2 and parts[1] else now_local2.month
+                    start_l2 = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local2.tzinfo)
+                except Exception:
+                    start_l2 = now_local2.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+                end_l2 = start_l2.replace(month=start_l2.month + 1) if start_l2.month < 12 else start_l2.replace(year=start_l2.year+1, month=1)
+                yield ['Serviço', 'Concluídos']
+                for title, c in services_done_counts(load_stats(start_l2, end_l2, apf2)):
+                    yield [title or 'Serviço', c]
+
+            yield []
+            yield ['Quantidade de serviços por barbeiro']
+            rng = barber_range
+            now_local3 = timezone.localtime()
+            if rng in ('today','day'):
+                start_l = now_local3.replace(hour=0, minute=0, second=0, microsecond=0)
+                end_l = now_local3
+            elif rng in ('7','week'):
+                start_l = now_local3 - timezone.timedelta(days=7)
+                end_l = now_local3
+            elif rng in ('15',):
+                start_l = now_local3 - timezone.timedelta(days=15)
+                end_l = now_local3
+            elif rng in ('60','2m','2mes','2meses'):
+                start_l = now_local3 - timezone.timedelta(days=60)
+                end_l = now_local3
+            else:
+                start_l = now_local3 - timezone.timedelta(days=30)
+                end_l = now_local3
+            counts_map = barber_done_counts(load_stats(start_l, end_l))
+            all_barbers = list(get_catalog().barbers)
+            def _norm(s):
+                return (s or '').strip().lower()
+            all_barbers = [u for u in all_barbers if _norm(getattr(u, 'display_name', '')) not in {'teste barber','test barber'} and _norm(getattr(u, 'username', '')) not in {'teste','test'}]
+            all_barbers.sort(key=lambda u: counts_map.get(u.id, 0), reverse=True)
+            yield ['Barbeiro', 'Concluídos']
+            for u in all_barbers:
+                yield [getattr(u, 'display_name', None) or getattr(u, 'username', ''), counts_map.get(u.id, 0)]
+
+            if is_special_finances_view and not is_admin:
+                yield []
+                yield ['Retiradas por motivo (últimos 30 dias)']
+                now4 = timezone.localtime()
+                start4 = now4 - timezone.timedelta(days=30)
+                end4 = now4
+                ub4 = start4.astimezone(datetime.timezone.utc)
+                ue4 = end4.astimezone(datetime.timezone.utc)
+                cats = ['Fornecedores', 'Itens básicos', 'Aluguel Agua/Luz', 'Produtos Freezer', 'Outros']
+                sums = {c: Decimal('0') for c in cats}
+                for note, amt in Withdrawal.objects.filter(created_at__gte=ub4, created_at__lt=ue4).values_list('note', 'amount').iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                    note = note or ''
+                    reason = 'Outros'
+                    if note.startswith('['):
+                        try:
+                            end_idx = note.find(']')
+                            if end_idx > 1:
+                                tag = note[1:end_idx].strip()
+                                reason = tag if tag in sums else 'Outros'
+                        except Exception:
+                            reason = 'Outros'
+                    amt = amt or Decimal('0')
+                    sums[reason] = (sums.get(reason, Decimal('0')) + amt)
+                ordered = sorted(((c, sums[c]) for c in cats), key=lambda x: x[1], reverse=True)
+                yield ['Motivo', 'Valor (R$)']
+                for c,v in ordered:
+                    yield [c, str(v)]
 
-        return response
+        return _csv_stream(export_rows(), 'financas_export.csv')
 
     return render(request, 'panel_finances.html', {
         'kpis': kpis,
         'recent_sales': recent_sales,
-        'completed_today': appts_completed_today.order_by('end_datetime'),
+        'completed_today': Appointment.objects.filter(
+            status=Appointment.STATUS_DONE, end_datetime__gte=today_start, end_datetime__lt=today_end, **appts_filter,
+        ).order_by('end_datetime'),
         'is_admin': is_admin,
         'is_special_finances_view': is_special_finances_view,
         'can_withdraw': (not is_admin) and is_special_finances_view,
         'breakdown_by_service': breakdown_by_service,
         'breakdown_by_barber': breakdown_by_barber,
-        'all_services': Service.objects.filter(active=True).order_by('title'),
+        'all_services': get_catalog().active_services(),
     })
 
 
-@login_required
-def finances_chart_data(request: HttpRequest):
-    """Return JSON timeseries for finances chart.
-    Query params:
-      - range: 'day'|'week'|'15'|'30' (default '30')
-      - compare: '1' to include previous-period comparison
-      - include_edited: '1' to include appointments that had updates (AuditLog)
-    """
-    rng = request.GET.get('range', '30')
-    compare = request.GET.get('compare', '0') in ('1', 'true', 'on')
-    include_edited = request.GET.get('include_edited', '0') in ('1', 'true', 'on')
+def _chart_payload(rng, compare, include_edited, appts_filter):
     now_local = timezone.localtime()
 
-    user: User = request.user  # type: ignore
-    is_admin = user.role == User.ADMIN
-    special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
-    is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    appts_filter = {}
-    if not (is_admin or is_special_finances_view):
-        appts_filter['barber'] = user
-
     def mk_range_points(start_local, end_local, granularity='day'):
-        points = []
-        details = {}
-        cur = start_local
-        if granularity == 'hour':
-            step = datetime.timedelta(hours=1)
-            while cur < end_local:
-                nxt = cur + step
-                utc_beg = cur.astimezone(datetime.timezone.utc)
-                utc_end = nxt.astimezone(datetime.timezone.utc)
-                # count done appointments
-                done_qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, start_datetime__gte=utc_beg, start_datetime__lt=utc_end, **appts_filter)
-                done_ids = set(done_qs.values_list('id', flat=True))
-                count_ids = set(done_ids)
-                if include_edited:
-                    edits = AuditLog.objects.filter(action='update', target_type='Appointment', timestamp__gte=utc_beg, timestamp__lt=utc_end)
-                    edit_ids = set()
-                    for t in edits.values_list('target_id', flat=True):
-                        try:
-                            edit_ids.add(int(t))
-                        except Exception:
-                            pass
-                    count_ids |= edit_ids
-                ts = int(cur.astimezone(datetime.timezone.utc).timestamp() * 1000)
-                # prepare list of service titles for this bucket
-                services = list({getattr(a.service, 'title', '') for a in done_qs})
-                details[ts] = services
-                points.append([ts, len(count_ids)])
-                cur = nxt
-            return points, details
-        else:
-            # daily granularity
-            step = datetime.timedelta(days=1)
-            while cur < end_local:
-                nxt = (cur + step)
-                utc_beg = cur.astimezone(datetime.timezone.utc)
-                utc_end = nxt.astimezone(datetime.timezone.utc)
-                done_qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, start_datetime__gte=utc_beg, start_datetime__lt=utc_end, **appts_filter)
-                done_ids = set(done_qs.values_list('id', flat=True))
-                count_ids = set(done_ids)
-                if include_edited:
-                    edits = AuditLog.objects.filter(action='update', target_type='Appointment', timestamp__gte=utc_beg, timestamp__lt=utc_end)
-                    edit_ids = set()
-                    for t in edits.values_list('target_id', flat=True):
-                        try:
-                            edit_ids.add(int(t))
-                        except Exception:
-                            pass
-                    count_ids |= edit_ids
-                ts = int(cur.astimezone(datetime.timezone.utc).timestamp() * 1000)
-                services = list({getattr(a.service, 'title', '') for a in done_qs})
-                details[ts] = services
-                points.append([ts, len(count_ids)])
-                cur = nxt
-            return points, details
+        return done_timeseries(start_local, end_local, granularity, appts_filter, include_edited)
 
     # determine start/end/local and granularity
     if rng == 'day':
@@ -721,180 +665,94 @@ def finances_chart_data(request: HttpRequest):
         })
         out_details['compare'] = details_prev
 
-    return JsonResponse({'series': out_series, 'details': out_details})
+    return {'series': out_series, 'details': out_details}
 
 
 @login_required
-def finances_revenue_data(request: HttpRequest):
+def finances_chart_data(request: HttpRequest):
+    """Return JSON timeseries for finances chart.
+    Query params:
+      - range: 'day'|'week'|'15'|'30' (default '30')
+      - compare: '1' to include previous-period comparison
+      - include_edited: '1' to include appointments that had updates (AuditLog)
+    """
+    rng = request.GET.get('range', '30')
+    compare = request.GET.get('compare', '0') in ('1', 'true', 'on')
+    include_edited = request.GET.get('include_edited', '0') in ('1', 'true', 'on')
+
     user: User = request.user  # type: ignore
     is_admin = user.role == User.ADMIN
     special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
     is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    
-    month_str = (request.GET.get('month') or '').strip()
-    range_str = (request.GET.get('range') or '').strip().lower()
-    
-    now_local = timezone.localtime()
-    
-    # Determine start/end based on params
-    if month_str:
-        try:
-            parts = month_str.split('-')
-            year = int(parts[0]) if len(parts) >= 1 and parts[0] else now_local.year
-            month = int(parts[1]) if len(parts) >= 2 and parts[1] else now_local.month
-            start_local = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local.tzinfo)
-        except Exception:
-            start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        if start_local.month == 12:
-            end_local = start_local.replace(year=start_local.year + 1, month=1)
-        else:
-            end_local = start_local.replace(month=start_local.month + 1)
-    elif range_str:
-        if range_str in ('today', 'day'):
-            start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_local = now_local + datetime.timedelta(days=1)
-        elif range_str in ('7', 'week'):
-            start_local = now_local - timezone.timedelta(days=7)
-            end_local = now_local
-        elif range_str == '15':
-            start_local = now_local - timezone.timedelta(days=15)
-            end_local = now_local
-        elif range_str == '30':
-            start_local = now_local - timezone.timedelta(days=30)
-            end_local = now_local
-        elif range_str == '60':
-            start_local = now_local - timezone.timedelta(days=60)
-            end_local = now_local
-        elif range_str == '90':
-            start_local = now_local - timezone.timedelta(days=90)
-            end_local = now_local
-        else:
-            # Default fallback
-            start_local = now_local - timezone.timedelta(days=30)
-            end_local = now_local
-    else:
-        # Default behavior if nothing provided (current month, or logic before was explicit month required? 
-        # Original code defaulted to month parsing or current month if month_str was empty/invalid)
-        # We will keep default to current month if no range provided
-        start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if start_local.month == 12:
-            end_local = start_local.replace(year=start_local.year + 1, month=1)
-        else:
-            end_local = start_local.replace(month=start_local.month + 1)
-
-    sales_filter = {}
     appts_filter = {}
-    withdraw_filter = {}
     if not (is_admin or is_special_finances_view):
-        sales_filter['barber'] = user
         appts_filter['barber'] = user
-        withdraw_filter['user'] = user
-
-    step = datetime.timedelta(days=1)
-    points = []
-    cur = start_local
-    # Safety break for loop
-    while cur < end_local:
-        nxt = cur + step
-        utc_beg = cur.astimezone(datetime.timezone.utc)
-        utc_end = nxt.astimezone(datetime.timezone.utc)
-        appts_val = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=utc_beg, end_datetime__lt=utc_end, **appts_filter).aggregate(total=Sum('service__price'))['total'] or 0
-        sales_val = Sale.objects.filter(created_at__gte=utc_beg, created_at__lt=utc_end, status='paid', **sales_filter).aggregate(total=Sum('amount'))['total'] or 0
-        withdraw_val = Withdrawal.objects.filter(created_at__gte=utc_beg, created_at__lt=utc_end, **withdraw_filter).aggregate(total=Sum('amount'))['total'] or 0
-        net = (appts_val or 0) + (sales_val or 0) - (withdraw_val or 0)
-        ts = int(cur.astimezone(datetime.timezone.utc).timestamp() * 1000)
-        points.append([ts, float(net)])
-        cur = nxt
-
-    series = [{ 'name': 'Receita líquida', 'data': points }]
-    return JsonResponse({'series': series})
+
+    return JsonResponse(_chart_payload(rng, compare, include_edited, appts_filter))
+
+
+def _revenue_payload(rows, start_local, end_local, granularity):
+    points = revenue_timeseries(rows, start_local, end_local, granularity)
+    return {'series': [{ 'name': 'Receita líquida', 'data': points }]}
 
 
 @login_required
-def finances_services_breakdown_data(request: HttpRequest):
+def finances_revenue_data(request: HttpRequest):
+    """Receita líquida (serviços concluídos + vendas pagas - retiradas) por período.
+    Query params:
+      - month: 'YYYY-MM' | range: 'today'|'7'|'15'|'30'|'60'|'90' (padrão: mês atual)
+      - granularity: 'day'|'week'|'month' (padrão 'day')
+    """
     user: User = request.user  # type: ignore
     is_admin = user.role == User.ADMIN
     special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
     is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    
-    month_str = (request.GET.get('month') or '').strip()
-    range_str = (request.GET.get('range') or '').strip().lower()
-    
-    now_local = timezone.localtime()
-    
-    if month_str:
-        try:
-            parts = month_str.split('-')
-            year = int(parts[0]) if len(parts) >= 1 and parts[0] else now_local.year
-            month = int(parts[1]) if len(parts) >= 2 and parts[1] else now_local.month
-            start_local = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local.tzinfo)
-        except Exception:
-            start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        
-        if start_local.month == 12:
-            end_local = start_local.replace(year=start_local.year + 1, month=1)
-        else:
-            end_local = start_local.replace(month=start_local.month + 1)
-    elif range_str:
-        if range_str in ('today', 'day'):
-            start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_local = now_local + datetime.timedelta(days=1)
-        elif range_str in ('7', 'week'):
-            start_local = now_local - timezone.timedelta(days=7)
-            end_local = now_local
-        elif range_str == '15':
-            start_local = now_local - timezone.timedelta(days=15)
-            end_local = now_local
-        elif range_str == '30':
-            start_local = now_local - timezone.timedelta(days=30)
-            end_local = now_local
-        elif range_str == '60':
-            start_local = now_local - timezone.timedelta(days=60)
-            end_local = now_local
-        elif range_str == '90':
-            start_local = now_local - timezone.timedelta(days=90)
-            end_local = now_local
-        else:
-            start_local = now_local - timezone.timedelta(days=30)
-            end_local = now_local
-    else:
-        start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if start_local.month == 12:
-            end_local = start_local.replace(year=start_local.year + 1, month=1)
-        else:
-            end_local = start_local.replace(month=start_local.month + 1)
 
-    appts_filter = {}
+    start_local, end_local = parse_period(request.GET.get('month'), request.GET.get('range'))
+    granularity = (request.GET.get('granularity') or 'day').strip().lower()
+    if granularity not in ('day', 'week', 'month'):
+        granularity = 'day'
+
+    stats_filter = {}
     if not (is_admin or is_special_finances_view):
-        appts_filter['barber'] = user
+        stats_filter['barber'] = user
+
+    rows = load_stats(start_local, end_local, stats_filter)
+    return JsonResponse(_revenue_payload(rows, start_local, end_local, granularity))
 
-    utc_beg = start_local.astimezone(datetime.timezone.utc)
-    utc_end = end_local.astimezone(datetime.timezone.utc)
 
-    qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=utc_beg, end_datetime__lt=utc_end, **appts_filter)
-    rows = qs.values('service__title').annotate(c=Count('id')).order_by('-c')
+def _services_payload(rows):
     labels = []
     series = []
-    for r in rows:
-        title = r['service__title'] or 'Serviço'
-        labels.append(title)
-        series.append(int(r['c'] or 0))
+    for title, c in services_done_counts(rows):
+        labels.append(title or 'Serviço')
+        series.append(c)
 
     if not labels:
         labels = ['Sem registros']
         series = [0]
 
-    return JsonResponse({'labels': labels, 'series': series})
+    return {'labels': labels, 'series': series}
+
 
 @login_required
-def finances_withdrawals_funnel_data(request: HttpRequest):
+def finances_services_breakdown_data(request: HttpRequest):
     user: User = request.user  # type: ignore
     is_admin = user.role == User.ADMIN
     special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
     is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    if not is_special_finances_view or is_admin:
-        return JsonResponse({'labels': [], 'series': []})
+
+    start_local, end_local = parse_period(request.GET.get('month'), request.GET.get('range'))
+
+    stats_filter = {}
+    if not (is_admin or is_special_finances_view):
+        stats_filter['barber'] = user
+
+    rows = load_stats(start_local, end_local, stats_filter)
+    return JsonResponse(_services_payload(rows))
+
+
+def _withdrawals_funnel_payload():
     now_local = timezone.localtime()
     start_local = now_local - timezone.timedelta(days=30)
     end_local = now_local
@@ -923,98 +781,68 @@ def finances_withdrawals_funnel_data(request: HttpRequest):
     ordered = sorted(sums.items(), key=lambda x: x[1], reverse=True)
     labels = [k for k,v in ordered]
     series = [float(v) for k,v in ordered]
-    return JsonResponse({'labels': labels, 'series': series})
+    return {'labels': labels, 'series': series}
+
 
 @login_required
-def finances_no_show_rate_data(request: HttpRequest):
+def finances_withdrawals_funnel_data(request: HttpRequest):
     user: User = request.user  # type: ignore
     is_admin = user.role == User.ADMIN
     special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
     is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    # Visão padrão: últimos 30 dias
-    now_local = timezone.localtime()
-    start_local = now_local - timezone.timedelta(days=30)
-    end_local = now_local
-    step = timezone.timedelta(days=1)
+    if not is_special_finances_view or is_admin:
+        return JsonResponse({'labels': [], 'series': []})
+    return JsonResponse(_withdrawals_funnel_payload())
 
-    labels = []
-    done_rates = []
-    cancel_rates = []
-
-    cur = start_local
-    while cur < end_local:
-        nxt = cur + step
-        utc_beg = cur.astimezone(datetime.timezone.utc)
-        utc_end = nxt.astimezone(datetime.timezone.utc)
-        # concluir por fim do serviço no dia
-        done_qs = Appointment.objects.filter(status=Appointment.STATUS_DONE, end_datetime__gte=utc_beg, end_datetime__lt=utc_end)
-        # cancelados considerados pelo início dentro do dia
-        cancel_qs = Appointment.objects.filter(status=Appointment.STATUS_CANCELLED, start_datetime__gte=utc_beg, start_datetime__lt=utc_end)
-        total = done_qs.count() + cancel_qs.count()
-        dr = float((done_qs.count() / total) * 100) if total else 0.0
-        cr = float((cancel_qs.count() / total) * 100) if total else 0.0
-        labels.append(timezone.localtime(cur).strftime('%d/%m'))
-        done_rates.append(round(dr, 2))
-        cancel_rates.append(round(cr, 2))
-        cur = nxt
 
-    return JsonResponse({
+def _no_show_payload(rows, start_local, end_local, by_barber):
+    labels, done_rates, cancel_rates, barbers = status_rate_timeseries(rows, start_local, end_local, by_barber)
+    data = {
         'labels': labels,
         'series': {
             'done_rate': done_rates,
             'cancel_rate': cancel_rates,
         }
-    })
+    }
+    if by_barber:
+        data['barbers'] = barbers
+    return data
+
 
 @login_required
-def finances_barber_stats_data(request: HttpRequest):
+def finances_no_show_rate_data(request: HttpRequest):
+    """Taxa diária de concluídos x cancelados.
+    Query params:
+      - month: 'YYYY-MM' | range: 'today'|'7'|'15'|'30'|'60'|'90' (padrão: últimos 30 dias)
+      - barberId: restringe a um barbeiro (admin/Kaue/Alafy)
+      - breakdown: 'barber' para incluir as taxas por barbeiro
+    """
     user: User = request.user  # type: ignore
     is_admin = user.role == User.ADMIN
     special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
     is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    rng = (request.GET.get('range') or '').strip().lower()
-    now_local = timezone.localtime()
-    month_param = (request.GET.get('month') or '').strip()
-    if month_param:
-        try:
-            parts = month_param.split('-')
-            year = int(parts[0]) if len(parts) >= 1 and parts[0] else now_local.year
-            month = int(parts[1]) if len(parts) >= 2 and parts[1] else now_local.month
-            start_local = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local.tzinfo)
-        except Exception:
-            start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        if start_local.month == 12:
-            end_local = start_local.replace(year=start_local.year + 1, month=1)
-        else:
-            end_local = start_local.replace(month=start_local.month + 1)
-    elif rng in ('today', 'day'):
-        start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-        end_local = now_local
-    elif rng in ('7', 'week'):
-        start_local = now_local - timezone.timedelta(days=7)
-        end_local = now_local
-    elif rng in ('15',):
-        start_local = now_local - timezone.timedelta(days=15)
-        end_local = now_local
-    elif rng in ('60', '2m', '2meses', '2mes'):
-        start_local = now_local - timezone.timedelta(days=60)
-        end_local = now_local
+
+    month_str = (request.GET.get('month') or '').strip()
+    range_str = (request.GET.get('range') or '').strip().lower()
+    if not month_str and not range_str:
+        range_str = '30'
+    start_local, end_local = parse_period(month_str, range_str)
+
+    stats_filter = {}
+    if not (is_admin or is_special_finances_view):
+        stats_filter['barber'] = user
     else:
-        start_local = now_local - timezone.timedelta(days=30)
-        end_local = now_local
+        barber_id = (request.GET.get('barberId') or '').strip()
+        if barber_id.isdigit():
+            stats_filter['barber_id'] = int(barber_id)
+    by_barber = (request.GET.get('breakdown') or '').strip().lower() == 'barber'
 
-    utc_beg = start_local.astimezone(datetime.timezone.utc)
-    utc_end = end_local.astimezone(datetime.timezone.utc)
+    rows = load_stats(start_local, end_local, stats_filter)
+    return JsonResponse(_no_show_payload(rows, start_local, end_local, by_barber))
 
-    qs = Appointment.objects.filter(
-        status=Appointment.STATUS_DONE,
-        end_datetime__gte=utc_beg,
-        end_datetime__lt=utc_end,
-    )
 
-    rows = list(qs.values('barber').annotate(c=Count('id')).order_by('-c'))
-    counts_map = {r['barber']: int(r.get('c') or 0) for r in rows}
-    all_barbers = list(User.objects.filter(role=User.BARBER).order_by('display_name', 'username'))
+def _barber_stats_payload(counts_map):
+    all_barbers = list(get_catalog().barbers)
     excluded_labels = {'teste barber', 'test barber'}
     excluded_users = {'teste', 'test'}
     def _norm(s):
@@ -1065,72 +893,55 @@ def finances_barber_stats_data(request: HttpRequest):
         series.append(c)
         barbers.append({'id': u.id, 'name': name, 'avatar_url': avatar_url, 'count': c})
 
-    return JsonResponse({'labels': labels, 'series': series, 'barbers': barbers})
+    return {'labels': labels, 'series': series, 'barbers': barbers}
+
 
 @login_required
-def finances_clients_top_data(request: HttpRequest):
-    user: User = request.user  # type: ignore
-    is_admin = user.role == User.ADMIN
-    special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
-    is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
-    
-    month_str = (request.GET.get('month') or '').strip()
-    range_str = (request.GET.get('range') or '').strip().lower()
-    
+def finances_barber_stats_data(request: HttpRequest):
+    rng = (request.GET.get('range') or '').strip().lower()
     now_local = timezone.localtime()
-    start_local = None
-    end_local = None
-
-    if month_str:
+    month_param = (request.GET.get('month') or '').strip()
+    if month_param:
         try:
-            parts = month_str.split('-')
+            parts = month_param.split('-')
             year = int(parts[0]) if len(parts) >= 1 and parts[0] else now_local.year
             month = int(parts[1]) if len(parts) >= 2 and parts[1] else now_local.month
             start_local = datetime.datetime(year=year, month=month, day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=now_local.tzinfo)
         except Exception:
-            pass
-        
-        if start_local:
-            if start_local.month == 12:
-                end_local = start_local.replace(year=start_local.year + 1, month=1)
-            else:
-                end_local = start_local.replace(month=start_local.month + 1)
-    elif range_str:
-        if range_str in ('today', 'day'):
-            start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
-            end_local = now_local + datetime.timedelta(days=1)
-        elif range_str in ('7', 'week'):
-            start_local = now_local - timezone.timedelta(days=7)
-            end_local = now_local
-        elif range_str == '15':
-            start_local = now_local - timezone.timedelta(days=15)
-            end_local = now_local
-        elif range_str == '30':
-            start_local = now_local - timezone.timedelta(days=30)
-            end_local = now_local
-        elif range_str == '60':
-            start_local = now_local - timezone.timedelta(days=60)
-            end_local = now_local
-        elif range_str == '90':
-            start_local = now_local - timezone.timedelta(days=90)
-            end_local = now_local
+            start_local = now_local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if start_local.month == 12:
+            end_local = start_local.replace(year=start_local.year + 1, month=1)
+        else:
+            end_local = start_local.replace(month=start_local.month + 1)
+    elif rng in ('today', 'day'):
+        start_local = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+        end_local = now_local
+    elif rng in ('7', 'week'):
+        start_local = now_local - timezone.timedelta(days=7)
+        end_local = now_local
+    elif rng in ('15',):
+        start_local = now_local - timezone.timedelta(days=15)
+        end_local = now_local
+    elif rng in ('60', '2m', '2meses', '2mes'):
+        start_local = now_local - timezone.timedelta(days=60)
+        end_local = now_local
+    else:
+        start_local = now_local - timezone.timedelta(days=30)
+        end_local = now_local
 
-    # If no filter is applied, defaults to ALL time (original behavior)
-    # BUT the user asked to add the filter, so usually we want to respect the filter if provided.
-    # If no filter provided, maybe we should default to '30 days' or 'all time'?
-    # The original code did `Appointment.objects.all()`.
-    # Let's keep it as "All Time" if no filter is provided, to preserve original behavior when page loads initially if we don't change the default JS param.
-    # However, I will change JS to send a default.
-    
-    qs = Appointment.objects.all().order_by('start_datetime')
+    counts_map = barber_done_counts(load_stats(start_local, end_local))
+    return JsonResponse(_barber_stats_payload(counts_map))
+
+
+def _clients_top_payload(start_local, end_local, appts_filter):
+    # Status gravado, como o resumo diário dos demais gráficos financeiros
+    qs = Appointment.objects.filter(**appts_filter).order_by('start_datetime')
     
     if start_local and end_local:
         utc_beg = start_local.astimezone(datetime.timezone.utc)
         utc_end = end_local.astimezone(datetime.timezone.utc)
         qs = qs.filter(start_datetime__gte=utc_beg, start_datetime__lt=utc_end)
 
-    if not (is_admin or is_special_finances_view):
-        qs = qs.filter(barber=user)
     clients = {}
     for a in qs:
         phone = ''.join(ch for ch in (a.client_phone or '') if ch.isdigit())
@@ -1151,10 +962,11 @@ def finances_clients_top_data(request: HttpRequest):
     items = [ (v['name'] or 'Cliente', int(v['count_done'] or 0)) for v in clients.values() if (int(v.get('count_done', 0)) > 0) ]
     items.sort(key=lambda x: x[1], reverse=True)
     top = items[:20]
-    return JsonResponse({ 'data': top })
+    return { 'data': top }
+
 
 @login_required
-def finances_occupancy_buckets_data(request: HttpRequest):
+def finances_clients_top_data(request: HttpRequest):
     user: User = request.user  # type: ignore
     is_admin = user.role == User.ADMIN
     special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
@@ -1200,62 +1012,141 @@ def finances_occupancy_buckets_data(request: HttpRequest):
         elif range_str == '90':
             start_local = now_local - timezone.timedelta(days=90)
             end_local = now_local
-            
-    if not start_local:
-        start_local = now_local - timezone.timedelta(days=30)
-        end_local = now_local
 
-    utc_beg = start_local.astimezone(datetime.timezone.utc)
-    utc_end = end_local.astimezone(datetime.timezone.utc)
-
-    appts_filter = { 'status': Appointment.STATUS_DONE, 'start_datetime__gte': utc_beg, 'start_datetime__lt': utc_end }
+    # If no filter is applied, defaults to ALL time (original behavior)
+    appts_filter = {}
     if not (is_admin or is_special_finances_view):
         appts_filter['barber'] = user
-    qs = Appointment.objects.filter(**appts_filter).select_related('service')
+    return JsonResponse(_clients_top_payload(start_local, end_local, appts_filter))
+
+
+def _occupancy_payload(rows):
+    hours = done_by_hour(rows)
     buckets = [(8,10),(10,12),(12,14),(14,16),(16,18),(18,20)]
     counts = { f"{str(a).zfill(2)}–{str(b).zfill(2)}": 0 for a,b in buckets }
-    for a in qs:
-        h = timezone.localtime(a.start_datetime).hour
+    for h, c in hours.items():
         for beg,end in buckets:
             if h >= beg and h < end:
                 label = f"{str(beg).zfill(2)}–{str(end).zfill(2)}"
-                counts[label] = counts.get(label, 0) + 1
+                counts[label] = counts.get(label, 0) + c
                 break
     data = [{ 'name': label, 'y': counts[label] } for label in counts.keys()]
-    return JsonResponse({ 'data': data })
+    return { 'data': data }
+
 
 @login_required
-def panel_clients(request: HttpRequest):
-    qs = Appointment.objects.all().order_by('start_datetime')
+def finances_occupancy_buckets_data(request: HttpRequest):
+    user: User = request.user  # type: ignore
+    is_admin = user.role == User.ADMIN
+    special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
+    is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
+
+    month_str = (request.GET.get('month') or '').strip()
+    range_str = (request.GET.get('range') or '').strip().lower()
+    if not month_str and not range_str:
+        range_str = '30'
+    start_local, end_local = parse_period(month_str, range_str)
+
+    stats_filter = {}
+    if not (is_admin or is_special_finances_view):
+        stats_filter['barber'] = user
+    rows = load_stats(start_local, end_local, stats_filter)
+    return JsonResponse(_occupancy_payload(rows))
+
+
+@login_required
+def finances_bundle_data(request: HttpRequest):
+    """Todos os gráficos do painel financeiro em um único JSON (carga inicial da página).
+    Query params:
+      - month: 'YYYY-MM' | range: 'today'|'7'|'15'|'30'|'60'|'90' (padrão: últimos 30 dias)
+      - chart_range, compare, include_edited: como em chart-data (chart_range segue range)
+      - granularity: como em revenue-data
+      - barberId, breakdown: como em no-show-rate
+    O resumo diário do período é lido uma vez e reaproveitado por todos os gráficos.
+    """
+    user: User = request.user  # type: ignore
+    is_admin = user.role == User.ADMIN
+    special_full_access_usernames = {"kaue", "alafy", "alafi", "alefi"}
+    is_special_finances_view = str(getattr(user, 'username', '')).lower() in special_full_access_usernames
+    full_access = is_admin or is_special_finances_view
+
+    month_str = (request.GET.get('month') or '').strip()
+    range_str = (request.GET.get('range') or '').strip().lower()
+    if not month_str and not range_str:
+        range_str = '30'
+    start_local, end_local = parse_period(month_str, range_str)
+
+    chart_range = (request.GET.get('chart_range') or '').strip().lower()
+    if not chart_range:
+        chart_range = {'today': 'day', 'day': 'day', '7': 'week', 'week': 'week', '15': '15'}.get(range_str, '30')
+    compare = request.GET.get('compare', '0') in ('1', 'true', 'on')
+    include_edited = request.GET.get('include_edited', '0') in ('1', 'true', 'on')
+    granularity = (request.GET.get('granularity') or 'day').strip().lower()
+    if granularity not in ('day', 'week', 'month'):
+        granularity = 'day'
+    by_barber = (request.GET.get('breakdown') or '').strip().lower() == 'barber'
+
+    # Todos os barbeiros (ranking); os demais gráficos usam só as linhas do usuário
+    rows = load_stats(start_local, end_local)
+    appts_filter = {}
+    own_rows = rows
+    no_show_rows = rows
+    if not full_access:
+        appts_filter['barber'] = user
+        own_rows = rows_for_barber(rows, user.id)
+        no_show_rows = own_rows
+    else:
+        barber_id = (request.GET.get('barberId') or '').strip()
+        if barber_id.isdigit():
+            no_show_rows = rows_for_barber(rows, int(barber_id))
+
+    if is_special_finances_view and not is_admin:
+        funnel = _withdrawals_funnel_payload()
+    else:
+        funnel = {'labels': [], 'series': []}
+
+    return JsonResponse({
+        'chart': _chart_payload(chart_range, compare, include_edited, appts_filter),
+        'revenue': _revenue_payload(own_rows, start_local, end_local, granularity),
+        'services': _services_payload(own_rows),
+        'barber_stats': _barber_stats_payload(barber_done_counts(rows)),
+        'withdrawals_funnel': funnel,
+        'no_show': _no_show_payload(no_show_rows, start_local, end_local, by_barber),
+        'clients_top': _clients_top_payload(start_local, end_local, appts_filter),
+        'occupancy': _occupancy_payload(own_rows),
+    })
+
+
+def _client_summaries():
+    """Agrega os agendamentos por telefone (só dígitos) numa passada pelo cursor.
+
+    Guarda apenas contadores por cliente, não os agendamentos; o nome é o do
+    agendamento mais recente.
+    """
     clients = {}
-    for a in qs:
-        phone = ''.join(ch for ch in (a.client_phone or '') if ch.isdigit())
+    rows = Appointment.objects.with_effective_status().order_by('start_datetime').values_list(
+        'client_name', 'client_phone', 'start_datetime', 'end_datetime', 'effective_status', 'service__price',
+    )
+    for name, raw_phone, start, end, status, price in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        phone = ''.join(ch for ch in (raw_phone or '') if ch.isdigit())
         if not phone:
             continue
-        entry = clients.get(phone) or {
-            'phone': phone,
-            'name': a.client_name or '',
-            'visits': [],
-            'done': [],
-            'cancel': [],
-            'total_spent': Decimal('0'),
-        }
-        entry['name'] = a.client_name or entry['name']
-        entry['visits'].append(a)
-        if a.status == Appointment.STATUS_DONE:
-            entry['done'].append(a)
-            price = getattr(getattr(a, 'service', None), 'price', Decimal('0')) or Decimal('0')
-            entry['total_spent'] = (entry['total_spent'] + Decimal(str(price)))
-        if a.status == Appointment.STATUS_CANCELLED:
-            entry['cancel'].append(a)
-        clients[phone] = entry
+        entry = clients.get(phone)
+        if entry is None:
+            entry = clients[phone] = {'name': '', 'first': None, 'last': None, 'count_done': 0, 'total_spent': Decimal('0')}
+        entry['name'] = name or entry['name']
+        if status == Appointment.STATUS_DONE:
+            visit = end or start
+            entry['count_done'] += 1
+            entry['total_spent'] += Decimal(str(price or 0))
+            if entry['first'] is None or visit < entry['first']:
+                entry['first'] = visit
+            if entry['last'] is None or visit > entry['last']:
+                entry['last'] = visit
 
     data = []
     for phone, entry in clients.items():
-        done_sorted = sorted(entry['done'], key=lambda x: x.end_datetime or x.start_datetime)
-        last_visit = done_sorted[-1].end_datetime if done_sorted else None
-        first_visit = done_sorted[0].end_datetime if done_sorted else None
-        count_done = len(done_sorted)
+        first_visit, last_visit, count_done = entry['first'], entry['last'], entry['count_done']
         freq_label = ''
         if count_done >= 3 and first_visit and last_visit:
             span_days = max(1, int((last_visit - first_visit).total_seconds() // 86400))
@@ -1275,7 +1166,18 @@ def panel_clients(request: HttpRequest):
             'count_done': count_done,
             'freq_label': freq_label,
         })
+    return data
+
+
+CLIENT_EXPORTS = {
+    'all': ('clientes_all.csv', ['Nome', 'Telefone', 'UltimaVisita', 'TotalGasto', 'VisitasConcluidas', 'Frequencia']),
+    'name_phone': ('clientes_nome_telefone.csv', ['Nome', 'Telefone']),
+    'phone': ('clientes_telefone.csv', ['Telefone']),
+}
 
+
+@login_required
+def panel_clients(request: HttpRequest):
     export = (request.GET.get('export') or '').strip()
     if export:
         user = request.user
@@ -1284,29 +1186,25 @@ def panel_clients(request: HttpRequest):
         if not (is_admin or special):
             return HttpResponseForbidden("Sem permissão para exportar.")
 
-        response = HttpResponse(content_type='text/csv')
-        if export == 'all':
-            response['Content-Disposition'] = 'attachment; filename="clientes_all.csv"'
-            writer = csv.writer(response)
-            writer.writerow(['Nome', 'Telefone', 'UltimaVisita', 'TotalGasto', 'VisitasConcluidas', 'Frequencia'])
-            for c in data:
-                lv = timezone.localtime(c['last_visit']).strftime('%Y-%m-%d %H:%M') if c['last_visit'] else ''
-                writer.writerow([c['name'], c['phone'], lv, str(c['total_spent']), c['count_done'], c['freq_label']])
-            return response
-        if export == 'name_phone':
-            response['Content-Disposition'] = 'attachment; filename="clientes_nome_telefone.csv"'
-            writer = csv.writer(response)
-            writer.writerow(['Nome', 'Telefone'])
-            for c in data:
-                writer.writerow([c['name'], c['phone']])
-            return response
-        if export == 'phone':
-            response['Content-Disposition'] = 'attachment; filename="clientes_telefone.csv"'
-            writer = csv.writer(response)
-            writer.writerow(['Telefone'])
-            for c in data:
-                writer.writerow([c['phone']])
-            return response
+    if export in CLIENT_EXPORTS:
+        filename, header = CLIENT_EXPORTS[export]
+        tz = timezone.get_current_timezone()
+
+        def export_rows():
+            # A agregação roda dentro do stream: os cabeçalhos HTTP saem na hora
+            yield header
+            for c in _client_summaries():
+                if export == 'all':
+                    lv = c['last_visit'].astimezone(tz).strftime('%Y-%m-%d %H:%M') if c['last_visit'] else ''
+                    yield [c['name'], c['phone'], lv, str(c['total_spent']), c['count_done'], c['freq_label']]
+                elif export == 'name_phone':
+                    yield [c['name'], c['phone']]
+                else:
+                    yield [c['phone']]
+
+        return _csv_stream(export_rows(), filename, content_type='text/csv')
+
+    data = _client_summaries()
 
     sort = (request.GET.get('sort') or '').strip()
     if sort == 'a_z':
@@ -1491,7 +1389,7 @@ def panel_profile(request: HttpRequest):
     # Lista de barbeiros para seleção no template (apenas para especiais)
     barbers_list = []
     if can_block_all:
-        barbers_list = list(User.objects.filter(role=User.BARBER).order_by('display_name', 'username'))
+        barbers_list = list(get_catalog().barbers)
     return render(request, 'panel_profile.html', {
         'message': message,
         'message_type': message_type,